@@ -1,13 +1,43 @@
-from fastapi import FastAPI, Request, Form, File, UploadFile
+import time
+IMPORT_STARTED = time.perf_counter()
+from fastapi import FastAPI, Request, Form, File, UploadFile, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 import pandas as pd
-import io
+import numpy as np
 import base64
 from io import BytesIO
-import matplotlib.pyplot as plt
-import seaborn as sns
 from typing import Optional
+import os
+import uuid
+import asyncio
+import sys
+
+# Profiling, the dataset store, request timing and upload parsing are shared
+# with the SQL editor (uniq_shared/ at the repository root)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from uniq_shared.lazy import LazyModule, lazy_import_seconds, use_headless_backend
+from uniq_shared.profiling import PROFILE_PROCESSES, ProfileBuilder, get_profile_executor, profile_answer, profile_chunk
+from uniq_shared.store import (DATASET_MAX_COUNT, DATASET_MEMORY_BUDGET_MB, DATASET_SPILL_DIR, DATASET_STORE_DIR,
+                               DatasetRegistry)
+from uniq_shared.timing import add_timing_middleware, metrics_text, record_rows, timed
+from uniq_shared.uploads import (UPLOAD_MEMORY_LIMIT_MB, iter_upload_frames, publish_progress, shared_progress,
+                                 start_upload_progress, update_upload_progress, upload_progress)
+
+# The plotting stack takes most of the import time, so it is imported on first use
+plt = LazyModule("matplotlib.pyplot", setup=use_headless_backend)
+sns = LazyModule("seaborn", setup=use_headless_backend)
+
+# Startup timings reported on /health and /metrics
+WARMUP = os.getenv("WARMUP", "0") == "1"
+startup_state = {
+    "importSeconds": None,
+    "warmup": "pending" if WARMUP else "off",
+    "warmupSeconds": None,
+    "firstResponseSeconds": None,
+}
 
 app = FastAPI()
 
@@ -17,10 +47,97 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Setup templates
 templates = Jinja2Templates(directory="templates")
 
-# In-memory storage for the dataset
-current_dataset = None
-current_dataset_name = ""
+# Request timing: Server-Timing header and the histograms served on /metrics
+add_timing_middleware(app, startup_state, IMPORT_STARTED)
+
+def parse_upload(file, upload_id):
+    """Parse and profile the upload chunk by chunk, keeping at most UPLOAD_MEMORY_LIMIT_MB in memory"""
+    progress = start_upload_progress(upload_id, file.filename, file.size)
+    
+    retained = []
+    retained_bytes = 0
+    rows = 0
+    sampled = False
+    profiler = ProfileBuilder(get_profile_executor())
+    try:
+        frames = iter_upload_frames(file)
+        while True:
+            with timed("parse"):
+                chunk = next(frames, None)
+            if chunk is None:
+                break
+            rows += len(chunk)
+            with timed("profile"):
+                profiler.add(chunk)
+            if not sampled:
+                chunk_bytes = int(chunk.memory_usage(deep=True).sum())
+                if not retained or retained_bytes + chunk_bytes <= UPLOAD_MEMORY_LIMIT_MB * 1024 * 1024:
+                    retained.append(chunk)
+                    retained_bytes += chunk_bytes
+                else:
+                    sampled = True
+            update_upload_progress(progress, file, rows)
+    except Exception:
+        progress["status"] = "failed"
+        publish_progress(progress)
+        raise
+    if not retained:
+        progress["status"] = "failed"
+        publish_progress(progress)
+        raise ValueError("No data found in file")
+    df = pd.concat(retained, ignore_index=True) if len(retained) > 1 else retained[0]
+    with timed("profile"):
+        profile = profiler.finish(df, sampled)
+    record_rows(rows)
+    progress["status"] = "done"
+    publish_progress(progress)
+    return df, profile, rows, sampled
+
+# Browsers remember their last upload in this cookie
+DATASET_COOKIE = "uniq_dataset"
 
+datasets = DatasetRegistry(DATASET_MEMORY_BUDGET_MB * 1024 * 1024, DATASET_STORE_DIR,
+                           DATASET_SPILL_DIR, DATASET_MAX_COUNT)
+datasets.load_store()
+
+def columns_for_action(schema, action, column=None):
+    """Columns an /analyze action reads, or None when it needs the whole frame"""
+    if action in ("histogram", "boxplot", "value_counts") and column in schema.columns:
+        return [column]
+    if action == "scatter" and column in schema.columns and len(schema.columns) > 1:
+        y_col = schema.columns[1] if column == schema.columns[0] else schema.columns[0]
+        return [column, y_col]
+    if action == "correlation":
+        return schema.select_dtypes(include=['number']).columns.tolist()
+    return None
+
+def resolve_dataset(request, dataset_id=None):
+    """Pick the dataset for a request: explicit id, then this browser's last upload, then the latest upload"""
+    if dataset_id:
+        return datasets.get(dataset_id)
+    session_id = request.cookies.get(DATASET_COOKIE)
+    entry = datasets.get(session_id) if session_id else None
+    return entry or datasets.get()
+
+CHART_ACTIONS = ("histogram", "boxplot", "scatter", "correlation")
+
+def compute_analysis(df, action, column=None):
+    """Table and statistics actions of /analyze"""
+    if action == "summary":
+        return df.describe(include='all').to_html()
+    if action == "head":
+        return df.head().to_html()
+    if action == "columns":
+        return list(df.columns)
+    if action == "missing":
+        return df.isna().sum().to_dict()
+    if action == "dtypes":
+        return df.dtypes.astype(str).to_dict()
+    if action == "value_counts":
+        return df[column].value_counts().to_dict()
+    raise ValueError(f"Unknown analysis action: {action}")
+
+@timed("encode")
 def fig_to_uri(fig):
     """Convert matplotlib figure to base64 encoded image"""
     buf = BytesIO()
@@ -28,100 +145,290 @@ def fig_to_uri(fig):
     buf.seek(0)
     return "data:image/png;base64," + base64.b64encode(buf.read()).decode('utf-8')
 
+# Opt-in warm-up (WARMUP=1): import the plotting stack and prime matplotlib's
+# font cache and pandas' formatters before /health reports the worker ready
+def warm_plotting():
+    sample = pd.DataFrame({"x": range(200), "y": [i % 7 for i in range(200)]})
+    sample.describe(include='all').to_html()
+    plt.figure()
+    sample["x"].hist()
+    plt.title("warm-up")
+    fig_to_uri(plt.gcf())
+    plt.close()
+    sns.boxplot(y=sample["y"])
+    plt.close()
+
+
+def warm_profiling():
+    # Start every profile process now, so the first large upload does not wait for their imports
+    executor = get_profile_executor()
+    if executor is not None:
+        sample = pd.DataFrame({"x": np.arange(200.0), "c": ["a", "b"] * 100})
+        for future in [executor.submit(profile_chunk, sample) for _ in range(PROFILE_PROCESSES)]:
+            future.result()
+
+
+async def warm_up():
+    startup_state["warmup"] = "running"
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(run_in_threadpool(warm_plotting), run_in_threadpool(warm_profiling))
+        startup_state["warmup"] = "done"
+    except Exception:
+        startup_state["warmup"] = "failed"
+    startup_state["warmupSeconds"] = round(time.perf_counter() - started, 3)
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    if WARMUP:
+        asyncio.get_running_loop().create_task(warm_up())
+
+
+@app.on_event("shutdown")
+def remove_spill_files():
+    datasets.close()
+
+
+@app.get("/health")
+async def health_check():
+    startup = {**startup_state, "lazyImports": dict(lazy_import_seconds)}
+    if startup_state["warmup"] in ("pending", "running"):
+        return JSONResponse({"status": "warming", "startup": startup}, status_code=503)
+    return {"status": "healthy", "startup": startup, "datasets": datasets.stats()}
+
 @app.get("/")
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 @app.post("/upload")
-async def upload_dataset(file: UploadFile = File(...)):
-    global current_dataset, current_dataset_name
+async def upload_dataset(response: Response, file: UploadFile = File(...), upload_id: Optional[str] = None):
     try:
         # Get file extension
         filename = file.filename
-        current_dataset_name = filename
-        if filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(await file.read()))
-        elif filename.endswith('.xlsx') or filename.endswith('.xls'):
-            df = pd.read_excel(io.BytesIO(await file.read()))
-        else:
+        if not (filename.endswith('.csv') or filename.endswith('.xlsx') or filename.endswith('.xls')):
             return {"error": "Unsupported file format. Please upload CSV or Excel file."}
         
-        current_dataset = df
+        upload_id = upload_id or uuid.uuid4().hex
+        df, profile, rows, sampled = await run_in_threadpool(parse_upload, file, upload_id)
+        
+        with timed("store"):
+            entry = await run_in_threadpool(datasets.add, filename, df, profile, sampled)
+        # Later /analyze calls from this browser default to this dataset
+        response.set_cookie(DATASET_COOKIE, entry.id, httponly=True, samesite="lax")
         return {
             "message": "Dataset uploaded successfully", 
-            "shape": df.shape,
+            "uploadId": upload_id,
+            "datasetId": entry.id,
+            "shape": [rows, df.shape[1]],
             "columns": list(df.columns),
-            "dtypes": df.dtypes.astype(str).to_dict()
+            "dtypes": df.dtypes.astype(str).to_dict(),
+            "inMemoryRows": len(df),
+            "sampled": sampled
         }
     except Exception as e:
         return {"error": f"Could not read file: {str(e)}"}
 
+@app.get("/upload-progress/{upload_id}")
+async def get_upload_progress(upload_id: str):
+    progress = upload_progress.get(upload_id) or shared_progress(upload_id)
+    if progress is None:
+        return {"error": "Unknown upload id"}
+    return progress
+
 @app.get("/analyze")
-async def analyze_dataset(action: str, column: str = None):
-    global current_dataset
-    
-    if current_dataset is None:
+async def analyze_dataset(request: Request, action: str, column: str = None, dataset_id: Optional[str] = None):
+    entry = resolve_dataset(request, dataset_id)
+    if entry is None:
+        if dataset_id:
+            return {"error": f"Dataset '{dataset_id}' not found"}
         return {"error": "No dataset uploaded"}
     
     try:
-        df = current_dataset
+        # Basic Analysis, answered from the upload-time profile when possible
+        profile_result = profile_answer(entry.profile, action, column)
+        if profile_result is not None:
+            return {"result": profile_result}
         
-        # Basic Analysis
-        if action == "summary":
-            result = df.describe(include='all').to_html()
-        elif action == "head":
-            result = df.head().to_html()
-        elif action == "columns":
-            result = list(df.columns)
-        elif action == "missing":
-            result = df.isna().sum().to_dict()
-        elif action == "dtypes":
-            result = df.dtypes.astype(str).to_dict()
+        # The correlation matrix is accumulated over every row while the upload is parsed
+        corr_data = (entry.profile or {}).get("correlation") if action == "correlation" else None
         
-        # Visualization with Matplotlib
-        elif action == "histogram" and column:
-            plt.figure()
-            df[column].hist()
-            plt.title(f"Histogram of {column}")
-            result = fig_to_uri(plt.gcf())
-            plt.close()
-        elif action == "boxplot" and column:
-            plt.figure()
-            sns.boxplot(y=df[column])
-            plt.title(f"Box Plot of {column}")
-            result = fig_to_uri(plt.gcf())
-            plt.close()
-        elif action == "scatter" and column:
-            if len(df.columns) > 1:
-                y_col = df.columns[1] if column == df.columns[0] else df.columns[0]
+        # Everything else needs the data: read just the columns this action
+        # touches (memory-mapped when the dataset is not in memory)
+        if corr_data is None:
+            with timed("load"):
+                schema = await run_in_threadpool(datasets.schema, entry)
+                df = await run_in_threadpool(datasets.frame, entry, columns_for_action(schema, action, column))
+        
+        # Plotting time includes the fig_to_uri encode, which is also reported on its own
+        with timed("render" if action in CHART_ACTIONS else "analysis"):
+            if action in ("summary", "head", "columns", "missing", "dtypes"):
+                result = compute_analysis(df, action)
+        
+            # Visualization with Matplotlib
+            elif action == "histogram" and column:
                 plt.figure()
-                plt.scatter(df[column], df[y_col])
-                plt.xlabel(column)
-                plt.ylabel(y_col)
-                plt.title(f"Scatter Plot: {column} vs {y_col}")
+                df[column].hist()
+                plt.title(f"Histogram of {column}")
                 result = fig_to_uri(plt.gcf())
                 plt.close()
-            else:
-                result = {"error": "Need at least two columns for scatter plot"}
-        elif action == "correlation":
-            numeric_df = df.select_dtypes(include=['number'])
-            if len(numeric_df.columns) > 1:
-                plt.figure(figsize=(10, 8))
-                sns.heatmap(numeric_df.corr(), annot=True, cmap='coolwarm')
-                plt.title("Correlation Matrix")
+            elif action == "boxplot" and column:
+                plt.figure()
+                sns.boxplot(y=df[column])
+                plt.title(f"Box Plot of {column}")
                 result = fig_to_uri(plt.gcf())
                 plt.close()
+            elif action == "scatter" and column:
+                if len(schema.columns) > 1:
+                    y_col = schema.columns[1] if column == schema.columns[0] else schema.columns[0]
+                    plt.figure()
+                    plt.scatter(df[column], df[y_col])
+                    plt.xlabel(column)
+                    plt.ylabel(y_col)
+                    plt.title(f"Scatter Plot: {column} vs {y_col}")
+                    result = fig_to_uri(plt.gcf())
+                    plt.close()
+                else:
+                    result = {"error": "Need at least two columns for scatter plot"}
+            elif action == "correlation":
+                if corr_data is not None:
+                    corr = pd.DataFrame(corr_data["matrix"], index=corr_data["columns"],
+                                        columns=corr_data["columns"], dtype='float64')
+                else:
+                    corr = df.select_dtypes(include=['number']).corr()
+                if len(corr.columns) > 1:
+                    plt.figure(figsize=(10, 8))
+                    sns.heatmap(corr, annot=True, cmap='coolwarm')
+                    plt.title("Correlation Matrix")
+                    result = fig_to_uri(plt.gcf())
+                    plt.close()
+                else:
+                    result = {"error": "Need at least two numeric columns for correlation"}
+            elif action == "value_counts" and column:
+                result = compute_analysis(df, action, column)
             else:
-                result = {"error": "Need at least two numeric columns for correlation"}
-        elif action == "value_counts" and column:
-            result = df[column].value_counts().to_dict()
-        else:
-            return {"error": "Invalid action or missing column parameter"}
+                return {"error": "Invalid action or missing column parameter"}
         
         return {"result": result}
     except Exception as e:
         return {"error": str(e)}
 
+# Batch analysis: every action of a dashboard in one request and one read of the data
+ANALYZE_BATCH_MAX = int(os.getenv("ANALYZE_BATCH_MAX", "500"))
+BATCH_ACTIONS = ("summary", "head", "columns", "missing", "dtypes", "profile", "value_counts")
+
+def plan_batch(actions, columns, all_columns):
+    """(action, column) pairs of a batch body, in order and without duplicates
+
+    An entry is an action name or {"action": ..., "column": ...}; value_counts
+    given by name runs for every entry of columns (default: all columns).
+    """
+    planned = []
+    for item in actions:
+        if isinstance(item, str):
+            action, column = item, None
+        elif isinstance(item, dict):
+            action, column = item.get("action"), item.get("column")
+        else:
+            raise ValueError("Each action must be a name or an object with an 'action' field")
+        if action == "value_counts" and column is None:
+            planned += [(action, c) for c in (all_columns if columns is None else columns)]
+        else:
+            planned.append((action, column))
+    return list(dict.fromkeys(planned))
+
+def batch_columns(schema, pending):
+    """Union of the columns the pending actions read, or None when one needs the whole frame"""
+    needed = {}
+    for action, column in pending:
+        columns = columns_for_action(schema, action, column)
+        if columns is None:
+            return None
+        needed.update(dict.fromkeys(columns))
+    return list(needed)
+
+def batch_item(df, action, column):
+    if action == "value_counts" and column not in df.columns:
+        raise ValueError(f"Column '{column}' not found in dataset")
+    return compute_analysis(df, action, column)
+
+@app.post("/analyze/batch")
+async def analyze_batch(request: Request):
+    """Several table and statistics actions of /analyze in one round trip
+
+    Profile answers come first; the rest share a single read of the union of
+    their columns and run in parallel. Charts stay on /analyze.
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return JSONResponse({"error": "The body must be a JSON object"}, status_code=400)
+    if not isinstance(data.get('actions', []), list) or not isinstance(data.get('columns', []), (list, type(None))):
+        return JSONResponse({"error": "'actions' and 'columns' must be lists"}, status_code=400)
+    dataset_id = data.get('datasetId')
+    entry = resolve_dataset(request, dataset_id)
+    if entry is None:
+        if dataset_id:
+            return {"error": f"Dataset '{dataset_id}' not found"}
+        return {"error": "No dataset uploaded"}
+    
+    try:
+        schema = await run_in_threadpool(datasets.schema, entry)
+        planned = plan_batch(data.get('actions') or [], data.get('columns'), list(schema.columns))
+        if len(planned) > ANALYZE_BATCH_MAX:
+            return {"error": f"Too many actions in one batch (max {ANALYZE_BATCH_MAX})"}
+        
+        results = {}
+        pending = []
+        for action, column in planned:
+            if action not in BATCH_ACTIONS:
+                results[(action, column)] = {"error": f"Invalid batch action: {action}"}
+                continue
+            answer = profile_answer(entry.profile, action, column)
+            if answer is not None:
+                results[(action, column)] = {"result": answer}
+            elif action == "profile":
+                results[(action, column)] = {"error": "No profile stored for this dataset"}
+            else:
+                pending.append((action, column))
+        
+        if pending:
+            # One read of the columns the remaining actions touch, shared by all of them
+            with timed("load"):
+                df = await run_in_threadpool(datasets.frame, entry, batch_columns(schema, pending))
+            with timed("analysis"):
+                outcomes = await asyncio.gather(
+                    *(run_in_threadpool(batch_item, df, action, column) for action, column in pending),
+                    return_exceptions=True)
+            for key, outcome in zip(pending, outcomes):
+                results[key] = {"error": str(outcome)} if isinstance(outcome, Exception) else {"result": outcome}
+        
+        return {"datasetId": entry.id,
+                "results": [{"action": action, **({"column": column} if column is not None else {}),
+                             **results[(action, column)]} for action, column in planned]}
+    except Exception as e:
+        return {"error": str(e)}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of the request histograms and dataset memory"""
+    gauges = [("uniq_datasets_memory_bytes", "gauge", "Dataset bytes held in memory", datasets.memory_bytes, {})]
+    return Response(metrics_text(gauges, startup_state), media_type="text/plain; version=0.0.4")
+
+@app.get("/datasets")
+async def list_datasets():
+    return {"datasets": datasets.list(), "stats": datasets.stats()}
+
+@app.delete("/datasets/{dataset_id}")
+async def delete_dataset(dataset_id: str):
+    if await run_in_threadpool(datasets.remove, dataset_id):
+        return {"success": "Dataset removed"}
+    return {"error": f"Dataset '{dataset_id}' not found"}
+
+startup_state["importSeconds"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
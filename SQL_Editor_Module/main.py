@@ -1,28 +1,288 @@
 # main.py - FIXED VERSION
-from fastapi import FastAPI, Request, Form, File, UploadFile, HTTPException
+import time
+IMPORT_STARTED = time.perf_counter()
+from fastapi import FastAPI, Request, Form, File, UploadFile, HTTPException, Query
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
 import pandas as pd
-import io
+try:
+    import pyarrow as pa
+    import pyarrow.feather
+    import pyarrow.ipc
+except ImportError:  # Arrow persistence is optional
+    pa = None
+import numpy as np
 import base64
 from io import BytesIO
-import matplotlib.pyplot as plt
-import seaborn as sns
-import mysql.connector
-from mysql.connector import Error
 import json
+import re
 import os
 from typing import Optional, Dict, Any
 import logging
 import sqlite3
+import asyncio
+import bisect
+import hashlib
+import concurrent.futures
+import contextlib
+import contextvars
+import datetime
+import decimal
+import functools
+import importlib
+import importlib.util
+import multiprocessing
+import queue
+import uuid
+import zlib
+import sys
+from collections import OrderedDict
+import tempfile
+import threading
+
+# Profiling, the dataset store, request timing and upload parsing are shared
+# with OneClick (uniq_shared/ at the repository root)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from uniq_shared.lazy import LazyModule, lazy_import_seconds, use_headless_backend
+from uniq_shared.profiling import (PROFILE_PROCESSES, ProfileBuilder, correlation_data, get_profile_executor,
+                                   is_numeric_column, profile_answer, profile_chunk)
+from uniq_shared.store import (DATASET_MAX_COUNT, DATASET_MEMORY_BUDGET_MB, DATASET_SPILL_DIR, DATASET_STORE_DIR,
+                               DatasetRegistry)
+from uniq_shared.timing import add_timing_middleware, collect_stages, metrics_text, record_rows, record_stage, timed
+from uniq_shared.uploads import (UPLOAD_MEMORY_LIMIT_MB, iter_upload_frames, publish_progress, shared_progress,
+                                 start_upload_progress, update_upload_progress, upload_progress)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# The plotting stack and the database drivers take most of the import time
+# and many workers never touch them, so they are imported on first use
+matplotlib = LazyModule("matplotlib", setup=use_headless_backend)
+plt = LazyModule("matplotlib.pyplot", setup=use_headless_backend)
+sns = LazyModule("seaborn", setup=use_headless_backend)
+mysql_pooling = LazyModule("mysql.connector.pooling")
+# Only looked up when an except clause is actually evaluated
+mysql_errors = LazyModule("mysql.connector.errors")
+# The in-process dataset engine is optional
+DUCKDB_AVAILABLE = importlib.util.find_spec("duckdb") is not None
+duckdb = LazyModule("duckdb")
+
+# Startup timings reported on /health and /metrics
+WARMUP = os.getenv("WARMUP", "0") == "1"
+startup_state = {
+    "importSeconds": None,
+    "warmup": "pending" if WARMUP else "off",
+    "warmupSeconds": None,
+    "firstResponseSeconds": None,
+}
+
+# Response encoding: fast JSON, columnar results, Arrow IPC and compression
+ORJSON_AVAILABLE = importlib.util.find_spec("orjson") is not None
+ZSTD_AVAILABLE = importlib.util.find_spec("zstandard") is not None
+orjson = LazyModule("orjson")
+zstandard = LazyModule("zstandard")
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "4096"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+# Bodies above this are compressed off the event loop
+COMPRESS_INLINE_BYTES = 256 * 1024
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/x-ndjson", ARROW_STREAM)
+
+
+def json_default(value):
+    """Values the JSON encoders do not know: Decimal, pandas/NumPy scalars, NaT"""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if value is pd.NaT:
+        return None
+    if isinstance(value, (pd.Timestamp, datetime.date, datetime.time)):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return str(value)
+
+
+def dump_json(content):
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content, default=json_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=json_default, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (stdlib json when it is not installed)"""
+
+    def render(self, content):
+        return dump_json(content)
+
+
+def to_columnar(rows, columns=None):
+    """[{column: value}, ...] -> column names once plus one value array per column"""
+    if columns is None:
+        columns = list(rows[0]) if rows else []
+    return {"columns": columns, "data": [[row[column] for row in rows] for column in columns],
+            "rowCount": len(rows)}
+
+
+def frame_to_columnar(df):
+    return {"columns": [str(column) for column in df.columns],
+            "data": [df[column].tolist() for column in df.columns], "rowCount": len(df)}
+
+
+def arrow_array(values):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed-type columns travel as text
+        return pa.array([None if value is None else str(value) for value in values])
+
+
+def arrow_ipc(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def columnar_to_arrow(columnar):
+    """Arrow IPC stream of a to_columnar() result"""
+    arrays = [arrow_array(values) for values in columnar["data"]]
+    return arrow_ipc(pa.Table.from_arrays(arrays, names=columnar["columns"]))
+
+
+def frame_to_arrow(df):
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        table = pa.Table.from_pandas(df.astype({column: str for column in df.columns
+                                                 if df[column].dtype == object}), preserve_index=False)
+    return arrow_ipc(table)
+
+
+def wants(request, media_type):
+    return media_type in request.headers.get("accept", "")
+
+
+def choose_encoding(accept_encoding):
+    """zstd when the client takes it and zstandard is installed, else gzip, else None"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(token.strip())
+    if ZSTD_AVAILABLE and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class StreamCompressor:
+    """gzip or zstd encoder that can be fed a response body in chunks; every
+    chunk is flushed so streamed rows reach the client without waiting"""
+
+    def __init__(self, encoding):
+        if encoding == "zstd":
+            self._encoder = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self._sync = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._encoder = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._sync = zlib.Z_SYNC_FLUSH
+
+    def compress(self, chunk, final=False):
+        data = self._encoder.compress(chunk)
+        return data + (self._encoder.flush() if final else self._encoder.flush(self._sync))
+
+
+class CompressionMiddleware:
+    """Compresses response bodies of COMPRESS_MIN_BYTES or more with the best
+    encoding the client accepts. A body with a Content-Length is already in
+    memory upstream, so it is buffered whole and compressed in one piece, keeping
+    a Content-Length; other bodies are buffered up to COMPRESS_MIN_BYTES to decide,
+    and past it (or for NDJSON streams) the rest is compressed as it arrives."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        state = {"start": None, "buffer": [], "size": 0, "passthrough": False, "compressor": None, "seconds": 0.0}
+
+        async def encode(chunk, final):
+            started = time.perf_counter()
+            if len(chunk) > COMPRESS_INLINE_BYTES:
+                data = await run_in_threadpool(state["compressor"].compress, chunk, final)
+            else:
+                data = state["compressor"].compress(chunk, final)
+            state["seconds"] += time.perf_counter() - started
+            return data
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if state["compressor"] is not None:
+                await send({"type": "http.response.body", "body": await encode(body, not more), "more_body": more})
+                return
+            
+            start = state["start"]
+            headers = MutableHeaders(raw=start["headers"])
+            content_type = headers.get("content-type", "")
+            if "content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                state["passthrough"] = True
+                await send(start)
+                await send(message)
+                return
+            state["buffer"].append(body)
+            state["size"] += len(body)
+            streaming = content_type.startswith("application/x-ndjson")
+            # The http middlewares re-send a sized body in several messages
+            sized = "content-length" in headers and not streaming
+            if more and (sized or (state["size"] < COMPRESS_MIN_BYTES and not streaming)):
+                return
+            body = b"".join(state["buffer"])
+            state["buffer"] = []
+            if not more and len(body) < COMPRESS_MIN_BYTES:
+                # Too small to be worth it
+                state["passthrough"] = True
+                await send(start)
+                await send({"type": "http.response.body", "body": body})
+                return
+            
+            state["compressor"] = StreamCompressor(encoding)
+            data = await encode(body, not more)
+            headers["Content-Encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(data))
+                if "server-timing" in headers:
+                    headers["Server-Timing"] += f", compress;dur={state['seconds'] * 1000:.2f}"
+            await send(start)
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, send_compressed)
+
+
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # Add CORS middleware to allow frontend-backend communication
 app.add_middleware(
@@ -37,13 +297,22 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
+# Request timing: Server-Timing header and the histograms served on /metrics
+add_timing_middleware(app, startup_state, IMPORT_STARTED)
+
+# Outermost, so it sees the final body and Server-Timing header
+app.add_middleware(CompressionMiddleware)
+
 # Database configuration - with error handling
 DB_CONFIG = {
     'host': '127.0.0.1',
     'database': 'hackathon',
     'user': 'root',
     'password': 'aj11anuj',
-    'auth_plugin': 'mysql_native_password'
+    'auth_plugin': 'mysql_native_password',
+    'connection_timeout': int(os.getenv("MYSQL_CONNECT_TIMEOUT", "5")),
+    # LOAD DATA LOCAL INFILE is only allowed for our own temp files
+    'allow_local_infile_in_path': tempfile.gettempdir()
 }
 
 # SQLite fallback configuration
@@ -71,31 +340,1602 @@ def init_sqlite_db():
     except Exception as e:
         logger.error(f"Error initializing SQLite database: {str(e)}")
 
-# Initialize SQLite on startup
-init_sqlite_db()
 
-# In-memory storage for the dataset
-current_dataset = None
-current_dataset_name = ""
+# Connection pool settings (override through environment variables)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("DB_BREAKER_FAILURES", "3"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("DB_BREAKER_COOLDOWN", "30"))
+
+
+class CircuitBreaker:
+    """Stops calling a failing backend for a cooldown period.
+
+    closed    -> calls go through, failures are counted
+    open      -> calls are rejected until the cooldown expires
+    half_open -> a single trial call decides whether to close or re-open
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = "half_open"
+                self._trial_running = False
+            if self.state == "half_open":
+                if self._trial_running:
+                    self.rejected += 1
+                    return False
+                self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.trips += 1
+                    logger.warning(f"MySQL circuit breaker opened for {self.reset_timeout}s")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            retry_in = 0.0
+            if self.state == "open":
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retryInSeconds": round(retry_in, 1),
+            }
+
+
+class PooledSQLiteConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool"""
+
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        self.pool.release(self)
+
+    def really_close(self):
+        super().close()
+
+
+class SQLitePool:
+    """Keeps up to `size` idle SQLite connections around for reuse"""
 
+    def __init__(self, path, size=5, init=None):
+        self.path = path
+        self.size = size
+        # Creates the schema when the first connection is opened, not at import
+        self._init = init
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.in_use = 0
+
+    def _connect(self):
+        if self._init is not None:
+            with self._lock:
+                init, self._init = self._init, None
+            if init is not None:
+                init()
+        conn = sqlite3.connect(self.path, factory=PooledSQLiteConnection, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.pool = self
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def acquire(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+                break
+            # Health check before handing out an idle connection
+            try:
+                conn.execute("SELECT 1")
+                with self._lock:
+                    self.reused += 1
+                break
+            except sqlite3.Error:
+                with self._lock:
+                    self.discarded += 1
+        with self._lock:
+            self.in_use += 1
+        return conn
+
+    def release(self, conn):
+        with self._lock:
+            self.in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.really_close()
+            with self._lock:
+                self.discarded += 1
+            return
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.really_close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": self._idle.qsize(),
+                "inUse": self.in_use,
+                "created": self.created,
+                "reused": self.reused,
+                "discarded": self.discarded,
+            }
+
+
+mysql_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+sqlite_pool = SQLitePool(SQLITE_DB_PATH, DB_POOL_SIZE, init=init_sqlite_db)
+mysql_pool = None
+mysql_pool_lock = threading.Lock()
+mysql_pool_metrics = {"acquired": 0, "waits": 0, "exhausted": 0, "failures": 0, "fallbacks": 0}
+
+
+def get_mysql_pool():
+    """Create the MySQL pool on first use (creating it opens the first connection)"""
+    global mysql_pool
+    with mysql_pool_lock:
+        if mysql_pool is None:
+            mysql_pool = mysql_pooling.MySQLConnectionPool(
+                pool_name="uniq_pool",
+                pool_size=DB_POOL_SIZE,
+                pool_reset_session=True,
+                **DB_CONFIG
+            )
+            logger.info(f"MySQL connection pool created (size={DB_POOL_SIZE})")
+        return mysql_pool
+
+
+def get_mysql_connection():
+    """Borrow a MySQL connection, waiting up to DB_POOL_TIMEOUT if the pool is exhausted"""
+    pool = get_mysql_pool()
+    deadline = time.monotonic() + DB_POOL_TIMEOUT
+    waited = False
+    while True:
+        try:
+            connection = pool.get_connection()
+            break
+        except mysql_errors.PoolError:
+            if time.monotonic() >= deadline:
+                mysql_pool_metrics["exhausted"] += 1
+                raise
+            if not waited:
+                mysql_pool_metrics["waits"] += 1
+                waited = True
+            time.sleep(0.01)
+    # Health check: the pool only reconnects sockets it knows are closed
+    try:
+        connection.ping(reconnect=True, attempts=1)
+    except mysql_errors.Error:
+        # Hand the connection back, or every failed ping shrinks the pool for good
+        try:
+            connection.close()
+        except mysql_errors.Error:
+            pass
+        raise
+    mysql_pool_metrics["acquired"] += 1
+    return connection
+
+
+def get_pool_stats():
+    """Pool and circuit breaker metrics for /health"""
+    mysql_stats = dict(mysql_pool_metrics)
+    mysql_stats["size"] = DB_POOL_SIZE
+    mysql_stats["initialized"] = mysql_pool is not None
+    if mysql_pool is not None:
+        mysql_stats["idle"] = mysql_pool._cnx_queue.qsize()
+    return {
+        "mysql": mysql_stats,
+        "sqlite": sqlite_pool.stats(),
+        "circuitBreaker": mysql_breaker.stats(),
+    }
+
+
+@timed("acquire")
 def get_db_connection():
-    """Create and return a database connection with better error handling"""
+    """Borrow a pooled database connection, falling back to SQLite when MySQL is unreachable.
+
+    Calling close() on the returned connection hands it back to its pool. An
+    exhausted MySQL pool is a 503, not a fallback: SQLite is a different database.
+    """
+    if mysql_breaker.allow_request():
+        try:
+            connection = get_mysql_connection()
+            mysql_breaker.record_success()
+            return connection
+        except mysql_errors.PoolError as e:
+            # The backend is fine, we are just out of connections
+            logger.warning(f"MySQL pool exhausted: {str(e)}")
+            mysql_breaker.record_success()
+            raise HTTPException(status_code=503, detail="All database connections are busy, try again shortly",
+                                headers={"Retry-After": "1"})
+        except mysql_errors.Error as e:
+            logger.error(f"MySQL database connection failed: {str(e)}")
+            mysql_pool_metrics["failures"] += 1
+            mysql_breaker.record_failure()
+    # Fallback to SQLite
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        logger.info("MySQL database connection established successfully")
-        return connection
-    except Error as e:
-        logger.error(f"MySQL database connection failed: {str(e)}")
-        # Fallback to SQLite
+        conn = sqlite_pool.acquire()
+        mysql_pool_metrics["fallbacks"] += 1
+        logger.info("Using SQLite database as fallback")
+        return conn
+    except Exception as sqlite_error:
+        logger.error(f"SQLite connection also failed: {str(sqlite_error)}")
+        raise HTTPException(status_code=500, detail=f"Database connection failed: {str(sqlite_error)}")
+
+# Bulk ingestion settings
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", "10000"))
+MYSQL_LOAD_DATA = os.getenv("MYSQL_LOAD_DATA", "1") == "1"
+# Set for the duration of a SQLite load, then put back to their previous values
+SQLITE_LOAD_PRAGMAS = {"journal_mode": "WAL", "synchronous": "OFF", "temp_store": "MEMORY", "cache_size": -65536}
+
+# Columns of uploaded_data and the dataset column names that map onto them
+UPLOAD_COLUMN_ALIASES = {
+    'name': ['name', 'Name', 'NAME'],
+    'age': ['age', 'Age', 'AGE'],
+    'city': ['city', 'City', 'CITY'],
+}
+
+def map_upload_columns(df):
+    """Map a dataset onto the uploaded_data columns in one vectorized pass"""
+    columns = {}
+    for target, aliases in UPLOAD_COLUMN_ALIASES.items():
+        source = next((alias for alias in aliases if alias in df.columns), None)
+        if target == 'age':
+            if source is None:
+                columns[target] = pd.Series(0, index=df.index, dtype='int64')
+            else:
+                ages = pd.to_numeric(df[source], errors='coerce')
+                columns[target] = ages.where(ages.abs() < 2**31, 0).fillna(0).astype('int64')
+        else:
+            if source is None:
+                columns[target] = pd.Series('', index=df.index, dtype=object)
+            else:
+                columns[target] = df[source].astype(str)
+    return pd.DataFrame(columns, index=df.index)
+
+def iter_upload_chunks(frame, chunk_size=None):
+    """Yield lists of (name, age, city) tuples holding plain Python values"""
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+    names = frame['name'].tolist()
+    ages = frame['age'].tolist()
+    cities = frame['city'].tolist()
+    for start in range(0, len(frame), chunk_size):
+        stop = start + chunk_size
+        yield list(zip(names[start:stop], ages[start:stop], cities[start:stop]))
+
+def load_data_mysql(cursor, frame):
+    """Stream the frame through LOAD DATA LOCAL INFILE from a temporary CSV file"""
+    tmp = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='', encoding='utf-8')
+    try:
+        with tmp:
+            frame.to_csv(tmp, index=False, header=False, lineterminator='\n')
+        path = tmp.name.replace('\\', '/').replace("'", "\\'")
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE uploaded_data "
+            "CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+            "LINES TERMINATED BY '\\n' (name, age, city)"
+        )
+    finally:
+        os.unlink(tmp.name)
+
+class BulkLoader:
+    """Replaces the contents of uploaded_data one chunk of rows at a time.
+
+    SQLite loads everything inside a single transaction with pragmas tuned
+    for the load; MySQL uses LOAD DATA LOCAL INFILE per chunk and falls back
+    to batched multi-row INSERTs when the server refuses it.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.is_sqlite = isinstance(connection, sqlite3.Connection)
+        self.backend_name = "SQLite" if self.is_sqlite else "MySQL"
+        self.rows = 0
+        self.elapsed = 0.0
+        if self.is_sqlite:
+            self.method = "sqlite-executemany"
+            self._start_sqlite()
+        else:
+            self.method = "mysql-load-data" if MYSQL_LOAD_DATA else "mysql-executemany"
+            self._start_mysql()
+
+    def _start_sqlite(self):
+        # The connection goes back to the pool afterwards (and journal_mode is
+        # stored in the database file), so remember what to put back
+        self._pragmas = {name: self.cursor.execute(f"PRAGMA {name}").fetchone()[0]
+                         for name in SQLITE_LOAD_PRAGMAS}
+        for name, value in SQLITE_LOAD_PRAGMAS.items():
+            self.cursor.execute(f"PRAGMA {name}={value}")
+        self.cursor.execute("BEGIN")
+        self.cursor.execute("DELETE FROM uploaded_data")
+
+    def _start_mysql(self):
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS uploaded_data (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255),
+            age INT,
+            city VARCHAR(255)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+        """)
+        # Clear existing data
+        self.cursor.execute("TRUNCATE TABLE uploaded_data")
+
+    def add(self, df):
+        """Map a chunk of the dataset onto uploaded_data and insert it"""
+        started = time.perf_counter()
+        frame = map_upload_columns(df)
+        if self.is_sqlite:
+            for rows in iter_upload_chunks(frame):
+                self.cursor.executemany(
+                    "INSERT INTO uploaded_data (name, age, city) VALUES (?, ?, ?)",
+                    rows
+                )
+        else:
+            self._add_mysql(frame)
+        self.rows += len(frame)
+        self.elapsed += time.perf_counter() - started
+
+    def _add_mysql(self, frame):
+        if self.method == "mysql-load-data":
+            try:
+                load_data_mysql(self.cursor, frame)
+                return
+            except mysql_errors.Error as e:
+                logger.warning(f"LOAD DATA LOCAL INFILE unavailable, using batched inserts: {str(e)}")
+                self.method = "mysql-executemany"
+        # executemany rewrites simple INSERTs into one multi-row statement per chunk
+        for rows in iter_upload_chunks(frame):
+            self.cursor.executemany(
+                "INSERT INTO uploaded_data (name, age, city) VALUES (%s, %s, %s)",
+                rows
+            )
+
+    def finish(self):
+        started = time.perf_counter()
+        self.connection.commit()
+        self.elapsed += time.perf_counter() - started
+        self._restore()
+
+    def abort(self):
+        try:
+            self.connection.rollback()
+        finally:
+            self._restore()
+
+    def _restore(self):
+        if not self.is_sqlite:
+            return
+        for name, value in self._pragmas.items():
+            try:
+                self.cursor.execute(f"PRAGMA {name}={value}")
+            except sqlite3.Error as e:
+                # Leaving WAL needs the database to itself; it is retried by the next upload
+                logger.warning(f"Could not restore PRAGMA {name}={value}: {str(e)}")
+
+    @property
+    def rows_per_second(self):
+        return round(self.rows / self.elapsed) if self.elapsed > 0 else self.rows
+
+    @property
+    def message(self):
+        return f"Data saved to {self.backend_name} database ({self.rows} rows, {self.rows_per_second} rows/sec)"
+
+# Browsers remember their last upload in this cookie
+DATASET_COOKIE = "uniq_dataset"
+
+datasets = DatasetRegistry(DATASET_MEMORY_BUDGET_MB * 1024 * 1024, DATASET_STORE_DIR,
+                           DATASET_SPILL_DIR, DATASET_MAX_COUNT)
+datasets.load_store()
+
+def columns_for_action(schema, action, column=None):
+    """Columns an /analyze action reads, or None when it needs the whole frame"""
+    if action in ("histogram", "boxplot", "line", "value_counts"):
+        return [column] if column in schema.columns else []
+    if action == "scatter":
+        if column not in schema.columns:
+            return []
+        others = [c for c in schema.select_dtypes(include=['number']).columns if c != column]
+        return [column] + others[:1]
+    if action == "correlation":
+        return schema.select_dtypes(include=['number']).columns.tolist()
+    return None
+
+def resolve_dataset(request, dataset_id=None):
+    """Pick the dataset for a request: explicit id, then this browser's last upload, then the latest upload"""
+    if dataset_id:
+        return datasets.get(dataset_id)
+    session_id = request.cookies.get(DATASET_COOKIE)
+    entry = datasets.get(session_id) if session_id else None
+    return entry or datasets.get()
+
+# Query result cache for read-only statements
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "60"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_MB", "64")) * 1024 * 1024
+# Results that depend on more than the table contents are never cached
+NON_DETERMINISTIC_SQL = re.compile(
+    r"\b(now|sysdate|curdate|curtime|current_date|current_time|current_timestamp|"
+    r"localtime|localtimestamp|utc_date|utc_time|utc_timestamp|unix_timestamp|"
+    r"rand|random|uuid|uuid_short|last_insert_id|found_rows|row_count|connection_id|"
+    r"changes|total_changes|sleep|get_lock|database|user|version)\s*\(|\bfor\s+update\b",
+    re.IGNORECASE,
+)
+SQL_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)")
+SQL_TABLE_NAME = r"((?:[`\"\[]?[\w$]+[`\"\]]?\.)?[`\"\[]?[\w$]+[`\"\]]?)"
+SQL_READ_TABLES = re.compile(r"\b(?:from|join)\s+" + SQL_TABLE_NAME, re.IGNORECASE)
+SQL_WRITE_TABLE = re.compile(
+    r"^\s*(?:insert\s+(?:ignore\s+)?into|replace\s+into|update|delete\s+from|"
+    r"truncate(?:\s+table)?|drop\s+table(?:\s+if\s+exists)?|alter\s+table|"
+    r"create\s+table(?:\s+if\s+not\s+exists)?|load\s+data.*?\binto\s+table)\s+" + SQL_TABLE_NAME,
+    re.IGNORECASE | re.DOTALL,
+)
+
+def normalize_sql(sql_query):
+    """Collapse whitespace and keyword case outside string literals, drop a trailing ';'"""
+    parts = SQL_QUOTED.split(sql_query.strip().rstrip(';').strip())
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part).lower() for i, part in enumerate(parts))
+
+def table_name(token):
+    return re.sub(r'[`"\[\]]', '', token).split('.')[-1].lower()
+
+def is_cacheable_sql(normalized):
+    return normalized.startswith(("select", "with")) and not NON_DETERMINISTIC_SQL.search(normalized)
+
+def read_tables(normalized):
+    # Only look outside string literals
+    code = " ".join(SQL_QUOTED.split(normalized)[::2])
+    return {table_name(token) for token in SQL_READ_TABLES.findall(code)}
+
+def written_table(sql_query):
+    """Table a write statement modifies, or None when it cannot be told"""
+    match = SQL_WRITE_TABLE.match(sql_query)
+    return table_name(match.group(1)) if match else None
+
+
+class SharedEpochs:
+    """Change tokens every worker process can see, kept as small files in the
+    dataset store: a writer bumps a name, readers compare it with the token
+    they last saw. Lets `--workers N` invalidate each other's caches."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, hashlib.sha1(name.lower().encode('utf-8')).hexdigest()[:16])
+
+    def get(self, name):
+        try:
+            with open(self._path(name), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return ""
+
+    def bump(self, name):
+        path = self._path(name)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(uuid.uuid4().hex)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not publish a cache invalidation: {str(e)}")
+
+
+shared_epochs = SharedEpochs(os.path.join(DATASET_STORE_DIR, "epochs"))
+
+
+class QueryCache:
+    """TTL + LRU cache of SELECT results keyed by (backend, normalized SQL),
+    bounded by the JSON size of the cached rows and invalidated per table.
+
+    Each result remembers the shared change tokens of the tables it read (taken
+    before the statement ran), so a write made by another worker invalidates it too."""
+
+    def __init__(self, ttl, max_bytes, epochs):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.epochs = epochs
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _epoch_name(table):
+        return f"query-cache {table or '*'}"
+
+    def snapshot(self, normalized):
+        """Change tokens of the tables a statement reads; take it before the statement runs"""
+        names = [self._epoch_name(table) for table in read_tables(normalized)] + [self._epoch_name(None)]
+        return {name: self.epochs.get(name) for name in names}
+
+    def table_epoch(self, table):
+        """Change token of one table: it moves whenever the table is written"""
+        return self.epochs.get(self._epoch_name(table)), self.epochs.get(self._epoch_name(None))
+
+    def get(self, backend, normalized):
+        key = (backend, normalized)
+        with self._lock:
+            entry = self._entries.get(key)
+        # Another worker may have written one of its tables since (read outside the lock: these are files)
+        stale = entry is not None and any(self.epochs.get(name) != token for name, token in entry["epochs"].items())
+        with self._lock:
+            if entry is None or stale or time.monotonic() > entry["expires"]:
+                if entry is not None and self._entries.get(key) is entry:
+                    self._remove(key)
+                    self.invalidations += stale
+                self.misses += 1
+                return None
+            if self._entries.get(key) is entry:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["rows"]
+
+    def put(self, backend, normalized, rows, epochs):
+        size = len(json.dumps(rows, default=str))
+        if size > self.max_bytes // 10:
+            return
+        key = (backend, normalized)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {"rows": rows, "size": size, "tables": read_tables(normalized),
+                                  "epochs": epochs, "expires": time.monotonic() + self.ttl}
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, table=None):
+        """Drop results that read `table` (every result when the table is unknown),
+        here and, through the shared tokens, in the other workers"""
+        self.epochs.bump(self._epoch_name(table))
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if table is None or table in entry["tables"]]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+
+    def invalidate_for(self, sql_query):
+        self.invalidate(written_table(sql_query))
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key)["size"]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "maxBytes": self.max_bytes,
+                "ttlSeconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+query_cache = QueryCache(QUERY_CACHE_TTL, QUERY_CACHE_MAX_BYTES, shared_epochs)
+
+# Schema metadata for autocomplete
+SQL_KEYWORDS = (
+    "SELECT", "FROM", "WHERE", "AND", "OR", "NOT", "IN", "IS", "NULL", "LIKE", "BETWEEN",
+    "GROUP BY", "ORDER BY", "HAVING", "LIMIT", "OFFSET", "ASC", "DESC", "DISTINCT", "AS",
+    "JOIN", "INNER JOIN", "LEFT JOIN", "RIGHT JOIN", "CROSS JOIN", "ON", "USING", "UNION",
+    "UNION ALL", "CASE", "WHEN", "THEN", "ELSE", "END", "WITH", "EXISTS",
+    "INSERT INTO", "VALUES", "UPDATE", "SET", "DELETE FROM", "CREATE TABLE", "ALTER TABLE",
+    "DROP TABLE", "TRUNCATE", "PRIMARY KEY", "DEFAULT", "COUNT", "SUM", "AVG", "MIN", "MAX",
+)
+SQL_DDL = re.compile(
+    r"^\s*(?:create|alter|drop)\s+(?:temporary\s+)?(?:table|view)(?:\s+if\s+(?:not\s+)?exists)?\s+"
+    + SQL_TABLE_NAME,
+    re.IGNORECASE,
+)
+AUTOCOMPLETE_LIMIT = 20
+
+
+class SchemaIndex:
+    """Tables and columns of the active backend in a sorted, prefix-searchable list.
+
+    Loaded once from sqlite_master / information_schema and refreshed per table
+    after DDL or uploads, so lookups never touch the database. Changes made by
+    other workers show up as a new shared token and trigger a full reload."""
+
+    EPOCH = "schema-index"
+
+    def __init__(self, epochs):
+        self.epochs = epochs
+        self.backend = None
+        self.tables = {}
+        self.loaded_at = None
+        # Shared token as of the last full load
+        self.seen = None
+        self._entries = self._build({})
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _build(tables):
+        entries = [(keyword.lower(), keyword, "keyword", None) for keyword in SQL_KEYWORDS]
+        for table, columns in tables.items():
+            entries.append((table.lower(), table, "table", None))
+            for column, column_type in columns:
+                entries.append((column.lower(), column, "column", f"{table} {column_type}".strip()))
+        entries.sort()
+        return entries
+
+    @staticmethod
+    def _table_names(connection):
+        cursor = connection.cursor()
+        try:
+            if isinstance(connection, sqlite3.Connection):
+                cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') "
+                               "AND name NOT LIKE 'sqlite_%'")
+            else:
+                cursor.execute("SELECT table_name FROM information_schema.tables "
+                               "WHERE table_schema = DATABASE()")
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _columns(connection, table=None):
+        """{table: [(column, type), ...]} for one table or the whole database"""
+        columns = {}
+        cursor = connection.cursor()
+        try:
+            if isinstance(connection, sqlite3.Connection):
+                for name in [table] if table else SchemaIndex._table_names(connection):
+                    cursor.execute(f'PRAGMA table_info("{name}")')
+                    rows = cursor.fetchall()
+                    if rows:
+                        columns[name] = [(row[1], row[2] or "") for row in rows]
+            else:
+                query = ("SELECT table_name, column_name, data_type FROM information_schema.columns "
+                         "WHERE table_schema = DATABASE()")
+                params = ()
+                if table:
+                    query += " AND table_name = %s"
+                    params = (table,)
+                cursor.execute(query + " ORDER BY table_name, ordinal_position", params)
+                for name, column, column_type in cursor.fetchall():
+                    columns.setdefault(name, []).append((column, column_type))
+        finally:
+            cursor.close()
+        return columns
+
+    def refresh(self, connection, table=None):
+        """Reload one table (dropping it if it is gone) or, without a table, everything"""
+        backend = "sqlite" if isinstance(connection, sqlite3.Connection) else "mysql"
+        if backend != self.backend:
+            table = None
+        seen = self.epochs.get(self.EPOCH) if table is None else self.seen
+        loaded = self._columns(connection, table)
+        with self._lock:
+            self.seen = seen
+            if table is None:
+                tables = loaded
+            else:
+                tables = {name: cols for name, cols in self.tables.items() if name.lower() != table.lower()}
+                tables.update(loaded)
+            self._entries = self._build(tables)
+            self.tables = tables
+            self.backend = backend
+            self.loaded_at = time.time()
+        logger.info(f"Schema index refreshed ({backend}, {table or 'all tables'}): {len(tables)} tables")
+
+    def changed(self, connection, table=None):
+        """Reload after a change made by this worker and tell the others"""
+        self.refresh(connection, table)
+        self.epochs.bump(self.EPOCH)
+
+    def stale(self):
+        """Whether another worker changed the schema since the last full load"""
+        return self.loaded_at is not None and self.epochs.get(self.EPOCH) != self.seen
+
+    def refresh_after(self, connection, sql_query):
+        """Refresh whatever a DDL statement may have changed"""
+        match = SQL_DDL.match(sql_query)
+        if match:
+            self.changed(connection, table_name(match.group(1)))
+        elif re.match(r"\s*rename\s", sql_query, re.IGNORECASE):
+            self.changed(connection)
+
+    def suggest(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """Keywords, tables and columns starting with `prefix`; `table.col` completes that table's columns"""
+        if "." in prefix:
+            table, _, prefix = prefix.rpartition(".")
+            columns = next((cols for name, cols in self.tables.items() if name.lower() == table.lower()), [])
+            return [{"label": column, "kind": "column", "detail": column_type}
+                    for column, column_type in columns if column.lower().startswith(prefix.lower())][:limit]
+        entries = self._entries
+        prefix = prefix.lower()
+        start = bisect.bisect_left(entries, (prefix,))
+        suggestions = []
+        for lowered, label, kind, detail in entries[start:]:
+            if not lowered.startswith(prefix) or len(suggestions) >= limit:
+                break
+            suggestions.append({"label": label, "kind": kind, "detail": detail})
+        return suggestions
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "tables": len(self.tables),
+            "columns": sum(len(columns) for columns in self.tables.values()),
+            "loadedAt": self.loaded_at,
+        }
+
+
+schema_index = SchemaIndex(shared_epochs)
+
+
+def refresh_schema(table=None):
+    """Refresh the schema index on a pooled connection"""
+    connection = get_db_connection()
+    try:
+        schema_index.refresh(connection, table)
+    finally:
+        connection.close()
+
+# In-process SQL over the uploaded datasets
+DATASET_TABLE = "dataset"
+dataset_engine = None
+dataset_engine_lock = threading.Lock()
+
+
+def get_dataset_engine():
+    """One in-memory database, created on first use; every query gets its own
+    cursor with its own registrations"""
+    global dataset_engine
+    with dataset_engine_lock:
+        if dataset_engine is None:
+            dataset_engine = duckdb.connect(config={"enable_external_access": False})
+        return dataset_engine
+
+
+def sql_table_name(name):
+    """Identifier a dataset is queryable under, e.g. "Sales 2024.csv" -> sales_2024"""
+    stem = os.path.splitext(os.path.basename(name or ""))[0]
+    ident = re.sub(r"\W+", "_", stem).strip("_").lower()
+    return ident if ident and not ident[0].isdigit() else f"t_{ident}"
+
+
+def dataset_tables(request, dataset_id=None):
+    """{table name: entry}: the request's dataset as `dataset`, plus every dataset by file name"""
+    tables = {}
+    for info in reversed(datasets.list()):
+        tables[sql_table_name(info["name"])] = info["datasetId"]
+    current = resolve_dataset(request, dataset_id)
+    if current is not None:
+        tables[DATASET_TABLE] = current.id
+    return tables
+
+
+def dataset_source(entry):
+    """What the engine scans: the live DataFrame, or the memory-mapped Arrow file"""
+    if entry.df is not None:
+        return entry.df
+    if entry.store_path is not None:
+        return pyarrow.feather.read_table(entry.store_path, memory_map=True)
+    return datasets.frame(entry)
+
+
+def run_dataset_sql(sql_query, tables, query, use_cache=True):
+    """Run a read-only query against registered datasets without copying them;
+    returns (rows, cache status) like run_sql"""
+    if not DUCKDB_AVAILABLE:
+        raise HTTPException(status_code=501, detail="The dataset engine needs the duckdb package")
+    normalized = normalize_sql(sql_query)
+    if not normalized.startswith(("select", "with")):
+        raise HTTPException(status_code=400, detail="The dataset engine only runs SELECT queries")
+    # Only the datasets the query names are registered (and read back if spilled)
+    used = {name: tables[name] for name in read_tables(normalized) if name in tables}
+    # Datasets are immutable per id, so their ids make a key that never goes stale
+    backend = "dataset:" + ",".join(f"{name}={dataset_id}" for name, dataset_id in sorted(used.items()))
+    cacheable = use_cache and is_cacheable_sql(normalized)
+    if cacheable:
+        cached = query_cache.get(backend, normalized)
+        if cached is not None:
+            return query.cap(cached), "hit"
+        epochs = query_cache.snapshot(normalized)
+    cursor = get_dataset_engine().cursor()
+    query.attach(cursor, "duckdb")
+    try:
+        for name, dataset_id in used.items():
+            entry = datasets.get(dataset_id)
+            if entry is not None:
+                cursor.register(name, dataset_source(entry))
+        with query.running():
+            try:
+                with timed("execute"):
+                    cursor.execute(sql_query)
+            except duckdb.Error as e:
+                raise HTTPException(status_code=400, detail=f"Dataset query error: {e}")
+            columns = [column[0] for column in cursor.description]
+            with timed("fetch"):
+                result = [dict(zip(columns, row)) for row in query.fetch(cursor)]
+    finally:
+        cursor.close()
+    logger.info(f"Dataset query returned {len(result)} rows")
+    # A capped fetch is not the whole result, so caching it would serve a
+    # short result to a later request with a higher cap
+    if cacheable and query.complete(result):
+        query_cache.put(backend, normalized, result, epochs)
+        return query.cap(result), "miss"
+    return query.cap(result), "bypass"
+
+# Query governance: statements from /execute-sql are time-boxed, capped and cancellable
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "30"))
+# Rows an interactive (not streamed, not paged) query returns at most; 0 = no cap
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "10000"))
+# SELECTs estimated to cost more are refused before they run; 0 = no pre-check.
+# For MySQL this is the optimizer's query_cost, for SQLite the rows its full scans touch
+QUERY_MAX_COST = float(os.getenv("QUERY_MAX_COST", "0"))
+QUERY_WATCHDOG_INTERVAL = 0.25
+QUERY_ID = re.compile(r"[\w-]{1,64}")
+# max_execution_time exceeded
+MYSQL_TIMEOUT_ERROR = 3024
+SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?([\w$]+)")
+# `table alias` / `table AS alias` in FROM lists and joins; SQLite plans name the alias
+SQL_TABLE_ALIAS = re.compile(
+    r"(?:\bfrom|\bjoin|,)\s+" + SQL_TABLE_NAME + r"\s+(?:as\s+)?(?!(?:where|on|using|join|inner|left|right|"
+    r"cross|natural|full|outer|group|order|limit|union|having|window|from)\b)([\w$]+)", re.IGNORECASE)
+SQL_TRAILING_LIMIT = re.compile(r"\blimit\s+\d+(?:\s*(?:,|offset)\s*\d+)?$")
+
+
+class RunningQuery:
+    """A statement in flight. Another request can cancel it, and any single
+    database call made for it is stopped once it runs longer than `timeout`:
+    SQLite and DuckDB connections are interrupted, MySQL statements killed
+    with KILL QUERY (interactive SELECTs also carry max_execution_time)."""
+
+    def __init__(self, query_id, sql_query, timeout, max_rows):
+        self.id = query_id
+        self.sql = sql_query
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.started_at = time.time()
+        self.connection = None
+        self.backend = None
+        # None while running normally, then "cancelled" or "timeout"
+        self.stopped = None
+        self.truncated = False
+        self.busy_since = None
+        self._lock = threading.Lock()
+
+    def attach(self, connection, backend, server_timeout=False):
+        self.connection = connection
+        self.backend = backend
+        if backend == "mysql" and server_timeout and self.timeout > 0:
+            cursor = connection.cursor()
+            try:
+                # Reset when the pool hands the connection out again (pool_reset_session)
+                cursor.execute(f"SET SESSION max_execution_time = {int(self.timeout * 1000)}")
+            except mysql_errors.Error:
+                pass  # MariaDB and MySQL < 5.7.8; the watchdog still applies
+            finally:
+                cursor.close()
+
+    @contextlib.contextmanager
+    def running(self):
+        """Time-box one database call and report an interrupt as a timeout or cancellation"""
+        with self._lock:
+            if self.stopped is not None:
+                raise self.error()
+            self.busy_since = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if self.stopped is None and getattr(e, 'errno', None) == MYSQL_TIMEOUT_ERROR:
+                self.stopped = "timeout"
+            if self.stopped is not None:
+                raise self.error() from e
+            raise
+        finally:
+            with self._lock:
+                self.busy_since = None
+
+    def overdue(self, now):
+        busy_since = self.busy_since
+        return self.timeout > 0 and busy_since is not None and now - busy_since > self.timeout
+
+    def cancel(self, reason="cancelled"):
+        # Holding the lock keeps the connection from going back to the pool mid-kill
+        with self._lock:
+            if self.stopped is None:
+                self.stopped = reason
+            if self.busy_since is None or self.connection is None:
+                return
+            try:
+                if self.backend == "mysql":
+                    kill_mysql_query(self.connection.connection_id)
+                else:
+                    self.connection.interrupt()
+            except Exception as e:
+                logger.warning(f"Could not stop query {self.id}: {str(e)}")
+
+    def error(self):
+        if self.stopped == "timeout":
+            return HTTPException(status_code=408, detail=f"Query stopped after the {self.timeout:g}s statement timeout")
+        return HTTPException(status_code=409, detail="Query cancelled")
+
+    def fetch(self, cursor):
+        """The result's rows, at most max_rows + 1: the extra row shows it was cut"""
+        if self.max_rows > 0:
+            return cursor.fetchmany(self.max_rows + 1)
+        return cursor.fetchall()
+
+    def cap(self, rows):
+        """Trim a result to max_rows, remembering whether anything was cut"""
+        if self.max_rows > 0 and len(rows) > self.max_rows:
+            self.truncated = True
+            return rows[:self.max_rows]
+        return rows
+
+    def complete(self, rows):
+        """Whether a fetch holds the whole result, so it can be cached for
+        requests with any row cap"""
+        return self.max_rows <= 0 or len(rows) <= self.max_rows
+
+    def info(self):
+        return {
+            "queryId": self.id,
+            "sql": self.sql[:200],
+            "backend": self.backend,
+            "elapsedSeconds": round(time.time() - self.started_at, 3),
+            "busy": self.busy_since is not None,
+            "stopped": self.stopped,
+        }
+
+
+class QueryRegistry:
+    """Statements in flight by query id, plus the watchdog that enforces their timeouts"""
+
+    def __init__(self):
+        self._queries = {}
+        self._lock = threading.Lock()
+        self._watchdog = None
+        self.started = 0
+        self.cancelled = 0
+        self.timed_out = 0
+        self.rejected = 0
+
+    def start(self, query_id, sql_query, timeout=QUERY_TIMEOUT, max_rows=QUERY_MAX_ROWS):
+        if not query_id or not QUERY_ID.fullmatch(str(query_id)):
+            query_id = uuid.uuid4().hex
+        query = RunningQuery(query_id, sql_query, timeout, max_rows)
+        with self._lock:
+            if query_id in self._queries:
+                raise HTTPException(status_code=409, detail=f"Query id '{query_id}' is already running")
+            self._queries[query_id] = query
+            self.started += 1
+            if self._watchdog is None:
+                self._watchdog = threading.Thread(target=self._watch, name="query-watchdog", daemon=True)
+                self._watchdog.start()
+        return query
+
+    def finish(self, query):
+        with self._lock:
+            if self._queries.get(query.id) is not query:
+                return
+            del self._queries[query.id]
+            if query.stopped == "timeout":
+                self.timed_out += 1
+            elif query.stopped == "cancelled":
+                self.cancelled += 1
+
+    def cancel(self, query_id):
+        with self._lock:
+            query = self._queries.get(query_id)
+        if query is None:
+            return False
+        query.cancel()
+        return True
+
+    def list(self):
+        with self._lock:
+            return [query.info() for query in self._queries.values()]
+
+    def stats(self):
+        with self._lock:
+            running = len(self._queries)
+        return {"running": running, "started": self.started, "cancelled": self.cancelled,
+                "timedOut": self.timed_out, "rejected": self.rejected,
+                "timeoutSeconds": QUERY_TIMEOUT, "maxRows": QUERY_MAX_ROWS, "maxCost": QUERY_MAX_COST}
+
+    def _watch(self):
+        while True:
+            time.sleep(QUERY_WATCHDOG_INTERVAL)
+            now = time.monotonic()
+            with self._lock:
+                overdue = [query for query in self._queries.values() if query.overdue(now)]
+            for query in overdue:
+                # Repeated until the statement gives up its connection
+                if query.stopped is None:
+                    logger.warning(f"Query {query.id} exceeded {query.timeout:g}s, stopping it")
+                query.cancel("timeout")
+
+
+running_queries = QueryRegistry()
+
+def request_limits(data):
+    """Per-request timeout / row cap; clients may only tighten the server limits.
+
+    A missing, invalid or non-positive value means the server default, so a
+    client can never switch a limit off."""
+    try:
+        timeout = float(data.get('timeout') or 0)
+        max_rows = int(data.get('maxRows') or 0)
+    except (TypeError, ValueError, OverflowError):
+        return QUERY_TIMEOUT, QUERY_MAX_ROWS
+    # not > 0 also catches NaN
+    if not (timeout > 0 and timeout != float('inf')):
+        timeout = QUERY_TIMEOUT
+    elif QUERY_TIMEOUT > 0:
+        timeout = min(timeout, QUERY_TIMEOUT)
+    if max_rows <= 0:
+        max_rows = QUERY_MAX_ROWS
+    elif QUERY_MAX_ROWS > 0:
+        max_rows = min(max_rows, QUERY_MAX_ROWS)
+    return timeout, max_rows
+
+def kill_mysql_query(connection_id):
+    """KILL QUERY from a connection of its own: the pool may be exhausted by
+    the very statements that need stopping"""
+    killer = mysql_pooling.MySQLConnection(**DB_CONFIG)
+    try:
+        cursor = killer.cursor()
+        cursor.execute(f"KILL QUERY {int(connection_id)}")
+        cursor.close()
+    finally:
+        killer.close()
+
+class TableSizes:
+    """Row counts of SQLite tables for the cost estimate. COUNT(*) is a full
+    scan, so a count is kept until the table's query-cache token moves, which
+    every upload and every write run through the editor does."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def get(self, connection, table):
+        token = self.cache.table_epoch(table)
+        with self._lock:
+            known = self._counts.get(table.lower())
+        if known is not None and known[0] == token:
+            return known[1]
+        count = connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        with self._lock:
+            self._counts[table.lower()] = (token, count)
+        return count
+
+
+table_sizes = TableSizes(query_cache)
+
+def estimate_query_cost(connection, sql_query):
+    """The planner's idea of what a statement costs, or None when it has none"""
+    cursor = connection.cursor()
+    try:
+        if isinstance(connection, sqlite3.Connection):
+            # SQLite has no cost model to ask; multiply the sizes of the tables
+            # it scans in full, which is what nested loops over them touch
+            cursor.execute("EXPLAIN QUERY PLAN " + sql_query)
+            code = " ".join(SQL_QUOTED.split(sql_query)[::2])
+            aliases = {alias.lower(): table_name(table) for table, alias in SQL_TABLE_ALIAS.findall(code)}
+            cost = 1.0
+            for row in cursor.fetchall():
+                match = SQLITE_SCAN.match(row[3])
+                if match:
+                    table = aliases.get(match.group(1).lower(), match.group(1))
+                    try:
+                        size = table_sizes.get(connection, table)
+                    except sqlite3.Error:
+                        continue  # subqueries, CTEs
+                    cost *= max(size or 0, 1)
+            return cost
+        cursor.execute("EXPLAIN FORMAT=JSON " + sql_query)
+        plan = json.loads(cursor.fetchone()[0])
+        cost = plan.get("query_block", {}).get("cost_info", {}).get("query_cost")
+        return float(cost) if cost is not None else None
+    finally:
+        cursor.close()
+
+def check_query_cost(connection, sql_query):
+    """Refuse a SELECT whose estimated cost is over QUERY_MAX_COST"""
+    if QUERY_MAX_COST <= 0:
+        return
+    normalized = normalize_sql(sql_query)
+    if not normalized.startswith(("select", "with")):
+        return
+    # A bare LIMIT stops early; sorting or grouping still needs every row
+    if SQL_TRAILING_LIMIT.search(normalized) and not re.search(r"\b(order|group)\s+by\b|\bdistinct\b", normalized):
+        return
+    with timed("explain"):
         try:
-            conn = sqlite3.connect(SQLITE_DB_PATH)
-            conn.row_factory = sqlite3.Row
-            logger.info("Using SQLite database as fallback")
-            return conn
-        except Exception as sqlite_error:
-            logger.error(f"SQLite connection also failed: {str(sqlite_error)}")
-            raise HTTPException(status_code=500, detail=f"Database connection failed: {str(e)}")
+            cost = estimate_query_cost(connection, sql_query)
+        except (sqlite3.Error, mysql_errors.Error, ValueError, TypeError, IndexError):
+            return  # the statement itself will report what is wrong with it
+    if cost is not None and cost > QUERY_MAX_COST:
+        running_queries.rejected += 1
+        raise HTTPException(status_code=400, detail=(
+            f"Query rejected: estimated cost {cost:,.0f} is over the limit of {QUERY_MAX_COST:,.0f}. "
+            "Narrow it down with a WHERE clause or a LIMIT."))
 
+# Streaming / pagination settings
+STREAM_FETCH_SIZE = int(os.getenv("STREAM_FETCH_SIZE", "1000"))
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "500"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "10000"))
+
+def close_quietly(connection, cursor=None):
+    """Close a cursor and hand its connection back to the pool, ignoring errors"""
+    try:
+        # An abandoned unbuffered MySQL result would poison the pooled
+        # connection; drop the socket and let the pool reconnect it
+        if getattr(connection, 'unread_result', False):
+            connection.disconnect()
+        if cursor is not None:
+            cursor.close()
+    except Exception:
+        pass
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+def open_query(sql_query, query):
+    """Execute a statement and return (connection, cursor) with rows still unread"""
+    connection = get_db_connection()
+    try:
+        # No server-side max_execution_time: it would also count the time the client takes to read
+        query.attach(connection, "sqlite" if isinstance(connection, sqlite3.Connection) else "mysql")
+        check_query_cost(connection, sql_query)
+        if isinstance(connection, sqlite3.Connection):
+            cursor = connection.cursor()
+        else:
+            cursor = connection.cursor(dictionary=True)
+        with query.running(), timed("execute"):
+            cursor.execute(sql_query)
+    except Exception:
+        if 'cursor' in locals():
+            close_quietly(connection, cursor)
+        else:
+            close_quietly(connection)
+        raise
+    return connection, cursor
+
+def fetch_rows(cursor, size):
+    """fetchmany() that always returns a list of dicts"""
+    with timed("fetch"):
+        rows = cursor.fetchmany(size)
+        if rows and isinstance(rows[0], sqlite3.Row):
+            return [dict(row) for row in rows]
+        return rows
+
+def finish_write(connection, cursor, sql_query):
+    """Commit a statement that returned no rows and build the usual success message"""
+    connection.commit()
+    query_cache.invalidate_for(sql_query)
+    schema_index.refresh_after(connection, sql_query)
+    logger.info(f"Query executed, {cursor.rowcount} rows affected")
+    return {"success": f"Query executed successfully. Rows affected: {cursor.rowcount}"}
+
+def is_pageable_sql(normalized):
+    """Queries that can be read a slice at a time with LIMIT/OFFSET"""
+    return normalized.startswith(("select", "with"))
+
+def page_statement(sql_query, offset, size):
+    """`sql_query` cut down to `size` rows starting at `offset`.
+
+    A query with its own trailing LIMIT is wrapped in a subquery; anything else
+    gets the clause appended, which keeps its ORDER BY (MySQL may drop the
+    ORDER BY of a derived table). The newlines stop a trailing -- comment from
+    swallowing the clause."""
+    body = sql_query.strip().rstrip(';').strip()
+    if SQL_TRAILING_LIMIT.search(normalize_sql(body)):
+        body = f"SELECT * FROM (\n{body}\n) AS paged_query"
+    return f"{body}\nLIMIT {int(size)} OFFSET {int(offset)}"
+
+def read_page(sql_query, offset, page_size, query):
+    """Read one page of a query; returns (columns, rows, has_more).
+
+    The connection is only held while the page is read, so a client that reads
+    slowly or never comes back keeps no pooled connection (and on SQLite no
+    read lock) between pages. One row is read ahead to tell whether another
+    page exists."""
+    connection, cursor = open_query(page_statement(sql_query, offset, page_size + 1), query)
+    try:
+        columns = [col[0] for col in cursor.description]
+        with query.running():
+            rows = fetch_rows(cursor, page_size + 1)
+    finally:
+        close_quietly(connection, cursor)
+    return columns, rows[:page_size], len(rows) > page_size
+
+def run_unpaged(sql_query, query):
+    """Run a statement that cannot be sliced: a write returns its summary, the
+    rest (PRAGMA, SHOW, ...) return up to MAX_PAGE_SIZE rows in one piece"""
+    connection, cursor = open_query(sql_query, query)
+    try:
+        if not cursor.description:
+            return finish_write(connection, cursor, sql_query)
+        columns = [col[0] for col in cursor.description]
+        with query.running():
+            rows = fetch_rows(cursor, MAX_PAGE_SIZE)
+        return {"columns": columns, "rows": rows}
+    finally:
+        close_quietly(connection, cursor)
+
+def stream_query(sql_query, query):
+    """Run a query and stream its rows as NDJSON, STREAM_FETCH_SIZE rows at a time.
+
+    Each batch is its own LIMIT/OFFSET read, so nothing is held open while the
+    client is reading; pages of a query without ORDER BY follow storage order,
+    which only moves if the table is written mid-stream."""
+    try:
+        if is_pageable_sql(normalize_sql(sql_query)):
+            columns, rows, has_more = read_page(sql_query, 0, STREAM_FETCH_SIZE, query)
+        else:
+            result = run_unpaged(sql_query, query)
+            if "success" in result:
+                running_queries.finish(query)
+                return result
+            columns, rows, has_more = result["columns"], result["rows"], False
+    except Exception:
+        running_queries.finish(query)
+        raise
+
+    def generate():
+        batch, more = rows, has_more
+        row_count = 0
+        try:
+            yield json.dumps({"columns": columns, "queryId": query.id}) + "\n"
+            while batch:
+                row_count += len(batch)
+                yield "".join(json.dumps(row, default=str) + "\n" for row in batch)
+                if not more:
+                    break
+                # Each batch gets the full statement timeout
+                _, batch, more = read_page(sql_query, row_count, STREAM_FETCH_SIZE, query)
+            yield json.dumps({"done": True, "rowCount": row_count}) + "\n"
+            logger.info(f"Streamed {row_count} rows")
+        except HTTPException as e:
+            yield json.dumps({"error": e.detail}) + "\n"
+        except Exception as e:
+            logger.error(f"Streaming error: {str(e)}")
+            yield json.dumps({"error": f"Database error: {str(e)}"}) + "\n"
+        finally:
+            running_queries.finish(query)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson", headers={"X-Query-Id": query.id})
+
+
+def encode_page_token(state):
+    """Continuation token: the query and where the next page starts. It holds
+    no server state, so any worker can serve the next page."""
+    return base64.urlsafe_b64encode(json.dumps(state).encode('utf-8')).decode('ascii')
+
+def decode_page_token(token):
+    try:
+        state = json.loads(base64.urlsafe_b64decode(str(token).encode('ascii')))
+    except ValueError:
+        return None
+    if (not isinstance(state, dict) or not isinstance(state.get("sql"), str)
+            or not isinstance(state.get("offset"), int) or state["offset"] < 0
+            or not is_pageable_sql(normalize_sql(state["sql"]))):
+        return None
+    return state
+
+def fetch_page(state, page_size, query):
+    """Read the page a continuation state points at and the token for the one after it"""
+    columns, rows, has_more = read_page(state["sql"], state["offset"], page_size, query)
+    rows_so_far = state["offset"] + len(rows)
+    record_rows(len(rows))
+    return {
+        "columns": columns,
+        "rows": rows,
+        "rowsSoFar": rows_so_far,
+        "nextToken": encode_page_token(dict(state, offset=rows_so_far)) if has_more else None,
+        "queryId": query.id,
+    }
+
+def start_paged_query(sql_query, page_size, query):
+    """Execute a query and return its first page plus a continuation token"""
+    try:
+        if not is_pageable_sql(normalize_sql(sql_query)):
+            result = run_unpaged(sql_query, query)
+            if "rows" in result:
+                result.update(rowsSoFar=len(result["rows"]), nextToken=None, queryId=query.id)
+            return result
+        state = {"sql": sql_query, "offset": 0, "queryId": query.id, "timeout": query.timeout}
+        return fetch_page(state, page_size, query)
+    finally:
+        running_queries.finish(query)
+
+def continue_paged_query(token, page_size):
+    """Return the next page for a continuation token"""
+    state = decode_page_token(token)
+    if state is None:
+        return {"error": "Invalid continuation token"}
+    # Every page runs under the query id and timeout of the first one
+    timeout, _ = request_limits({"timeout": state.get("timeout")})
+    query = running_queries.start(state.get("queryId"), state["sql"], timeout, 0)
+    try:
+        return fetch_page(state, page_size, query)
+    finally:
+        running_queries.finish(query)
+
+def close_paged_query(token):
+    """Tokens hold no connection, so there is nothing to release; kept so
+    clients that close a cursor early still get an answer"""
+    return decode_page_token(token) is not None
+
+# Execution layer: blocking work runs in per-class executors so the event
+# loop (and with it /health and short queries) never waits on it
+# One db thread per pooled connection: extra statements queue here instead of exhausting the pool
+DB_THREADS = int(os.getenv("DB_THREADS", str(DB_POOL_SIZE)))
+INGEST_THREADS = int(os.getenv("INGEST_THREADS", "2"))
+ANALYSIS_THREADS = int(os.getenv("ANALYSIS_THREADS", "4"))
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", str(min(4, os.cpu_count() or 1))))
+
+
+class WorkClass:
+    """An executor plus a concurrency limit and queueing metrics for one kind of work"""
+
+    def __init__(self, name, executor, limit):
+        self.name = name
+        self.executor = executor
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    async def run(self, fn, *args):
+        queued_at = time.perf_counter()
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        started = time.perf_counter()
+        wait = started - queued_at
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.running += 1
+        record_stage(f"{self.name}-wait", wait)
+        try:
+            loop = asyncio.get_running_loop()
+            if isinstance(self.executor, concurrent.futures.ProcessPoolExecutor):
+                result, stages = await loop.run_in_executor(self.executor, functools.partial(collect_stages, fn, *args))
+                for stage, seconds in stages:
+                    record_stage(stage, seconds)
+            else:
+                # Threads see the request's timing through a copy of its context
+                result = await loop.run_in_executor(self.executor, functools.partial(contextvars.copy_context().run, fn, *args))
+            self.completed += 1
+            return result
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            record_stage(self.name, time.perf_counter() - started)
+            self.total_run += time.perf_counter() - started
+            self._semaphore.release()
+
+    def stats(self):
+        finished = self.completed + self.failed
+        return {
+            "limit": self.limit,
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avgWaitMs": round(1000 * self.total_wait / finished, 2) if finished else 0.0,
+            "maxWaitMs": round(1000 * self.max_wait, 2),
+            "avgRunMs": round(1000 * self.total_run / finished, 2) if finished else 0.0,
+        }
+
+
+def init_render_worker():
+    plt.switch_backend('Agg')
+
+
+def make_render_executor():
+    """Plotting is CPU bound and pyplot is not thread safe, so it gets its own processes"""
+    if RENDER_PROCESSES > 0:
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=RENDER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_render_worker,
+        )
+    # In-process fallback: a single thread serialises pyplot use
+    return concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+
+
+WORK_CLASSES = {
+    "db": WorkClass("db", concurrent.futures.ThreadPoolExecutor(DB_THREADS, thread_name_prefix="db"), DB_THREADS),
+    "ingest": WorkClass("ingest", concurrent.futures.ThreadPoolExecutor(INGEST_THREADS, thread_name_prefix="ingest"), INGEST_THREADS),
+    "analysis": WorkClass("analysis", concurrent.futures.ThreadPoolExecutor(ANALYSIS_THREADS, thread_name_prefix="analysis"), ANALYSIS_THREADS),
+    "render": WorkClass("render", make_render_executor(), max(RENDER_PROCESSES, 1)),
+}
+
+
+async def run_work(work_class, fn, *args):
+    """Run a blocking callable in the executor for its work class"""
+    return await WORK_CLASSES[work_class].run(fn, *args)
+
+
+def get_executor_stats():
+    return {name: work.stats() for name, work in WORK_CLASSES.items()}
+
+
+@app.on_event("startup")
+async def load_schema_index():
+    # In the background so a slow database does not hold up startup
+    async def load():
+        try:
+            await run_work("db", refresh_schema)
+        except Exception as e:
+            logger.warning(f"Could not load the schema index: {e}")
+    asyncio.get_running_loop().create_task(load())
+
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    for work in WORK_CLASSES.values():
+        work.executor.shutdown(wait=False, cancel_futures=True)
+
+@app.on_event("shutdown")
+def remove_spill_files():
+    datasets.close()
+
+# Rendered chart cache
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_MB", "64")) * 1024 * 1024
+CHART_ACTIONS = ("histogram", "boxplot", "scatter", "correlation", "line")
+
+
+class ChartCache:
+    """LRU cache of rendered charts, bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value):
+        # PNG data URIs are stored as strings, binned chart data as dicts
+        size = len(value) if isinstance(value, str) else len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+chart_cache = ChartCache(CHART_CACHE_MAX_BYTES)
+
+def chart_cache_key(dataset_id, action, column, options=()):
+    # The correlation heatmap does not depend on the selected column
+    return (dataset_id, action, None if action == "correlation" else column, options)
+
+def chart_etag(key):
+    """Datasets never change after upload, so the key alone identifies the image.
+
+    Nothing per-process goes in, so every worker hands out the same validator."""
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+    return f'"{digest}"'
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+
+PNG_DATA_URI = "data:image/png;base64,"
+ANALYZE_FORMATS = ("json", "png", "columnar", "arrow")
+
+
+@timed("serialize")
+def chart_response(result, etag, result_format="json"):
+    # no-cache: the browser keeps the chart but revalidates it with If-None-Match
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept"}
+    if result_format == "png" and isinstance(result, str) and result.startswith(PNG_DATA_URI):
+        # The raw bytes are a quarter smaller than the base64 data URI
+        return Response(base64.b64decode(result[len(PNG_DATA_URI):]), media_type="image/png", headers=headers)
+    return FastJSONResponse({"result": result}, headers=headers)
+
+@timed("encode")
 def fig_to_uri(fig):
     """Convert matplotlib figure to base64 encoded image"""
     buf = BytesIO()
@@ -103,10 +1943,257 @@ def fig_to_uri(fig):
     buf.seek(0)
     return "data:image/png;base64," + base64.b64encode(buf.read()).decode('utf-8')
 
+# Binned / downsampled chart data: cost scales with the output resolution, not the row count
+DEFAULT_PNG_BINS = 10
+DEFAULT_DATA_BINS = 50
+MAX_BINS = 1000
+MAX_CHART_PIXELS = 2000
+SCATTER_POINT_LIMIT = int(os.getenv("SCATTER_POINT_LIMIT", "5000"))
+# Points sampled on top of a density grid (e.g. for hover)
+SCATTER_DENSITY_SAMPLE = 500
+# Density grid cells are this many pixels wide and high
+DENSITY_CELL_PX = 4
+BOXPLOT_MAX_OUTLIERS = 200
+
+def finite_values(series):
+    values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    return values[np.isfinite(values)]
+
+def require_numeric(df, column):
+    if not is_numeric_column(df[column]):
+        raise ValueError(f"Column '{column}' is not numeric")
+
+def reservoir_sample(n, k, seed=0):
+    """Indices of a uniform k-of-n sample: keep the k smallest random keys
+    (the vectorized form of reservoir sampling; samples of chunks merge the same way)"""
+    if n <= k:
+        return np.arange(n)
+    keys = np.random.default_rng(seed).random(n)
+    return np.sort(np.argpartition(keys, k)[:k])
+
+def histogram_data(values, bins):
+    counts, edges = np.histogram(values, bins=bins)
+    return {"type": "histogram", "edges": edges.tolist(), "counts": counts.tolist(), "n": int(len(values))}
+
+def boxplot_data(values):
+    if not len(values):
+        raise ValueError("No numeric values to plot")
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    outliers = values[(values < q1 - 1.5 * iqr) | (values > q3 + 1.5 * iqr)]
+    return {
+        "type": "boxplot",
+        "q1": float(q1), "median": float(median), "q3": float(q3),
+        "whiskerLow": float(inside.min()), "whiskerHigh": float(inside.max()),
+        "outlierCount": int(len(outliers)),
+        "outliers": outliers[reservoir_sample(len(outliers), BOXPLOT_MAX_OUTLIERS)].tolist(),
+        "n": int(len(values)),
+    }
+
+def scatter_data(x, y, width, height):
+    """Raw points for small data, a 2D density grid plus a point sample otherwise"""
+    x = pd.to_numeric(x, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    y = pd.to_numeric(y, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    mask = np.isfinite(x) & np.isfinite(y)
+    x, y = x[mask], y[mask]
+    dense = len(x) > SCATTER_POINT_LIMIT
+    sample = reservoir_sample(len(x), SCATTER_DENSITY_SAMPLE if dense else SCATTER_POINT_LIMIT)
+    data = {"type": "scatter", "n": int(len(x)), "x": x[sample].tolist(), "y": y[sample].tolist()}
+    if dense:
+        grid = [max(1, width // DENSITY_CELL_PX), max(1, height // DENSITY_CELL_PX)]
+        counts, x_edges, y_edges = np.histogram2d(x, y, bins=grid)
+        data.update({"type": "density", "xEdges": x_edges.tolist(), "yEdges": y_edges.tolist(),
+                     "counts": counts.astype(int).tolist()})
+    return data
+
+def minmax_data(values, pixels):
+    """Min/max per pixel column of a series over its row order, so peaks survive downsampling"""
+    values = pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    n = len(values)
+    if n <= 2 * pixels:
+        index = np.arange(n)
+        return {"type": "line", "n": n, "x": index.tolist(),
+                "min": np.where(np.isnan(values), None, values).tolist(),
+                "max": np.where(np.isnan(values), None, values).tolist()}
+    starts = np.linspace(0, n, pixels + 1).astype(np.int64)[:-1]
+    with np.errstate(invalid='ignore'):
+        lows = np.fmin.reduceat(values, starts)
+        highs = np.fmax.reduceat(values, starts)
+    return {"type": "line", "n": n, "x": starts.tolist(),
+            "min": np.where(np.isnan(lows), None, lows).tolist(),
+            "max": np.where(np.isnan(highs), None, highs).tolist()}
+
+def chart_data(df, action, column=None, y_col=None, bins=DEFAULT_DATA_BINS, width=400, height=300):
+    """Compact chart data computed with vectorized NumPy binning"""
+    if action == "histogram":
+        require_numeric(df, column)
+        return histogram_data(finite_values(df[column]), bins)
+    if action == "boxplot":
+        require_numeric(df, column)
+        return boxplot_data(finite_values(df[column]))
+    if action == "scatter":
+        require_numeric(df, column)
+        data = scatter_data(df[column], df[y_col], width, height)
+        data.update({"xColumn": column, "yColumn": y_col})
+        return data
+    if action == "line":
+        require_numeric(df, column)
+        return minmax_data(df[column], width)
+    if action == "correlation":
+        return correlation_data(df.select_dtypes(include=['number']).corr())
+    raise ValueError(f"Unknown chart action: {action}")
+
+# Chart renderers run in the render processes, so they only receive the binned data they draw
+def render_histogram(data, column):
+    plt.figure(figsize=(10, 6))
+    edges = np.asarray(data["edges"])
+    plt.bar(edges[:-1], data["counts"], width=np.diff(edges), align='edge')
+    plt.grid(True)
+    plt.title(f"Histogram of {column}")
+    plt.xlabel(column)
+    plt.ylabel('Frequency')
+    result = fig_to_uri(plt.gcf())
+    plt.close()
+    return result
+
+def render_boxplot(data, column):
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ax.bxp([{"med": data["median"], "q1": data["q1"], "q3": data["q3"],
+             "whislo": data["whiskerLow"], "whishi": data["whiskerHigh"],
+             "fliers": data["outliers"], "label": column}], showfliers=True)
+    ax.set_ylabel(column)
+    plt.title(f"Box Plot of {column}")
+    result = fig_to_uri(fig)
+    plt.close(fig)
+    return result
+
+def render_scatter(data, column, y_col):
+    plt.figure(figsize=(10, 6))
+    if data["type"] == "density":
+        counts = np.asarray(data["counts"], dtype=float).T
+        plt.pcolormesh(data["xEdges"], data["yEdges"], np.ma.masked_equal(counts, 0),
+                       norm=matplotlib.colors.LogNorm(), cmap='viridis')
+        plt.colorbar(label='Points per cell')
+    else:
+        plt.scatter(data["x"], data["y"])
+    plt.xlabel(column)
+    plt.ylabel(y_col)
+    plt.title(f"Scatter Plot: {column} vs {y_col}")
+    result = fig_to_uri(plt.gcf())
+    plt.close()
+    return result
+
+def render_line(data, column):
+    plt.figure(figsize=(10, 6))
+    x = np.asarray(data["x"], dtype=float)
+    lows = np.asarray(data["min"], dtype=float)
+    highs = np.asarray(data["max"], dtype=float)
+    plt.fill_between(x, lows, highs, step='post', linewidth=0.8)
+    plt.xlabel('Row')
+    plt.ylabel(column)
+    plt.title(f"{column} by row")
+    result = fig_to_uri(plt.gcf())
+    plt.close()
+    return result
+
+def render_correlation(data):
+    corr = pd.DataFrame(data["matrix"], index=data["columns"], columns=data["columns"], dtype=float)
+    plt.figure(figsize=(10, 8))
+    sns.heatmap(corr, annot=True, cmap='coolwarm', center=0)
+    plt.title("Correlation Matrix")
+    result = fig_to_uri(plt.gcf())
+    plt.close()
+    return result
+
+def analysis_table(df, action):
+    """summary / head as a DataFrame, for the columnar and Arrow formats"""
+    if action == "summary":
+        return df.describe(include='all').rename_axis("statistic").reset_index()
+    return df.head()
+
+def table_html(df):
+    """summary / head tables as the frontend styles them (also used for the stored profile)"""
+    return df.fillna('').to_html(classes='data-table')
+
+def compute_analysis(df, action, column=None):
+    """Table and statistics actions of /analyze"""
+    if action == "summary":
+        return table_html(df.describe(include='all'))
+    if action == "head":
+        return table_html(df.head())
+    if action == "columns":
+        return list(df.columns)
+    if action == "missing":
+        return df.isna().sum().to_dict()
+    if action == "dtypes":
+        return df.dtypes.astype(str).to_dict()
+    if action == "value_counts":
+        return df[column].value_counts().to_dict()
+    raise ValueError(f"Unknown analysis action: {action}")
+
+# Opt-in warm-up (WARMUP=1): load the lazy stacks, spawn and prime the render
+# processes and touch the database before /health reports the worker ready
+def warm_analysis():
+    sample = pd.DataFrame({"x": np.arange(200.0), "y": np.arange(200.0) % 7, "c": ["a", "b"] * 100})
+    for action in ("summary", "missing"):
+        compute_analysis(sample, action)
+    compute_analysis(sample, "value_counts", "c")
+    return chart_data(sample, "histogram", "x", None, DEFAULT_PNG_BINS, 400, 300)
+
+
+def warm_profiling():
+    # Start every profile process now, so the first large upload does not wait for their imports
+    executor = get_profile_executor()
+    if executor is not None:
+        sample = pd.DataFrame({"x": np.arange(200.0), "c": ["a", "b"] * 100})
+        for future in [executor.submit(profile_chunk, sample) for _ in range(PROFILE_PROCESSES)]:
+            future.result()
+
+
+def warm_database():
+    refresh_schema()
+    if DUCKDB_AVAILABLE:
+        get_dataset_engine().execute("SELECT 1").fetchall()
+
+
+async def warm_up():
+    startup_state["warmup"] = "running"
+    started = time.perf_counter()
+    try:
+        data = await run_work("analysis", warm_analysis)
+        # One task per render process so every worker imports pyplot and builds its font cache
+        renders = [run_work("render", render_histogram, data, "x") for _ in range(WORK_CLASSES["render"].limit)]
+        await asyncio.gather(run_work("db", warm_database), run_work("ingest", warm_profiling), *renders)
+        startup_state["warmup"] = "done"
+    except Exception as e:
+        logger.warning(f"Warm-up failed: {e}")
+        startup_state["warmup"] = "failed"
+    startup_state["warmupSeconds"] = round(time.perf_counter() - started, 3)
+    logger.info(f"Warm-up {startup_state['warmup']} in {startup_state['warmupSeconds']}s")
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    if WARMUP:
+        asyncio.get_running_loop().create_task(warm_up())
+
+
+def startup_stats():
+    return {**startup_state, "lazyImports": dict(lazy_import_seconds)}
+
+
 @app.get("/")
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+def get_page_size(data):
+    try:
+        page_size = int(data.get('pageSize') or DEFAULT_PAGE_SIZE)
+    except (TypeError, ValueError):
+        page_size = DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
 # SQL execution endpoint (replaces execute.php and query.php)
 @app.post("/execute-sql")
 async def execute_sql(request: Request):
@@ -114,295 +2201,625 @@ async def execute_sql(request: Request):
         data = await request.json()
         sql_query = data.get('sql', '')
         
+        # Next page of an earlier paginated query
+        token = data.get('continuationToken')
+        if token:
+            return await run_work("db", continue_paged_query, token, get_page_size(data))
+        
         if not sql_query:
             return {"error": "No SQL query provided"}
         
         logger.info(f"Executing SQL: {sql_query[:100]}...")  # Log first 100 chars
         
-        connection = get_db_connection()
+        # rows (default): list of row objects; columnar: names once plus value arrays; arrow: Arrow IPC stream
+        result_format = data.get('format') or ('arrow' if wants(request, ARROW_STREAM) else 'rows')
+        if result_format not in ('rows', 'columnar', 'arrow'):
+            return {"error": "Invalid format. Use 'rows', 'columnar' or 'arrow'."}
         
-        # Check if it's SQLite or MySQL
-        if isinstance(connection, sqlite3.Connection):
-            cursor = connection.cursor()
-            cursor.execute(sql_query)
-            
-            # For SELECT queries
-            if sql_query.strip().lower().startswith('select'):
-                result = cursor.fetchall()
-                # Convert sqlite3.Row objects to dictionaries
-                result = [dict(row) for row in result]
-                logger.info(f"Query returned {len(result)} rows")
-                return result
-            else:
-                connection.commit()
-                logger.info(f"Query executed, {cursor.rowcount} rows affected")
-                return {"success": f"Query executed successfully. Rows affected: {cursor.rowcount}"}
-        else:
-            # MySQL connection
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute(sql_query)
-            
-            # For SELECT queries
-            if cursor.description:
-                result = cursor.fetchall()
-                logger.info(f"Query returned {len(result)} rows")
-                return result
-            # For INSERT, UPDATE, DELETE queries
+        # The dataset engine answers in one piece; it has no server-side cursor to stream or page
+        if data.get('engine') == 'dataset' and (data.get('stream') or data.get('pageSize')):
+            return JSONResponse({"error": "The dataset engine does not support 'stream' or 'pageSize'"},
+                                status_code=400)
+        
+        # Clients may pick the query id, so they can cancel before the response arrives
+        timeout, max_rows = request_limits(data)
+        query = running_queries.start(data.get('queryId'), sql_query, timeout, max_rows)
+        
+        # Constant-memory modes: NDJSON stream or first page + continuation token.
+        # These are not capped; every page is its own LIMIT/OFFSET read, so no
+        # connection is held between pages
+        if data.get('stream'):
+            return await run_work("db", stream_query, sql_query, query)
+        if data.get('pageSize'):
+            return await run_work("db", start_paged_query, sql_query, get_page_size(data), query)
+        
+        use_cache = data.get('cache', True) is not False
+        try:
+            if data.get('engine') == 'dataset':
+                tables = dataset_tables(request, data.get('datasetId'))
+                result, cache_status = await run_work("analysis", run_dataset_sql, sql_query, tables, query, use_cache)
             else:
-                connection.commit()
-                logger.info(f"Query executed, {cursor.rowcount} rows affected")
-                return {"success": f"Query executed successfully. Rows affected: {cursor.rowcount}"}
+                result, cache_status = await run_work("db", run_sql, sql_query, query, use_cache)
+        finally:
+            running_queries.finish(query)
+        if isinstance(result, list):
+            record_rows(len(result))
+        headers = {"X-Query-Cache": cache_status, "X-Query-Id": query.id}
+        if query.truncated:
+            headers["X-Row-Limit"] = str(query.max_rows)
+        with timed("serialize"):
+            if not isinstance(result, list) or result_format == 'rows':
+                return FastJSONResponse(result, headers=headers)
+            columnar = to_columnar(result)
+            if result_format == 'arrow':
+                return Response(columnar_to_arrow(columnar), media_type=ARROW_STREAM, headers=headers)
+            return FastJSONResponse(columnar, headers=headers)
             
-    except Error as e:
+    except HTTPException as e:
+        return JSONResponse({"error": e.detail}, status_code=e.status_code, headers=e.headers)
+    except mysql_errors.Error as e:
         logger.error(f"Database error: {str(e)}")
         return {"error": f"Database error: {str(e)}"}
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         return {"error": f"Unexpected error: {str(e)}"}
+
+def run_sql(sql_query, query, use_cache=True):
+    """Execute a statement and return (rows or write summary, cache status).
+
+    The statement runs under `query` (a RunningQuery): it is time-boxed,
+    cancellable, and a SELECT returns at most query.max_rows rows."""
+    connection = get_db_connection()
+    backend = "sqlite" if isinstance(connection, sqlite3.Connection) else "mysql"
+    normalized = normalize_sql(sql_query)
+    cacheable = use_cache and is_cacheable_sql(normalized)
+    if cacheable:
+        cached = query_cache.get(backend, normalized)
+        if cached is not None:
+            connection.close()
+            logger.info(f"Query cache hit, {len(cached)} rows")
+            return query.cap(cached), "hit"
+        epochs = query_cache.snapshot(normalized)
+    cursor = None
+    try:
+        query.attach(connection, backend, server_timeout=True)
+        check_query_cost(connection, sql_query)
+        # Check if it's SQLite or MySQL
+        if isinstance(connection, sqlite3.Connection):
+            cursor = connection.cursor()
+            with query.running():
+                with timed("execute"):
+                    cursor.execute(sql_query)
+                
+                # For SELECT queries
+                if sql_query.strip().lower().startswith('select'):
+                    with timed("fetch"):
+                        result = query.fetch(cursor)
+                        # Convert sqlite3.Row objects to dictionaries
+                        result = [dict(row) for row in result]
+                    logger.info(f"Query returned {len(result)} rows")
+                else:
+                    connection.commit()
+                    query_cache.invalidate_for(sql_query)
+                    schema_index.refresh_after(connection, sql_query)
+                    logger.info(f"Query executed, {cursor.rowcount} rows affected")
+                    return {"success": f"Query executed successfully. Rows affected: {cursor.rowcount}"}, "bypass"
+        else:
+            # MySQL connection
+            cursor = connection.cursor(dictionary=True)
+            with query.running():
+                with timed("execute"):
+                    cursor.execute(sql_query)
+                
+                # For SELECT queries
+                if cursor.description:
+                    with timed("fetch"):
+                        result = query.fetch(cursor)
+                    logger.info(f"Query returned {len(result)} rows")
+                # For INSERT, UPDATE, DELETE queries
+                else:
+                    connection.commit()
+                    query_cache.invalidate_for(sql_query)
+                    schema_index.refresh_after(connection, sql_query)
+                    logger.info(f"Query executed, {cursor.rowcount} rows affected")
+                    return {"success": f"Query executed successfully. Rows affected: {cursor.rowcount}"}, "bypass"
+        
+        if cacheable and query.complete(result):
+            query_cache.put(backend, normalized, result, epochs)
+            return query.cap(result), "miss"
+        return query.cap(result), "bypass"
     finally:
-        if 'connection' in locals():
-            try:
-                if hasattr(connection, 'is_connected') and connection.is_connected():
-                    cursor.close()
-                    connection.close()
-                elif hasattr(connection, 'close'):
-                    connection.close()
-            except:
-                pass
+        # Rows past the cap may still be unread; close_quietly copes with that
+        close_quietly(connection, cursor)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of the request histograms plus pool, cache and queue gauges"""
+    gauges = [
+        ("uniq_query_cache_hits_total", "counter", "Query cache hits", query_cache.hits, {}),
+        ("uniq_query_cache_misses_total", "counter", "Query cache misses", query_cache.misses, {}),
+        ("uniq_query_cache_bytes", "gauge", "Bytes held by the query cache", query_cache.bytes, {}),
+        ("uniq_queries_running", "gauge", "Statements in flight", running_queries.stats()["running"], {}),
+        ("uniq_queries_cancelled_total", "counter", "Statements cancelled by a client", running_queries.cancelled, {}),
+        ("uniq_queries_timed_out_total", "counter", "Statements stopped by the statement timeout", running_queries.timed_out, {}),
+        ("uniq_queries_rejected_total", "counter", "SELECTs refused by the cost pre-check", running_queries.rejected, {}),
+        ("uniq_chart_cache_bytes", "gauge", "Bytes held by the chart cache", chart_cache.bytes, {}),
+        ("uniq_datasets_memory_bytes", "gauge", "Dataset bytes held in memory", datasets.memory_bytes, {}),
+    ]
+    for name, work in WORK_CLASSES.items():
+        gauges.append(("uniq_work_queued", "gauge", "Tasks waiting per work class", work.queued, {"work_class": name}))
+        gauges.append(("uniq_work_running", "gauge", "Tasks running per work class", work.running, {"work_class": name}))
+    return Response(metrics_text(gauges, startup_state), media_type="text/plain; version=0.0.4")
+
+@app.get("/autocomplete")
+async def autocomplete(prefix: str = "", limit: int = AUTOCOMPLETE_LIMIT):
+    if schema_index.stale():
+        try:
+            await run_work("db", refresh_schema)
+        except Exception as e:
+            # Serve the index we have; the next request tries again
+            logger.warning(f"Could not reload the schema index: {str(e)}")
+    started = time.perf_counter()
+    suggestions = schema_index.suggest(prefix, max(1, min(limit, 100)))
+    return {"prefix": prefix, "suggestions": suggestions,
+            "tookMs": round((time.perf_counter() - started) * 1000, 3)}
+
+@app.post("/schema/refresh")
+async def schema_refresh():
+    await run_work("db", refresh_schema)
+    return {"success": "Schema index refreshed", **schema_index.stats()}
+
+@app.get("/query-cache")
+async def query_cache_stats():
+    return query_cache.stats()
+
+@app.delete("/query-cache")
+async def clear_query_cache():
+    query_cache.invalidate()
+    return {"success": "Query cache cleared"}
+
+@app.get("/queries")
+async def list_queries():
+    return {"queries": running_queries.list(), "stats": running_queries.stats()}
+
+@app.delete("/queries/{query_id}")
+async def cancel_query(query_id: str):
+    # KILL QUERY opens a MySQL connection, so keep it off the event loop
+    if await run_in_threadpool(running_queries.cancel, query_id):
+        return {"success": "Query cancelled"}
+    return {"error": "Unknown or finished query id"}
+
+@app.delete("/execute-sql/cursor/{token}")
+async def close_cursor(token: str):
+    if await run_work("db", close_paged_query, token):
+        return {"success": "Cursor closed"}
+    return {"error": "Unknown or expired continuation token"}
 
 # Dataset upload endpoint (replaces upload.php) - COMPLETELY REWRITTEN
 @app.post("/upload-dataset")
-async def upload_dataset(file: UploadFile = File(...)):
-    global current_dataset, current_dataset_name
-    
+async def upload_dataset(response: Response, file: UploadFile = File(...), upload_id: Optional[str] = None):
     try:
         # Get file extension
         filename = file.filename
-        current_dataset_name = filename
         logger.info(f"Uploading file: {filename}")
         
         if not filename:
             return {"error": "No file provided"}
         
-        # Read file content
-        contents = await file.read()
-        
-        # Process the file based on extension
-        if filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(contents))
-        elif filename.endswith('.xlsx') or filename.endswith('.xls'):
-            df = pd.read_excel(io.BytesIO(contents))
-        else:
+        if not (filename.endswith('.csv') or filename.endswith('.xlsx') or filename.endswith('.xls')):
             return {"error": "Unsupported file format. Please upload CSV or Excel file."}
         
-        current_dataset = df
-        logger.info(f"Dataset loaded with shape: {df.shape}")
-        
-        # Try to save to database
-        db_message = ""
-        rows_inserted = 0
-        
-        try:
-            connection = get_db_connection()
-            
-            if isinstance(connection, sqlite3.Connection):
-                # SQLite
-                cursor = connection.cursor()
-                
-                # Clear existing data
-                cursor.execute("DELETE FROM uploaded_data")
-                
-                # Insert new data - handle different column names
-                for _, row in df.iterrows():
-                    # Map common column names or use defaults
-                    name = row.get('name', row.get('Name', row.get('NAME', '')))
-                    age = row.get('age', row.get('Age', row.get('AGE', 0)))
-                    city = row.get('city', row.get('City', row.get('CITY', '')))
-                    
-                    # Convert age to integer if possible
-                    try:
-                        age = int(age)
-                    except (ValueError, TypeError):
-                        age = 0
-                    
-                    cursor.execute(
-                        "INSERT INTO uploaded_data (name, age, city) VALUES (?, ?, ?)",
-                        (str(name), age, str(city))
-                    )
-                
-                connection.commit()
-                rows_inserted = len(df)
-                db_message = f"Data saved to SQLite database ({rows_inserted} rows)"
-                
-            else:
-                # MySQL
-                cursor = connection.cursor()
-                
-                # Create table if not exists
-                create_table_sql = """
-                CREATE TABLE IF NOT EXISTS uploaded_data (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(255),
-                    age INT,
-                    city VARCHAR(255)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-                """
-                cursor.execute(create_table_sql)
-                
-                # Clear existing data
-                cursor.execute("TRUNCATE TABLE uploaded_data")
-                
-                # Insert new data - handle different column names
-                for _, row in df.iterrows():
-                    # Map common column names or use defaults
-                    name = row.get('name', row.get('Name', row.get('NAME', '')))
-                    age = row.get('age', row.get('Age', row.get('AGE', 0)))
-                    city = row.get('city', row.get('City', row.get('CITY', '')))
-                    
-                    # Convert age to integer if possible
-                    try:
-                        age = int(age)
-                    except (ValueError, TypeError):
-                        age = 0
-                    
-                    cursor.execute(
-                        "INSERT INTO uploaded_data (name, age, city) VALUES (%s, %s, %s)",
-                        (str(name), age, str(city))
-                    )
-                
-                connection.commit()
-                rows_inserted = len(df)
-                db_message = f"Data saved to MySQL database ({rows_inserted} rows)"
-            
-            logger.info(db_message)
-            
-        except Exception as db_error:
-            db_message = f"Database save failed: {str(db_error)}"
-            logger.error(db_message)
-            rows_inserted = 0
-        finally:
-            if 'connection' in locals():
-                try:
-                    if hasattr(connection, 'is_connected') and connection.is_connected():
-                        cursor.close()
-                        connection.close()
-                    elif hasattr(connection, 'close'):
-                        connection.close()
-                except:
-                    pass
-        
-        # Convert numpy array to list for JSON serialization
-        shape_list = list(df.shape)
-        
-        return {
-            "success": True,
-            "message": "Dataset uploaded successfully", 
-            "shape": shape_list,
-            "columns": list(df.columns),
-            "dtypes": df.dtypes.astype(str).to_dict(),
-            "rowsInserted": rows_inserted,
-            "dbStatus": db_message
-        }
+        upload_id = upload_id or uuid.uuid4().hex
+        # Parsing and inserting block, so run them off the event loop;
+        # that also lets /upload-progress answer while the upload runs
+        result = await run_work("ingest", ingest_upload, file, upload_id)
+        # Later /analyze calls from this browser default to this dataset
+        response.set_cookie(DATASET_COOKIE, result["datasetId"], httponly=True, samesite="lax")
+        return result
         
     except Exception as e:
         error_msg = f"Could not process file: {str(e)}"
         logger.error(error_msg)
         return {"error": error_msg}
 
+def ingest_upload(file, upload_id):
+    """Parse the upload chunk by chunk, feeding every chunk to the database
+    loader and the in-memory dataset as it arrives"""
+    filename = file.filename
+    progress = start_upload_progress(upload_id, filename, file.size)
+    
+    # Try to save to database
+    db_message = ""
+    loader = None
+    connection = None
+    try:
+        connection = get_db_connection()
+        loader = BulkLoader(connection)
+    except Exception as db_error:
+        db_message = f"Database save failed: {str(db_error)}"
+        logger.error(db_message)
+        if connection is not None:
+            close_quietly(connection)
+            connection = None
+    
+    retained = []
+    retained_bytes = 0
+    rows = 0
+    sampled = False
+    profiler = ProfileBuilder(get_profile_executor())
+    try:
+        frames = iter_upload_frames(file)
+        while True:
+            with timed("parse"):
+                chunk = next(frames, None)
+            if chunk is None:
+                break
+            rows += len(chunk)
+            with timed("profile"):
+                profiler.add(chunk)
+            
+            # Keep the dataset in memory for /analyze while it fits the budget
+            if not sampled:
+                chunk_bytes = int(chunk.memory_usage(deep=True).sum())
+                if not retained or retained_bytes + chunk_bytes <= UPLOAD_MEMORY_LIMIT_MB * 1024 * 1024:
+                    retained.append(chunk)
+                    retained_bytes += chunk_bytes
+                else:
+                    sampled = True
+                    logger.warning(f"Dataset exceeds {UPLOAD_MEMORY_LIMIT_MB} MB, keeping the first {rows - len(chunk)} rows in memory")
+            
+            if loader is not None:
+                try:
+                    with timed("insert"):
+                        loader.add(chunk)
+                except Exception as db_error:
+                    db_message = f"Database save failed: {str(db_error)}"
+                    logger.error(db_message)
+                    loader.abort()
+                    loader = None
+            
+            update_upload_progress(progress, file, rows)
+        
+        if loader is not None:
+            with timed("insert"):
+                loader.finish()
+            query_cache.invalidate("uploaded_data")
+            schema_index.changed(loader.connection, "uploaded_data")
+            db_message = loader.message
+            logger.info(db_message)
+    except Exception:
+        if loader is not None:
+            try:
+                loader.abort()
+            except Exception:
+                pass
+        progress["status"] = "failed"
+        publish_progress(progress)
+        raise
+    finally:
+        if connection is not None:
+            close_quietly(connection, loader.cursor if loader is not None else None)
+    
+    if not retained:
+        progress["status"] = "failed"
+        publish_progress(progress)
+        raise ValueError("No data found in file")
+    df = pd.concat(retained, ignore_index=True) if len(retained) > 1 else retained[0]
+    with timed("profile"):
+        profile = profiler.finish(df, sampled, to_html=table_html)
+    with timed("store"):
+        entry = datasets.add(filename, df, profile, sampled)
+    record_rows(rows)
+    progress["status"] = "done"
+    publish_progress(progress)
+    logger.info(f"Dataset loaded with shape: {df.shape} ({rows} rows parsed)")
+    
+    # Convert numpy array to list for JSON serialization
+    shape_list = [rows, df.shape[1]]
+    
+    return {
+        "success": True,
+        "message": "Dataset uploaded successfully", 
+        "uploadId": upload_id,
+        "datasetId": entry.id,
+        "shape": shape_list,
+        "columns": list(df.columns),
+        "dtypes": df.dtypes.astype(str).to_dict(),
+        "missing": profile["missing"],
+        "inMemoryRows": len(df),
+        "sampled": sampled,
+        "rowsInserted": loader.rows if loader is not None else 0,
+        "rowsPerSecond": loader.rows_per_second if loader is not None else 0,
+        "insertMethod": loader.method if loader is not None else None,
+        "dbStatus": db_message
+    }
+
+@app.get("/upload-progress/{upload_id}")
+async def get_upload_progress(upload_id: str):
+    progress = upload_progress.get(upload_id) or shared_progress(upload_id)
+    if progress is None:
+        return {"error": "Unknown upload id"}
+    return progress
+
 # Data analysis endpoint
 @app.get("/analyze")
-async def analyze_dataset(action: str, column: str = None):
-    global current_dataset
-    
-    if current_dataset is None:
+async def analyze_dataset(request: Request, action: str, column: str = None, mode: str = "png",
+                          bins: Optional[int] = None, width: int = 400, height: int = 300,
+                          dataset_id: Optional[str] = None,
+                          result_format: Optional[str] = Query(None, alias="format")):
+    entry = resolve_dataset(request, dataset_id)
+    if entry is None:
+        if dataset_id:
+            return {"error": f"Dataset '{dataset_id}' not found"}
         return {"error": "No dataset uploaded. Please upload a dataset first."}
     
     try:
-        df = current_dataset
         logger.info(f"Analysis action: {action}, column: {column}")
         
-        # Basic Analysis
-        if action == "summary":
-            result = df.describe(include='all').fillna('').to_html(classes='data-table')
-        elif action == "head":
-            result = df.head().fillna('').to_html(classes='data-table')
-        elif action == "columns":
-            result = list(df.columns)
-        elif action == "missing":
-            result = df.isna().sum().to_dict()
-        elif action == "dtypes":
-            result = df.dtypes.astype(str).to_dict()
+        # mode=data returns binned chart data as JSON instead of a PNG
+        if mode not in ("png", "data"):
+            return {"error": "Invalid mode. Use 'png' or 'data'."}
+        # json (default); png: charts as raw image/png; columnar / arrow: summary and head as tables
+        if result_format is None:
+            result_format = ("png" if wants(request, "image/png")
+                             else "arrow" if wants(request, ARROW_STREAM) else "json")
+        if result_format not in ANALYZE_FORMATS:
+            return {"error": f"Invalid format. Use one of: {', '.join(ANALYZE_FORMATS)}."}
+        tabular = result_format in ("columnar", "arrow") and action in ("summary", "head")
+        bins = max(1, min(bins or (DEFAULT_DATA_BINS if mode == "data" else DEFAULT_PNG_BINS), MAX_BINS))
+        width = max(1, min(width, MAX_CHART_PIXELS))
+        height = max(1, min(height, MAX_CHART_PIXELS))
         
-        # Visualization with Matplotlib
-        elif action == "histogram" and column:
-            if column not in df.columns:
-                return {"error": f"Column '{column}' not found in dataset"}
-            plt.figure(figsize=(10, 6))
-            df[column].hist()
-            plt.title(f"Histogram of {column}")
-            plt.xlabel(column)
-            plt.ylabel('Frequency')
-            result = fig_to_uri(plt.gcf())
-            plt.close()
-        elif action == "boxplot" and column:
+        # Unchanged charts are answered from the client's copy or the chart cache
+        is_chart = action == "correlation" or (action in CHART_ACTIONS and column)
+        if is_chart:
+            chart_key = chart_cache_key(entry.id, action, column, (mode, bins, width, height))
+            # Each representation (JSON data URI / raw PNG) gets its own validator
+            etag = chart_etag((chart_key, result_format))
+            if etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+            cached = chart_cache.get(chart_key)
+            if cached is not None:
+                return chart_response(cached, etag, result_format)
+        
+        # Basic Analysis, answered from the upload-time profile when possible
+        profile_result = None if tabular else profile_answer(entry.profile, action, column)
+        # The correlation matrix is accumulated over every row while the upload is parsed
+        corr_data = (entry.profile or {}).get("correlation") if action == "correlation" else None
+        if profile_result is None and corr_data is None:
+            # Everything else needs the data: read just the columns this action
+            # touches (memory-mapped when the dataset is not in memory)
+            schema = await run_work("analysis", datasets.schema, entry)
+            df = await run_work("analysis", datasets.frame, entry, columns_for_action(schema, action, column))
+        
+        if profile_result is not None:
+            result = profile_result
+        elif tabular:
+            table = await run_work("analysis", analysis_table, df, action)
+            with timed("serialize"):
+                if result_format == "arrow":
+                    return Response(frame_to_arrow(table), media_type=ARROW_STREAM)
+                return FastJSONResponse({"result": frame_to_columnar(table)})
+        elif action in ("summary", "head", "columns", "missing", "dtypes"):
+            result = await run_work("analysis", compute_analysis, df, action)
+        
+        # Visualization: bin in the analysis pool, draw the compact result in a render process
+        elif action in ("histogram", "boxplot", "line") and column:
             if column not in df.columns:
                 return {"error": f"Column '{column}' not found in dataset"}
-            plt.figure(figsize=(10, 6))
-            sns.boxplot(y=df[column])
-            plt.title(f"Box Plot of {column}")
-            result = fig_to_uri(plt.gcf())
-            plt.close()
+            data = await run_work("analysis", chart_data, df, action, column, None, bins, width, height)
+            if mode == "data":
+                result = data
+            else:
+                renderer = {"histogram": render_histogram, "boxplot": render_boxplot, "line": render_line}[action]
+                result = await run_work("render", renderer, data, column)
         elif action == "scatter" and column:
             if column not in df.columns:
                 return {"error": f"Column '{column}' not found in dataset"}
-            if len(df.columns) < 2:
+            if len(schema.columns) < 2:
                 return {"error": "Need at least two columns for scatter plot"}
             # Find another numeric column
-            numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+            numeric_cols = schema.select_dtypes(include=['number']).columns.tolist()
             if column in numeric_cols:
                 numeric_cols.remove(column)
             if not numeric_cols:
                 return {"error": "No other numeric columns found for scatter plot"}
             y_col = numeric_cols[0]
-            plt.figure(figsize=(10, 6))
-            plt.scatter(df[column], df[y_col])
-            plt.xlabel(column)
-            plt.ylabel(y_col)
-            plt.title(f"Scatter Plot: {column} vs {y_col}")
-            result = fig_to_uri(plt.gcf())
-            plt.close()
+            data = await run_work("analysis", chart_data, df, action, column, y_col, bins, width, height)
+            result = data if mode == "data" else await run_work("render", render_scatter, data, column, y_col)
         elif action == "correlation":
-            numeric_df = df.select_dtypes(include=['number'])
-            if len(numeric_df.columns) < 2:
+            if corr_data is None:
+                numeric_df = df.select_dtypes(include=['number'])
+                if len(numeric_df.columns) < 2:
+                    return {"error": "Need at least two numeric columns for correlation"}
+                corr_data = await run_work("analysis", chart_data, numeric_df, action)
+            elif len(corr_data["columns"]) < 2:
                 return {"error": "Need at least two numeric columns for correlation"}
-            plt.figure(figsize=(10, 8))
-            sns.heatmap(numeric_df.corr(), annot=True, cmap='coolwarm', center=0)
-            plt.title("Correlation Matrix")
-            result = fig_to_uri(plt.gcf())
-            plt.close()
+            result = corr_data if mode == "data" else await run_work("render", render_correlation, corr_data)
         elif action == "value_counts" and column:
             if column not in df.columns:
                 return {"error": f"Column '{column}' not found in dataset"}
-            result = df[column].value_counts().to_dict()
+            result = await run_work("analysis", compute_analysis, df, action, column)
         else:
             return {"error": "Invalid action or missing column parameter"}
         
+        if is_chart:
+            chart_cache.put(chart_key, result)
+            return chart_response(result, etag, result_format)
         return {"result": result}
     except Exception as e:
         error_msg = f"Analysis error: {str(e)}"
         logger.error(error_msg)
         return {"error": error_msg}
 
+# Batch analysis: every action of a dashboard in one request and one read of the data
+ANALYZE_BATCH_MAX = int(os.getenv("ANALYZE_BATCH_MAX", "500"))
+TABLE_ACTIONS = ("summary", "head", "columns", "missing", "dtypes", "profile")
+COLUMN_ACTIONS = ("value_counts", "histogram", "boxplot", "line", "scatter")
+
+def plan_batch(actions, columns, all_columns):
+    """(action, column) pairs of a batch body, in order and without duplicates
+
+    An entry is an action name or {"action": ..., "column": ...}; a per-column
+    action given by name runs for every entry of columns (default: all columns).
+    """
+    planned = []
+    for item in actions:
+        if isinstance(item, str):
+            action, column = item, None
+        elif isinstance(item, dict):
+            action, column = item.get("action"), item.get("column")
+        else:
+            raise ValueError("Each action must be a name or an object with an 'action' field")
+        if action in COLUMN_ACTIONS and column is None:
+            planned += [(action, c) for c in (all_columns if columns is None else columns)]
+        else:
+            planned.append((action, column))
+    return list(dict.fromkeys(planned))
+
+def batch_columns(schema, pending):
+    """Union of the columns the pending actions read, or None when one needs the whole frame"""
+    needed = {}
+    for action, column in pending:
+        columns = columns_for_action(schema, action, column)
+        if columns is None:
+            return None
+        needed.update(dict.fromkeys(columns))
+    return list(needed)
+
+def batch_item(df, schema, action, column, bins, width, height):
+    """One non-profile action of a batch on the shared frame; charts come back as binned data"""
+    if action in COLUMN_ACTIONS and column not in df.columns:
+        raise ValueError(f"Column '{column}' not found in dataset")
+    if action == "correlation":
+        numeric_df = df.select_dtypes(include=['number'])
+        if len(numeric_df.columns) < 2:
+            raise ValueError("Need at least two numeric columns for correlation")
+        return chart_data(numeric_df, action)
+    if action == "scatter":
+        numeric_cols = [c for c in schema.select_dtypes(include=['number']).columns if c != column]
+        if not numeric_cols:
+            raise ValueError("No other numeric columns found for scatter plot")
+        return chart_data(df, action, column, numeric_cols[0], bins, width, height)
+    if action in ("histogram", "boxplot", "line"):
+        return chart_data(df, action, column, None, bins, width, height)
+    return compute_analysis(df, action, column)
+
+@app.post("/analyze/batch")
+async def analyze_batch(request: Request):
+    """Several /analyze actions in one round trip
+
+    Answers from the profile and chart cache come first; the rest share a
+    single read of the union of their columns and run in parallel in the
+    analysis pool. Charts are returned as mode=data JSON. Each result
+    carries its own error, so one bad column does not fail the batch.
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return JSONResponse({"error": "The body must be a JSON object"}, status_code=400)
+    if not isinstance(data.get('actions', []), list) or not isinstance(data.get('columns', []), (list, type(None))):
+        return JSONResponse({"error": "'actions' and 'columns' must be lists"}, status_code=400)
+    dataset_id = data.get('datasetId')
+    entry = resolve_dataset(request, dataset_id)
+    if entry is None:
+        if dataset_id:
+            return {"error": f"Dataset '{dataset_id}' not found"}
+        return {"error": "No dataset uploaded. Please upload a dataset first."}
+    
+    try:
+        schema = await run_work("analysis", datasets.schema, entry)
+        actions = data.get('actions') or []
+        columns = data.get('columns')
+        planned = plan_batch(actions, columns, list(schema.columns))
+        if len(planned) > ANALYZE_BATCH_MAX:
+            return {"error": f"Too many actions in one batch (max {ANALYZE_BATCH_MAX})"}
+        bins = max(1, min(int(data.get('bins') or DEFAULT_DATA_BINS), MAX_BINS))
+        width = max(1, min(int(data.get('width') or 400), MAX_CHART_PIXELS))
+        height = max(1, min(int(data.get('height') or 300), MAX_CHART_PIXELS))
+        logger.info(f"Batch analysis: {len(planned)} actions")
+        
+        results = {}
+        pending = []
+        for action, column in planned:
+            if action not in TABLE_ACTIONS + COLUMN_ACTIONS + ("correlation",):
+                results[(action, column)] = {"error": f"Invalid action: {action}"}
+                continue
+            if action in CHART_ACTIONS:
+                cached = chart_cache.get(chart_cache_key(entry.id, action, column, ("data", bins, width, height)))
+                if cached is not None:
+                    results[(action, column)] = {"result": cached}
+                    continue
+            answer = profile_answer(entry.profile, action, column)
+            if answer is None and action == "correlation":
+                answer = (entry.profile or {}).get("correlation")
+            if action == "correlation" and answer is not None and len(answer["columns"]) < 2:
+                results[(action, column)] = {"error": "Need at least two numeric columns for correlation"}
+            elif answer is not None:
+                results[(action, column)] = {"result": answer}
+            elif action == "profile":
+                results[(action, column)] = {"error": "No profile stored for this dataset"}
+            else:
+                pending.append((action, column))
+        
+        if pending:
+            # One read of the columns the remaining actions touch, shared by all of them
+            df = await run_work("analysis", datasets.frame, entry, batch_columns(schema, pending))
+            outcomes = await asyncio.gather(
+                *(run_work("analysis", batch_item, df, schema, action, column, bins, width, height)
+                  for action, column in pending),
+                return_exceptions=True)
+            for (action, column), outcome in zip(pending, outcomes):
+                if isinstance(outcome, Exception):
+                    results[(action, column)] = {"error": str(outcome)}
+                    continue
+                if action in CHART_ACTIONS:
+                    chart_cache.put(chart_cache_key(entry.id, action, column, ("data", bins, width, height)), outcome)
+                results[(action, column)] = {"result": outcome}
+        
+        return {"datasetId": entry.id,
+                "results": [{"action": action, **({"column": column} if column is not None else {}),
+                             **results[(action, column)]} for action, column in planned]}
+    except Exception as e:
+        error_msg = f"Analysis error: {str(e)}"
+        logger.error(error_msg)
+        return {"error": error_msg}
+
+@app.get("/datasets")
+async def list_datasets():
+    return {"datasets": datasets.list(), "stats": datasets.stats()}
+
+@app.delete("/datasets/{dataset_id}")
+async def delete_dataset(dataset_id: str):
+    if await run_work("analysis", datasets.remove, dataset_id):
+        return {"success": "Dataset removed"}
+    return {"error": f"Dataset '{dataset_id}' not found"}
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
+    stats = {"pool": get_pool_stats(), "executors": get_executor_stats(),
+             "chartCache": chart_cache.stats(), "queryCache": query_cache.stats(),
+             "queries": running_queries.stats(),
+             "schema": schema_index.stats(), "datasets": datasets.stats(),
+             "startup": startup_stats()}
+    if startup_state["warmup"] in ("pending", "running"):
+        # Not ready yet: load balancers keep traffic away until the warm-up finishes
+        return JSONResponse({"status": "warming", **stats}, status_code=503)
     try:
-        connection = get_db_connection()
+        # Deliberately outside the "db" work class so saturated queries cannot starve it
+        connection = await run_in_threadpool(get_db_connection)
+        backend = "sqlite" if isinstance(connection, sqlite3.Connection) else "mysql"
         if hasattr(connection, 'close'):
             connection.close()
-        return {"status": "healthy", "database": "connected"}
+        return {"status": "healthy", "database": "connected", "backend": backend, **stats}
     except Exception as e:
-        return {"status": "healthy", "database": f"disconnected: {str(e)}"}
+        return {"status": "healthy", "database": f"disconnected: {str(e)}", **stats}
+
+startup_state["importSeconds"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+logger.info(f"main imported in {startup_state['importSeconds']}s")
 
 if __name__ == "__main__":
     import uvicorn
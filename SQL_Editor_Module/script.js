@@ -23,6 +23,7 @@ document.addEventListener('DOMContentLoaded', function() {
   const sql = document.getElementById('sql');
   const consoleEl = document.getElementById('console');
   const runBtn = document.getElementById('runBtn');
+  const cancelBtn = document.getElementById('cancelBtn');
   const clearBtn = document.getElementById('clearBtn');
   const formatBtn = document.getElementById('formatBtn');
   const statusEl = document.getElementById('status');
@@ -35,6 +36,57 @@ document.addEventListener('DOMContentLoaded', function() {
   sql.addEventListener('input', updateLength);
   updateLength();
   
+  // Autocomplete: suggestions for the word at the cursor, Tab accepts the first one
+  const suggestionsEl = document.getElementById('suggestions');
+  let suggestions = [];
+  let suggestSeq = 0;
+  
+  function wordAtCursor() {
+    const before = sql.value.slice(0, sql.selectionStart);
+    const match = before.match(/[\w$.]+$/);
+    return match ? match[0] : '';
+  }
+  
+  function showSuggestions(items) {
+    suggestions = items;
+    // Labels are table and column names from the database, so they go in as text
+    const nodes = [];
+    items.slice(0, 6).forEach((s, i) => {
+      if (i) nodes.push(' · ');
+      const span = document.createElement('span');
+      if (i === 0) span.className = 'active';
+      span.textContent = s.label;
+      nodes.push(span);
+    });
+    suggestionsEl.replaceChildren(...nodes);
+  }
+  
+  sql.addEventListener('input', async () => {
+    const word = wordAtCursor();
+    const seq = ++suggestSeq;
+    if (!word) {
+      showSuggestions([]);
+      return;
+    }
+    try {
+      const data = await (await fetch(`/autocomplete?prefix=${encodeURIComponent(word)}`)).json();
+      if (seq === suggestSeq) showSuggestions(data.suggestions || []);
+    } catch {
+      // Suggestions are optional
+    }
+  });
+  
+  sql.addEventListener('keydown', (e) => {
+    if (e.key !== 'Tab' || !suggestions.length) return;
+    e.preventDefault();
+    const word = wordAtCursor();
+    const replaced = word.includes('.') ? word.slice(word.lastIndexOf('.') + 1) : word;
+    const start = sql.selectionStart - replaced.length;
+    sql.setRangeText(suggestions[0].label, start, sql.selectionStart, 'end');
+    showSuggestions([]);
+    updateLength();
+  });
+  
   // Simple formatter: trims lines & uppercases common keywords
   function simpleFormat(text) {
     const keywords = ['select', 'from', 'where', 'and', 'or', 'group by', 'order by', 'insert', 'into', 'values', 'update', 'set', 'delete', 'create', 'table', 'join', 'left', 'right', 'inner', 'outer', 'limit'];
@@ -56,6 +108,19 @@ document.addEventListener('DOMContentLoaded', function() {
     }
   }
   
+  // Id of the query in flight, for the Cancel button
+  let runningQueryId = null;
+  
+  // Uploaded datasets are queryable as `dataset` (the current one) or by file name
+  function queryBody(q) {
+    const body = { sql: q, queryId: runningQueryId };
+    if (document.getElementById('engineSelect').value === 'dataset') {
+      body.engine = 'dataset';
+      if (currentDatasetId) body.datasetId = currentDatasetId;
+    }
+    return body;
+  }
+  
   async function runQuery() {
     const q = sql.value.trim();
     if (!q) {
@@ -65,12 +130,15 @@ document.addEventListener('DOMContentLoaded', function() {
     
     statusEl.textContent = 'Running…';
     setLoading(runBtn, true);
+    // Chosen here so the query can be cancelled before its response arrives
+    runningQueryId = Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+    cancelBtn.disabled = false;
     
     try {
       const response = await fetch('/execute-sql', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ sql: q })
+        body: JSON.stringify(queryBody(q))
       });
       
       // Check if response is JSON
@@ -95,15 +163,28 @@ document.addEventListener('DOMContentLoaded', function() {
         consoleEl.textContent = JSON.stringify(data, null, 2);
       }
       
-      statusEl.textContent = 'Done';
+      const rowLimit = response.headers.get('X-Row-Limit');
+      statusEl.textContent = rowLimit ? `Done (first ${rowLimit} rows)` : 'Done';
     } catch (err) {
       consoleEl.innerHTML = `<div class="message-error">Network error: ${err.message}</div>`;
       statusEl.textContent = 'Error';
     } finally {
+      runningQueryId = null;
+      cancelBtn.disabled = true;
       setLoading(runBtn, false);
     }
   }
   
+  cancelBtn.addEventListener('click', async () => {
+    if (!runningQueryId) return;
+    statusEl.textContent = 'Cancelling…';
+    try {
+      await fetch(`/queries/${encodeURIComponent(runningQueryId)}`, { method: 'DELETE' });
+    } catch {
+      // The query response reports the outcome
+    }
+  });
+  
   // Store original button text
   runBtn.setAttribute('data-original-text', runBtn.textContent);
   
@@ -130,6 +211,11 @@ document.addEventListener('DOMContentLoaded', function() {
   
   // Data Analyzer functionality
   let currentColumns = [];
+  let currentDatasetId = null;
+  
+  function datasetParam() {
+    return currentDatasetId ? `&dataset_id=${encodeURIComponent(currentDatasetId)}` : '';
+  }
   const uploadForm = document.getElementById('uploadForm');
   const uploadStatus = document.getElementById('uploadStatus');
   const uploadButton = uploadForm.querySelector('button[type="submit"]');
@@ -154,8 +240,21 @@ document.addEventListener('DOMContentLoaded', function() {
     const formData = new FormData();
     formData.append('file', file);
     
+    // Poll parsing progress while the upload runs
+    const uploadId = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    const progressTimer = setInterval(async () => {
+      try {
+        const progress = await (await fetch(`/upload-progress/${uploadId}`)).json();
+        if (!progress.error && progress.status === 'parsing') {
+          uploadStatus.innerHTML = `<span class="loading"></span> Processing... ${progress.percent}% (${progress.rows} rows)`;
+        }
+      } catch {
+        // Progress is best effort; the upload response reports the outcome
+      }
+    }, 500);
+    
     try {
-      const response = await fetch('/upload-dataset', {
+      const response = await fetch(`/upload-dataset?upload_id=${encodeURIComponent(uploadId)}`, {
         method: 'POST',
         body: formData
       });
@@ -184,12 +283,14 @@ document.addEventListener('DOMContentLoaded', function() {
           <div class="dataset-info">
             <h3>Current Dataset: ${file.name}</h3>
             <p>Shape: ${result.shape[0]} rows × ${result.shape[1]} columns</p>
+            ${result.sampled ? `<p>Analyzing the first ${result.inMemoryRows} rows (dataset exceeds the memory limit)</p>` : ''}
             <p>Rows inserted: ${result.rowsInserted}</p>
             <p>Database status: ${result.dbStatus || 'Data saved to database'}</p>
           </div>
         `;
         
         // Update column dropdown
+        currentDatasetId = result.datasetId;
         currentColumns = result.columns;
         const columnSelect = document.getElementById('columnSelect');
         columnSelect.innerHTML = '';
@@ -202,22 +303,54 @@ document.addEventListener('DOMContentLoaded', function() {
         
         document.getElementById('resultContent').innerHTML = "Dataset ready for analysis";
         uploadStatus.innerHTML = `<div class="message-success">${result.message}</div>`;
+        loadDashboard();
       }
     } catch (error) {
       console.error('Upload error:', error);
       uploadStatus.innerHTML = `<div class="message-error">Error uploading file: ${error.message}</div>`;
     } finally {
+      clearInterval(progressTimer);
       setLoading(uploadButton, false);
     }
   });
   
+  // Quick-analysis results for the current dataset, fetched in one /analyze/batch round trip
+  let dashboard = {};
+  
+  async function loadDashboard() {
+    dashboard = {};
+    const datasetId = currentDatasetId;
+    try {
+      const response = await fetch('/analyze/batch', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({
+          datasetId,
+          actions: ['head', 'dtypes', 'missing', 'summary', 'columns', 'value_counts']
+        })
+      });
+      const batch = await response.json();
+      if (batch.error || datasetId !== currentDatasetId) return;
+      batch.results.forEach(item => {
+        dashboard[`${item.action}|${item.column || ''}`] = item;
+      });
+    } catch {
+      // The buttons fall back to one /analyze request each
+    }
+  }
+  
   // Expose analyze and visualize functions to global scope
   window.analyze = async function(action) {
     const resultContent = document.getElementById('resultContent');
+    const cached = dashboard[`${action}|`];
+    if (cached) {
+      displayResult(cached);
+      return;
+    }
     resultContent.innerHTML = '<span class="loading"></span> Analyzing...';
     
     try {
-      const response = await fetch(`/analyze?action=${action}`);
+      const response = await fetch(`/analyze?action=${action}${datasetParam()}`);
       
       // Check if response is JSON
       const contentType = response.headers.get('content-type');
@@ -241,6 +374,8 @@ document.addEventListener('DOMContentLoaded', function() {
     }
   };
   
+  let chartUrl = null;
+  
   window.visualize = async function(action) {
     const column = document.getElementById('columnSelect').value;
     if (!column) {
@@ -249,16 +384,27 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     const resultContent = document.getElementById('resultContent');
+    const cached = dashboard[`${action}|${column}`];
+    if (cached) {
+      displayResult(cached);
+      return;
+    }
     resultContent.innerHTML = '<span class="loading"></span> Generating visualization...';
     
     try {
-      const response = await fetch(`/analyze?action=${action}&column=${encodeURIComponent(column)}`);
+      // Charts come back as raw PNG bytes; errors and data still come back as JSON
+      const response = await fetch(`/analyze?action=${action}&column=${encodeURIComponent(column)}&format=png${datasetParam()}`);
       
       // Check if response is JSON
       const contentType = response.headers.get('content-type');
       let result;
       
-      if (contentType && contentType.includes('application/json')) {
+      if (contentType && contentType.includes('image/png')) {
+        if (chartUrl) URL.revokeObjectURL(chartUrl);
+        chartUrl = URL.createObjectURL(await response.blob());
+        resultContent.innerHTML = `<img src="${chartUrl}" style="max-width:100%; margin-top:20px;">`;
+        return;
+      } else if (contentType && contentType.includes('application/json')) {
         result = await response.json();
       } else {
         // If not JSON, get the text and try to parse it
@@ -293,6 +439,13 @@ document.addEventListener('DOMContentLoaded', function() {
     } else if (Array.isArray(result.result)) {
       // List of items
       resultDiv.innerHTML = `<ul>${result.result.map(item => `<li>${item}</li>`).join('')}</ul>`;
+    } else if (result.result && result.result.approximate) {
+      // Heavy hitters of a column with too many distinct values to count exactly
+      const note = document.createElement('p');
+      note.textContent = `Approximate counts: each may be low by up to ${result.result.countError}.`;
+      const counts = document.createElement('pre');
+      counts.textContent = JSON.stringify(result.result.counts, null, 2);
+      resultDiv.replaceChildren(note, counts);
     } else {
       // JSON object
       resultDiv.innerHTML = `<pre>${JSON.stringify(result.result, null, 2)}</pre>`;
@@ -0,0 +1,80 @@
+"""Synthetic datasets for the benchmarks.
+
+Files have the name/age/city columns the SQL editor stores in uploaded_data,
+a few typed columns the analyzers care about, and optionally many extra
+numeric columns for wide-table runs. Generation is chunked, so 10M-row
+files are written without holding them in memory.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+CITIES = ["Oslo", "Rome", "Lima", "Pune", "Kyiv", "Cairo", "Perth", "Quito", "Seoul", "Dakar"]
+NAMES = ["Ann", "Bob", "Cy", "Dee", "Eve", "Finn", "Gus", "Hal", "Ivy", "Jo", "Kai", "Lea"]
+GENERATE_CHUNK_ROWS = 250_000
+# Excel sheets stop at 1,048,576 rows (including the header)
+XLSX_MAX_ROWS = 1_048_575
+SIZE_SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1m' -> 1000000, '2500' -> 2500"""
+    text = text.strip().lower()
+    if text[-1:] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def make_chunk(rng, start, rows, extra_columns=0):
+    """Rows [start, start + rows) of the synthetic table"""
+    n = np.arange(start, start + rows)
+    chunk = {
+        "name": np.array(NAMES)[rng.integers(0, len(NAMES), rows)],
+        "age": rng.integers(18, 90, rows),
+        "city": np.array(CITIES)[rng.zipf(1.6, rows).clip(1, len(CITIES)) - 1],
+        "score": rng.normal(50, 15, rows).round(3),
+        "visits": rng.poisson(4, rows),
+        "active": rng.random(rows) < 0.7,
+        "signup": (np.datetime64("2020-01-01") + (n % 1500).astype("timedelta64[D]")).astype(str),
+    }
+    # ~2% missing scores, as real exports tend to have
+    chunk["score"][rng.random(rows) < 0.02] = np.nan
+    for i in range(extra_columns):
+        chunk[f"f{i}"] = rng.random(rows).round(4)
+    return pd.DataFrame(chunk)
+
+
+def generate_dataset(directory, rows, fmt="csv", extra_columns=0, seed=42):
+    """Write (or reuse) a synthetic dataset and return its path"""
+    if fmt == "xlsx" and rows > XLSX_MAX_ROWS:
+        raise ValueError(f"XLSX files hold at most {XLSX_MAX_ROWS} rows")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"synthetic_{rows}x{7 + extra_columns}_s{seed}.{fmt}")
+    if os.path.exists(path):
+        return path
+    rng = np.random.default_rng(seed)
+    tmp = path + ".tmp"
+    if fmt == "csv":
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            for start in range(0, rows, GENERATE_CHUNK_ROWS):
+                chunk = make_chunk(rng, start, min(GENERATE_CHUNK_ROWS, rows - start), extra_columns)
+                chunk.to_csv(f, index=False, header=start == 0)
+    elif fmt == "xlsx":
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("data")
+        for start in range(0, rows, GENERATE_CHUNK_ROWS):
+            chunk = make_chunk(rng, start, min(GENERATE_CHUNK_ROWS, rows - start), extra_columns)
+            if start == 0:
+                sheet.append(list(chunk.columns))
+            for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False):
+                sheet.append(list(row))
+        with open(tmp, "wb") as f:
+            workbook.save(f)
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+    os.replace(tmp, path)
+    return path
+
@@ -0,0 +1,73 @@
+"""Concurrent load driver: N client threads replay a request mix for a fixed time."""
+import random
+import threading
+import time
+
+import httpx
+
+from stats import summarize
+
+
+def run_load(base_url, mix, concurrency=8, duration=10.0, seed=0):
+    """Drive `mix` — a list of (label, method, path, kwargs, weight) — from
+    `concurrency` threads for `duration` seconds; returns per-label and overall stats"""
+    labels = [item[0] for item in mix]
+    weights = [item[4] for item in mix]
+    latencies = {label: [] for label in labels}
+    errors = {label: 0 for label in labels}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(worker_id):
+        rng = random.Random(seed + worker_id)
+        local = {label: [] for label in labels}
+        local_errors = {label: 0 for label in labels}
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            while time.monotonic() < deadline:
+                label, method, path, kwargs, _ = rng.choices(mix, weights)[0]
+                started = time.perf_counter()
+                try:
+                    response = client.request(method, path, **kwargs)
+                    failed = response.status_code >= 400 or _is_error_body(response)
+                except httpx.HTTPError:
+                    failed = True
+                local[label].append((time.perf_counter() - started) * 1000)
+                local_errors[label] += failed
+        with lock:
+            for label in labels:
+                latencies[label].extend(local[label])
+                errors[label] += local_errors[label]
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [ms for values in latencies.values() for ms in values]
+    return {
+        "concurrency": concurrency,
+        "durationSeconds": round(elapsed, 3),
+        "requests": len(all_latencies),
+        "requestsPerSecond": round(len(all_latencies) / elapsed, 2) if elapsed else 0.0,
+        "errors": sum(errors.values()),
+        "latencyMs": summarize(all_latencies),
+        "byRequest": {
+            label: {"requests": len(latencies[label]), "errors": errors[label],
+                    "latencyMs": summarize(latencies[label])}
+            for label in labels
+        },
+    }
+
+
+def _is_error_body(response):
+    # The apps report most failures as 200 {"error": ...}
+    if not response.headers.get("content-type", "").startswith("application/json"):
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return True
+    return isinstance(body, dict) and "error" in body
@@ -0,0 +1,267 @@
+"""Benchmark the UniQ endpoints against the SQLite fallback.
+
+For every module / format / size / width combination this starts a fresh
+server, uploads a synthetic dataset, times queries and every /analyze
+action, runs the concurrent load driver and records the server's peak RSS
+per phase. Results are written as JSON and can be compared with an earlier
+run to catch regressions:
+
+    python benchmarks/run.py --sizes 10k,100k,1m --formats csv,xlsx --wide 0,100
+    python benchmarks/run.py --baseline benchmarks/results/v1.json
+
+MySQL must not be reachable on 127.0.0.1:3306, otherwise the SQL editor uses
+it instead of SQLite; the backend used is recorded in every result.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from datasets import XLSX_MAX_ROWS, generate_dataset, parse_size
+from load import run_load
+from server import Server
+from stats import compare, summarize
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# name, SQL, extra /execute-sql fields
+SQL_QUERIES = [
+    ("count", "SELECT COUNT(*) AS n FROM uploaded_data", {}),
+    ("point_lookup", "SELECT * FROM uploaded_data WHERE id = 42", {}),
+    ("group_by", "SELECT city, COUNT(*) AS n, AVG(age) AS avg_age FROM uploaded_data GROUP BY city", {}),
+    ("top_n", "SELECT name, age, city FROM uploaded_data ORDER BY age DESC LIMIT 100", {}),
+    ("first_page", "SELECT * FROM uploaded_data", {"pageSize": 500}),
+    ("group_by_cached", "SELECT city, MAX(age) AS oldest FROM uploaded_data GROUP BY city", {"cache": True}),
+    ("dataset_group_by", "SELECT city, AVG(score) AS s, SUM(visits) AS v FROM dataset GROUP BY city",
+     {"engine": "dataset"}),
+]
+
+# action, column, extra query parameters
+SQL_ACTIONS = [
+    ("summary", None, {}), ("head", None, {}), ("columns", None, {}), ("missing", None, {}),
+    ("dtypes", None, {}), ("value_counts", "city", {}),
+    ("histogram", "age", {}), ("histogram", "age", {"mode": "data"}),
+    ("boxplot", "score", {}), ("boxplot", "score", {"mode": "data"}),
+    ("scatter", "age", {}), ("scatter", "age", {"mode": "data"}),
+    ("line", "score", {}), ("correlation", None, {}), ("correlation", None, {"mode": "data"}),
+]
+ONECLICK_ACTIONS = [
+    ("summary", None, {}), ("head", None, {}), ("columns", None, {}), ("missing", None, {}),
+    ("dtypes", None, {}), ("value_counts", "city", {}),
+    ("histogram", "age", {}), ("boxplot", "score", {}), ("scatter", "age", {}), ("correlation", None, {}),
+]
+UPLOAD_PATHS = {"sql": "/upload-dataset", "oneclick": "/upload"}
+
+
+def time_ms(fn):
+    started = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - started) * 1000, result
+
+
+def check(response):
+    response.raise_for_status()
+    if response.status_code == 304:
+        return None
+    body = response.json()
+    if isinstance(body, dict) and "error" in body:
+        raise RuntimeError(body["error"])
+    return body
+
+
+def bench_upload(client, server, path):
+    server.reset_peak_rss()
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        ms, body = time_ms(lambda: check(client.post(
+            UPLOAD_PATHS[server.module], files={"file": (os.path.basename(path), f)}, timeout=None)))
+    seconds = ms / 1000
+    rows = body["shape"][0]
+    result = {
+        "seconds": round(seconds, 3),
+        "rows": rows,
+        "bytes": size,
+        "rowsPerSecond": round(rows / seconds, 1),
+        "mbPerSecond": round(size / 1024 / 1024 / seconds, 2),
+        "peakRssMb": server.peak_rss_mb(),
+        "sampled": body.get("sampled"),
+    }
+    for key in ("rowsInserted", "rowsPerSecond", "insertMethod"):
+        if key in body:
+            result["db" + key[0].upper() + key[1:]] = body[key]
+    return body["datasetId"], result
+
+
+def bench_queries(client, server, repeat):
+    server.reset_peak_rss()
+    results = {}
+    for name, sql, extra in SQL_QUERIES:
+        payload = {"sql": sql, "cache": False, **extra}
+        latencies = []
+        for _ in range(repeat):
+            ms, body = time_ms(lambda: check(client.post("/execute-sql", json=payload)))
+            latencies.append(ms)
+        results[name] = {"id": name, "latencyMs": summarize(latencies)}
+    return {"queries": list(results.values()), "peakRssMb": server.peak_rss_mb()}
+
+
+def bench_analyze(client, server, dataset_id, actions, repeat):
+    """First call (cold) and repeated calls (warm, served from the profile and chart caches) per action"""
+    server.reset_peak_rss()
+    results = []
+    for action, column, extra in actions:
+        params = {"action": action, "dataset_id": dataset_id, **extra}
+        if column:
+            params["column"] = column
+        cold, _ = time_ms(lambda: check(client.get("/analyze", params=params)))
+        warm = [time_ms(lambda: check(client.get("/analyze", params=params)))[0] for _ in range(repeat)]
+        label = action + (f"[{extra['mode']}]" if "mode" in extra else "")
+        results.append({"id": label, "coldMs": round(cold, 3), "warmMs": summarize(warm)})
+    # The dashboard's table actions plus value_counts for every column in one /analyze/batch call
+    body = {"datasetId": dataset_id, "actions": ["head", "dtypes", "missing", "summary", "columns", "value_counts"]}
+    cold, _ = time_ms(lambda: check(client.post("/analyze/batch", json=body)))
+    warm = [time_ms(lambda: check(client.post("/analyze/batch", json=body)))[0] for _ in range(repeat)]
+    results.append({"id": "batch[dashboard]", "coldMs": round(cold, 3), "warmMs": summarize(warm)})
+    return {"actions": results, "peakRssMb": server.peak_rss_mb()}
+
+
+def load_mix(module, dataset_id):
+    if module == "sql":
+        return [
+            ("query_group_by", "POST", "/execute-sql",
+             {"json": {"sql": SQL_QUERIES[2][1], "cache": False}}, 4),
+            ("query_cached", "POST", "/execute-sql", {"json": {"sql": SQL_QUERIES[5][1]}}, 2),
+            ("analyze_summary", "GET", "/analyze", {"params": {"action": "summary", "dataset_id": dataset_id}}, 2),
+            ("analyze_histogram", "GET", "/analyze",
+             {"params": {"action": "histogram", "column": "age", "dataset_id": dataset_id}}, 1),
+            ("health", "GET", "/health", {}, 1),
+        ]
+    return [
+        ("analyze_summary", "GET", "/analyze", {"params": {"action": "summary", "dataset_id": dataset_id}}, 3),
+        ("analyze_value_counts", "GET", "/analyze",
+         {"params": {"action": "value_counts", "column": "city", "dataset_id": dataset_id}}, 2),
+        ("analyze_histogram", "GET", "/analyze",
+         {"params": {"action": "histogram", "column": "age", "dataset_id": dataset_id}}, 1),
+    ]
+
+
+def run_case(args, module, fmt, rows, wide, workdir):
+    path = generate_dataset(args.data_dir, rows, fmt, wide)
+    env = {"MYSQL_CONNECT_TIMEOUT": "1", "DATASET_STORE_DIR": os.path.join(workdir, "datasets")}
+    case = {
+        "id": f"{module}-{fmt}-{rows}x{7 + wide}",
+        "module": module,
+        "dataset": {"format": fmt, "rows": rows, "columns": 7 + wide, "bytes": os.path.getsize(path)},
+    }
+    with Server(module, workdir, env=env, workers=args.workers) as server:
+        with httpx.Client(base_url=server.url, timeout=600) as client:
+            if module == "sql":
+                case["backend"] = client.get("/health").json().get("backend")
+            dataset_id, case["upload"] = bench_upload(client, server, path)
+            if module == "sql":
+                case["sql"] = bench_queries(client, server, args.repeat)
+            actions = SQL_ACTIONS if module == "sql" else ONECLICK_ACTIONS
+            case["analyze"] = bench_analyze(client, server, dataset_id, actions, args.repeat)
+        if args.duration > 0:
+            server.reset_peak_rss()
+            case["load"] = run_load(server.url, load_mix(module, dataset_id), args.concurrency, args.duration)
+            case["load"]["peakRssMb"] = server.peak_rss_mb()
+        case["peakRssMb"] = server.peak_rss_mb()
+    return case
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_case(case):
+    upload = case["upload"]
+    print(f"  upload: {upload['seconds']}s, {upload['rowsPerSecond']:.0f} rows/s, "
+          f"{upload['mbPerSecond']} MB/s, peak {upload['peakRssMb']} MiB")
+    for query in case.get("sql", {}).get("queries", []):
+        lat = query["latencyMs"]
+        print(f"  sql {query['id']:<18} p50 {lat['p50']:>9.2f} ms  p95 {lat['p95']:>9.2f} ms")
+    for action in case["analyze"]["actions"]:
+        print(f"  analyze {action['id']:<22} cold {action['coldMs']:>9.2f} ms  "
+              f"warm p50 {action['warmMs']['p50']:>9.2f} ms")
+    if "load" in case:
+        load = case["load"]
+        print(f"  load x{load['concurrency']}: {load['requestsPerSecond']} req/s, "
+              f"p95 {load['latencyMs'].get('p95')} ms, {load['errors']} errors")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--modules", default="sql,oneclick", help="comma-separated: sql, oneclick")
+    parser.add_argument("--sizes", default="10k,100k", help="row counts, e.g. 10k,100k,1m,10m")
+    parser.add_argument("--formats", default="csv", help="comma-separated: csv, xlsx")
+    parser.add_argument("--wide", default="0", help="extra numeric columns per run, e.g. 0,200")
+    parser.add_argument("--repeat", type=int, default=20, help="timed repetitions per query/action")
+    parser.add_argument("--concurrency", type=int, default=8, help="load driver client threads")
+    parser.add_argument("--duration", type=float, default=10, help="load phase seconds (0 to skip)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "uniq-bench-data"),
+                        help="where generated datasets are cached")
+    parser.add_argument("--output", default=os.path.join(HERE, "results", "latest.json"))
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="regression tolerance (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    run = {
+        "meta": {
+            "startedAt": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpuCount": os.cpu_count(),
+            "args": vars(args),
+        },
+        "cases": [],
+    }
+    workdir = tempfile.mkdtemp(prefix="uniq-bench-")
+    for module in args.modules.split(","):
+        for fmt in args.formats.split(","):
+            for rows in map(parse_size, args.sizes.split(",")):
+                if fmt == "xlsx" and rows > XLSX_MAX_ROWS:
+                    print(f"skipping {fmt} x {rows} rows: over the Excel row limit")
+                    continue
+                for wide in map(int, args.wide.split(",")):
+                    print(f"{module} {fmt} {rows} rows x {7 + wide} columns")
+                    try:
+                        case = run_case(args, module, fmt, rows, wide, os.path.join(workdir, module))
+                    except Exception as e:
+                        print(f"  failed: {e}")
+                        run["cases"].append({"id": f"{module}-{fmt}-{rows}x{7 + wide}", "error": str(e)})
+                        continue
+                    print_case(case)
+                    run["cases"].append(case)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        run["regressions"] = compare({"cases": run["cases"]}, {"cases": baseline["cases"]}, args.threshold)
+        for regression in run["regressions"]:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']} -> "
+                  f"{regression['current']} (+{regression['change']:.0%})")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"results written to {args.output}")
+    failed = any("error" in case for case in run["cases"])
+    return 1 if failed or run.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Start a module's app under uvicorn in a scratch directory and watch its memory.
+
+The modules expect static/ and templates/ next to main.py and write their
+SQLite database and dataset store to the working directory, so each run
+gets a fresh copy of the module (plus the shared uniq_shared package) laid
+out that way.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = {
+    "sql": "SQL_Editor_Module",
+    "oneclick": "OneClick_Module",
+}
+READY_PATHS = {"sql": "/health", "oneclick": "/datasets"}
+SHARED_PACKAGE = "uniq_shared"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare_module(module, workdir):
+    """Copy a module into `workdir` with the static/ and templates/ layout it serves from"""
+    source = os.path.join(REPO_ROOT, MODULES[module])
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(os.path.join(workdir, "static"))
+    os.makedirs(os.path.join(workdir, "templates"))
+    for filename in os.listdir(source):
+        path = os.path.join(source, filename)
+        if filename.endswith(".py"):
+            shutil.copy(path, workdir)
+        elif filename == "index.html":
+            shutil.copy(path, os.path.join(workdir, "templates"))
+        elif filename.endswith((".js", ".css")):
+            shutil.copy(path, os.path.join(workdir, "static"))
+    # Code both modules import; main.py finds it next to itself as well as at the repo root
+    shutil.copytree(os.path.join(REPO_ROOT, SHARED_PACKAGE), os.path.join(workdir, SHARED_PACKAGE),
+                    ignore=shutil.ignore_patterns("__pycache__"))
+    return workdir
+
+
+def child_pids(pid):
+    """Direct and indirect children of `pid` (render workers, uvicorn workers)"""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents.setdefault(int(f.read().rsplit(")", 1)[1].split()[1]), []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    found, stack = [], [pid]
+    while stack:
+        for child in parents.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def peak_rss_mb(pid):
+    """Peak resident set size of the process tree in MiB (Linux only, else None)"""
+    total_kb = 0
+    for p in [pid] + child_pids(pid):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1) if total_kb else None
+
+
+def reset_peak_rss(pid):
+    """Restart the peak RSS counters so each phase gets its own high-water mark"""
+    for p in [pid] + child_pids(pid):
+        try:
+            with open(f"/proc/{p}/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+
+class Server:
+    """A running module; use as a context manager"""
+
+    def __init__(self, module, workdir, env=None, workers=1, startup_timeout=60):
+        self.module = module
+        self.workdir = prepare_module(module, workdir)
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = {**os.environ, "PYTHONUNBUFFERED": "1", **(env or {})}
+        self.workers = workers
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.log = None
+
+    def __enter__(self):
+        self.log = open(os.path.join(self.workdir, "server.log"), "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=self.workdir, env=self.env, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.module} server exited; see {self.log.name}")
+            try:
+                if httpx.get(self.url + READY_PATHS[self.module], timeout=2).status_code < 500:
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.25)
+        self.__exit__()
+        raise RuntimeError(f"{self.module} server did not start in {self.startup_timeout}s")
+
+    def __exit__(self, *exc):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.log is not None:
+            self.log.close()
+
+    def peak_rss_mb(self):
+        return peak_rss_mb(self.process.pid)
+
+    def reset_peak_rss(self):
+        reset_peak_rss(self.process.pid)
@@ -0,0 +1,74 @@
+"""Latency summaries and regression comparison for benchmark results."""
+import math
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(sorted_values, pct):
+    """Linear-interpolated percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * pct / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize(values):
+    """count/mean/min/max and p50..p99 of a list of milliseconds"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    summary = {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "min": round(ordered[0], 3),
+        "max": round(ordered[-1], 3),
+    }
+    for pct in PERCENTILES:
+        summary[f"p{pct}"] = round(percentile(ordered, pct), 3)
+    return summary
+
+
+# Metrics where a larger number is worse; everything else is ignored by compare()
+LOWER_IS_BETTER = ("p50", "p95", "p99", "mean", "seconds", "coldMs", "peakRssMb")
+HIGHER_IS_BETTER = ("rowsPerSecond", "mbPerSecond", "requestsPerSecond")
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        items = {}
+        for key, inner in value.items():
+            items.update(flatten(inner, f"{prefix}.{key}" if prefix else str(key)))
+        return items
+    if isinstance(value, list):
+        items = {}
+        for inner in value:
+            if isinstance(inner, dict) and "id" in inner:
+                items.update(flatten(inner, f"{prefix}[{inner['id']}]"))
+        return items
+    return {prefix: value} if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+
+
+def compare(current, baseline, threshold=0.2, min_ms=1.0):
+    """Metrics that got worse than `baseline` by more than `threshold` (0.2 = 20%).
+
+    Latencies below `min_ms` in both runs are skipped; they are mostly noise."""
+    now, before = flatten(current), flatten(baseline)
+    regressions = []
+    for key, old in before.items():
+        new = now.get(key)
+        metric = key.rsplit(".", 1)[-1]
+        if new is None or not old:
+            continue
+        if metric in LOWER_IS_BETTER:
+            if metric not in ("seconds", "peakRssMb") and max(old, new) < min_ms:
+                continue
+            change = (new - old) / old
+        elif metric in HIGHER_IS_BETTER:
+            change = (old - new) / old
+        else:
+            continue
+        if change > threshold:
+            regressions.append({"metric": key, "baseline": old, "current": new,
+                                "change": round(change, 3)})
+    return sorted(regressions, key=lambda r: -r["change"])
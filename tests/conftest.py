@@ -0,0 +1,60 @@
+import os
+import shutil
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = {"sql": "SQL_Editor_Module", "oneclick": "OneClick_Module"}
+# uniq_shared for the tests that use it directly
+sys.path.insert(0, REPO_ROOT)
+
+
+def prepare_module(module, workdir):
+    """Copy a module into `workdir` with the static/ and templates/ layout it serves from"""
+    source = os.path.join(REPO_ROOT, MODULES[module])
+    os.makedirs(os.path.join(workdir, "static"))
+    os.makedirs(os.path.join(workdir, "templates"))
+    for filename in os.listdir(source):
+        path = os.path.join(source, filename)
+        if filename.endswith(".py"):
+            shutil.copy(path, workdir)
+        elif filename == "index.html":
+            shutil.copy(path, os.path.join(workdir, "templates"))
+        elif filename.endswith((".js", ".css")):
+            shutil.copy(path, os.path.join(workdir, "static"))
+    shutil.copytree(os.path.join(REPO_ROOT, "uniq_shared"), os.path.join(workdir, "uniq_shared"),
+                    ignore=shutil.ignore_patterns("__pycache__"))
+
+
+def load_app(module, tmp_path, monkeypatch):
+    """Import a fresh copy of a module's main.py, running from `tmp_path`"""
+    prepare_module(module, str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setenv("PROFILE_PROCESSES", "0")
+    monkeypatch.setenv("RENDER_PROCESSES", "0")
+    for name in list(sys.modules):
+        if name == "main" or name.split(".")[0] == "uniq_shared":
+            del sys.modules[name]
+    import main
+    return main
+
+
+@pytest.fixture
+def sql_app(tmp_path, monkeypatch):
+    """SQL editor app on its SQLite fallback, with a test client"""
+    main = load_app("sql", tmp_path, monkeypatch)
+    # Keep MySQL out of the picture: an open breaker goes straight to SQLite
+    main.mysql_breaker.state = "open"
+    main.mysql_breaker.opened_at = float("inf")
+    with TestClient(main.app) as client:
+        yield main, client
+
+
+@pytest.fixture
+def oneclick_app(tmp_path, monkeypatch):
+    main = load_app("oneclick", tmp_path, monkeypatch)
+    with TestClient(main.app) as client:
+        yield main, client
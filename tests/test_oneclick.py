@@ -0,0 +1,15 @@
+def test_upload_reports_progress_and_timing(oneclick_app):
+    main, client = oneclick_app
+    csv = "city,temp\n" + "".join(f"c{i % 3},{i}\n" for i in range(30))
+
+    upload = client.post("/upload?upload_id=u-1", files={"file": ("temps.csv", csv.encode())})
+    assert upload.json()["shape"] == [30, 2]
+    assert "parse;dur=" in upload.headers["Server-Timing"]
+    progress = client.get("/upload-progress/u-1").json()
+    assert progress["status"] == "done" and progress["rows"] == 30
+
+    counts = client.get("/analyze", params={"action": "value_counts", "column": "city"}).json()
+    assert counts["result"] == {"c0": 10, "c1": 10, "c2": 10}
+    metrics = client.get("/metrics").text
+    assert 'uniq_result_rows_count{route="/upload"} 1' in metrics
+    assert "# TYPE uniq_datasets_memory_bytes gauge" in metrics
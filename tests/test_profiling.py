@@ -0,0 +1,28 @@
+import pandas as pd
+
+from uniq_shared import profiling
+from uniq_shared.profiling import ProfileBuilder, profile_answer
+
+
+def test_heavy_hitters_are_reported_as_approximate(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_MAX_DISTINCT", 50)
+    monkeypatch.setattr(profiling, "PROFILE_HEAVY_HITTERS", 5)
+    # "hot" stands out from 200 values seen once each
+    chunk = pd.DataFrame({"key": ["hot"] * 100 + [f"k{i}" for i in range(200)]})
+    builder = ProfileBuilder()
+    builder.add(chunk)
+    profile = builder.finish(chunk.head(10), sampled=True)
+
+    answer = profile_answer(profile, "value_counts", "key")
+    assert answer["approximate"] is True
+    assert answer["countError"] == profile["stats"]["key"]["countError"] > 0
+    assert 100 - answer["countError"] <= answer["counts"]["hot"] <= 100
+
+
+def test_exact_value_counts_are_returned_as_is():
+    chunk = pd.DataFrame({"key": ["a", "b", "a"]})
+    builder = ProfileBuilder()
+    builder.add(chunk)
+    profile = builder.finish(chunk, sampled=False)
+
+    assert profile_answer(profile, "value_counts", "key") == {"a": 2, "b": 1}
@@ -0,0 +1,91 @@
+import json
+from io import BytesIO
+
+import pandas as pd
+
+
+def execute(client, **body):
+    return client.post("/execute-sql", json=body)
+
+
+def make_numbers(client, count):
+    execute(client, sql="CREATE TABLE nums (n INTEGER)")
+    execute(client, sql="INSERT INTO nums WITH RECURSIVE r(n) AS "
+                        f"(SELECT 1 UNION ALL SELECT n + 1 FROM r WHERE n < {count}) SELECT n FROM r")
+
+
+def test_capped_result_is_not_served_to_uncapped_request(sql_app):
+    main, client = sql_app
+    make_numbers(client, 20)
+
+    capped = execute(client, sql="SELECT n FROM nums", maxRows=5)
+    assert len(capped.json()) == 5
+    assert capped.headers["X-Row-Limit"] == "5"
+
+    full = execute(client, sql="SELECT n FROM nums")
+    assert len(full.json()) == 20
+    assert "X-Row-Limit" not in full.headers
+    assert full.headers["X-Query-Cache"] == "miss"
+
+
+def test_cache_hit_applies_row_cap(sql_app):
+    main, client = sql_app
+    make_numbers(client, 20)
+
+    assert execute(client, sql="SELECT n FROM nums").headers["X-Query-Cache"] == "miss"
+    capped = execute(client, sql="SELECT n FROM nums", maxRows=5)
+    assert capped.headers["X-Query-Cache"] == "hit"
+    assert [row["n"] for row in capped.json()] == [1, 2, 3, 4, 5]
+    assert capped.headers["X-Row-Limit"] == "5"
+
+
+def test_cost_estimate_counts_rows_after_deletes(sql_app, monkeypatch):
+    main, client = sql_app
+    make_numbers(client, 3000)
+    monkeypatch.setattr(main, "QUERY_MAX_COST", 1_000_000)
+    join = "SELECT a.n, b.n FROM nums a, nums b ORDER BY a.n"
+
+    assert "estimated cost 9,000,000" in execute(client, sql=join, cache=False).json()["error"]
+    # Row ids keep climbing after a delete; the estimate must follow the rows that are left
+    execute(client, sql="DELETE FROM nums WHERE n <= 2990")
+    assert len(execute(client, sql=join, cache=False).json()) == 100
+
+
+def test_paged_query_holds_no_connection_between_pages(sql_app):
+    main, client = sql_app
+    make_numbers(client, 25)
+
+    first = execute(client, sql="SELECT n FROM nums ORDER BY n DESC", pageSize=10).json()
+    assert [row["n"] for row in first["rows"]] == list(range(25, 15, -1))
+    # An unfinished cursor must not lock writers out
+    assert "success" in execute(client, sql="INSERT INTO nums VALUES (0)").json()
+
+    second = execute(client, continuationToken=first["nextToken"], pageSize=10).json()
+    third = execute(client, continuationToken=second["nextToken"], pageSize=10).json()
+    assert [row["n"] for row in second["rows"]] == list(range(15, 5, -1))
+    assert [row["n"] for row in third["rows"]] == list(range(5, -1, -1))
+    assert third["rowsSoFar"] == 26 and third["nextToken"] is None
+    assert "error" in execute(client, continuationToken="not-a-token").json()
+
+
+def test_stream_reads_in_batches(sql_app, monkeypatch):
+    main, client = sql_app
+    make_numbers(client, 25)
+    monkeypatch.setattr(main, "STREAM_FETCH_SIZE", 10)
+
+    lines = execute(client, sql="SELECT n FROM nums LIMIT 22", stream=True).text.splitlines()
+    assert len(lines) == 24
+    assert lines[-1] == '{"done": true, "rowCount": 22}'
+
+
+def test_upload_with_datetime_column_is_persisted(sql_app):
+    main, client = sql_app
+    df = pd.DataFrame({"day": pd.date_range("2024-01-01", periods=6).repeat(2), "n": range(12)})
+    workbook = BytesIO()
+    df.to_excel(workbook, index=False)
+
+    upload = client.post("/upload-dataset", files={"file": ("days.xlsx", workbook.getvalue())}).json()
+    entry = main.datasets.get(upload["datasetId"])
+    assert entry.info()["persisted"]
+    with open(entry.profile_path, encoding="utf-8") as f:
+        assert json.load(f)["valueCounts"]["day"]["2024-01-03T00:00:00"] == 2
@@ -0,0 +1,37 @@
+import os
+
+import pandas as pd
+
+from uniq_shared.store import DatasetRegistry
+
+
+def mixed_frame(rows):
+    # Object columns of mixed types cannot be stored as Arrow, so they spill
+    return pd.DataFrame({"value": [1, "a"] * (rows // 2)})
+
+
+def test_spill_directory_is_created_on_first_spill_and_removed_with_it(tmp_path):
+    registry = DatasetRegistry(1, str(tmp_path / "store"), None, 10)
+    first = registry.add("first.csv", mixed_frame(100), {})
+    assert registry._own_spill_dir is None
+
+    registry.add("second.csv", mixed_frame(100), {})
+    spill_dir = registry._own_spill_dir
+    assert os.path.exists(first.spill_path)
+
+    assert registry.remove(first.id)
+    assert not os.path.exists(spill_dir)
+    assert registry._own_spill_dir is None
+
+
+def test_close_removes_spill_files(tmp_path):
+    spill_dir = tmp_path / "spill"
+    registry = DatasetRegistry(1, str(tmp_path / "store"), str(spill_dir), 10)
+    first = registry.add("first.csv", mixed_frame(100), {})
+    second = registry.add("second.csv", mixed_frame(100), {})
+    assert os.listdir(spill_dir) == [first.id + ".pkl.gz"]
+
+    registry.close()
+    assert os.listdir(spill_dir) == []
+    assert registry.get(first.id) is None
+    assert registry.get(second.id) is second
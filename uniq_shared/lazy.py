@@ -0,0 +1,46 @@
+"""Deferred imports for modules most workers never touch.
+
+The plotting stack and the database drivers take most of an app's import
+time, so the apps bind them to LazyModule stand-ins imported on first use.
+"""
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# module name -> seconds its first use spent importing it, reported on /metrics
+lazy_import_seconds = {}
+
+
+class LazyModule:
+    """Stand-in for a heavy module that imports it on first attribute access"""
+
+    def __init__(self, name, setup=None):
+        self._name = name
+        self._setup = setup
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    if self._setup is not None:
+                        self._setup()
+                    module = importlib.import_module(self._name)
+                    lazy_import_seconds[self._name] = round(time.perf_counter() - started, 3)
+                    logger.info(f"Imported {self._name} in {lazy_import_seconds[self._name]}s")
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+def use_headless_backend():
+    # Servers have no display; pick Agg before pyplot chooses a GUI backend
+    import matplotlib
+    matplotlib.use("Agg")
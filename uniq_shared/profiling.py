@@ -0,0 +1,425 @@
+"""Dataset profiling shared by the SQL editor and OneClick.
+
+A profile is built in the same single pass that parses an upload, from
+mergeable accumulators, and answers most /analyze actions without touching
+the data again.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# Profile settings
+PROFILE_MAX_DISTINCT = int(os.getenv("PROFILE_MAX_DISTINCT", "10000"))
+PROFILE_TOP_K = int(os.getenv("PROFILE_TOP_K", "10"))
+# Counters kept per column once it has more than PROFILE_MAX_DISTINCT values (Misra-Gries)
+PROFILE_HEAVY_HITTERS = int(os.getenv("PROFILE_HEAVY_HITTERS", "1000"))
+# Quantile sketch size; rank error is roughly 1 / PROFILE_SKETCH_K
+PROFILE_SKETCH_K = int(os.getenv("PROFILE_SKETCH_K", "400"))
+# Chunks after the first are profiled in these processes while the parser reads on; 0 = inline
+PROFILE_PROCESSES = int(os.getenv("PROFILE_PROCESSES", str(max(0, min(4, (os.cpu_count() or 1) - 1)))))
+
+def to_python(value):
+    """numpy scalars -> plain Python values for JSON"""
+    return value.item() if hasattr(value, 'item') else value
+
+def count_key(value):
+    """A value_counts key JSON can hold: dates become ISO strings, as in API responses"""
+    value = to_python(value)
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+def count_dict(counts):
+    return {count_key(value): int(n) for value, n in counts.items()}
+
+def is_numeric_column(series):
+    # describe() treats booleans as categorical
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def misra_gries(counts, capacity):
+    """Keep the `capacity` largest counters, lowering all by the first one dropped;
+    returns (counts, decrement). Every count is then undercounted by at most
+    the sum of the decrements, and any value above that bound is kept."""
+    if len(counts) <= capacity:
+        return counts, 0
+    cut = counts.nlargest(capacity + 1).iloc[-1]
+    counts = counts[counts > cut] - cut
+    return counts, cut
+
+
+class QuantileSketch:
+    """Mergeable approximate quantiles, a KLL-style stack of compactors.
+
+    Level h holds values of weight 2**h. A level over its capacity is sorted
+    and every other value moves up a level, so a column of any length needs
+    O(k log n) memory, and sketches of separate chunks merge into one."""
+
+    def __init__(self, k=PROFILE_SKETCH_K):
+        self.k = k
+        self.count = 0
+        self.levels = []
+        self._flip = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype='float64')
+        self.count += len(values)
+        self._push(0, values)
+        self._compact()
+
+    def merge(self, other):
+        self.count += other.count
+        for h, level in enumerate(other.levels):
+            self._push(h, level)
+        self._compact()
+
+    def quantiles(self, qs):
+        if not self.count:
+            return [float('nan')] * len(qs)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values, weights = values[order], weights[order]
+        # Each value stands for `weight` consecutive ranks; interpolate between their centres
+        # (the same linear interpolation as Series.quantile while nothing was compacted)
+        centres = np.cumsum(weights) - (weights + 1) / 2
+        return np.interp(np.asarray(qs) * (weights.sum() - 1), centres, values).tolist()
+
+    def _push(self, h, values):
+        while len(self.levels) <= h:
+            self.levels.append(np.empty(0))
+        self.levels[h] = np.concatenate([self.levels[h], values])
+
+    def _capacity(self, h):
+        # Lower levels get geometrically smaller buffers
+        return max(8, int(self.k * (2 / 3) ** (len(self.levels) - h - 1)))
+
+    def _compact(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) > self._capacity(h):
+                level = np.sort(level)
+                odd = len(level) % 2
+                # Alternating which half is promoted keeps the estimate unbiased
+                self._flip ^= 1
+                self._push(h + 1, level[odd + self._flip::2])
+                self.levels[h] = level[:odd]
+            h += 1
+
+
+class CoMoments:
+    """Pairwise-complete covariance of the numeric columns, mergeable across chunks.
+
+    Entry [i, j] of each matrix describes column i over the rows where both
+    i and j are present: n, mean, m2 (sum of squared deviations) and, in `c`,
+    the co-moment with column j. Chunks merge with the same update as the
+    per-column moments, so correlation() matches DataFrame.corr() on all rows."""
+
+    def __init__(self, columns=(), n=None, mean=None, m2=None, c=None):
+        self.columns = list(columns)
+        size = (len(self.columns),) * 2
+        self.n = np.zeros(size) if n is None else n
+        self.mean = np.zeros(size) if mean is None else mean
+        self.m2 = np.zeros(size) if m2 is None else m2
+        self.c = np.zeros(size) if c is None else c
+
+    @classmethod
+    def from_frame(cls, frame):
+        values = frame.to_numpy(dtype='float64', na_value=np.nan)
+        present = ~np.isnan(values)
+        # Centring on the chunk's column means keeps the one-pass sums below accurate
+        counts = present.sum(axis=0)
+        shift = np.where(present, values, 0.0).sum(axis=0) / np.maximum(counts, 1)
+        x = np.where(present, values - shift, 0.0)
+        p = present.astype('float64')
+        n = p.T @ p
+        s = x.T @ p
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, s / n, 0.0)
+        return cls(frame.columns, n, mean + shift[:, None],
+                   (x * x).T @ p - s * mean, x.T @ x - s * mean.T)
+
+    def merge(self, other):
+        if other.columns != self.columns:
+            columns = self.columns + [col for col in other.columns if col not in self.columns]
+            self._expand(columns)
+            other._expand(columns)
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(n > 0, other.n / n, 0.0)
+            scale = np.where(n > 0, self.n * other.n / n, 0.0)
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + other.m2 + delta * delta * scale
+        self.c = self.c + other.c + delta * delta.T * scale
+        self.n = n
+
+    def correlation(self, columns):
+        """Pearson correlation of `columns` (NaN where fewer than two shared rows)"""
+        index = [self.columns.index(col) if col in self.columns else None for col in columns]
+        found = [i for i in index if i is not None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = self.c / np.sqrt(self.m2 * self.m2.T)
+        corr = np.where(self.n > 1, np.clip(corr, -1.0, 1.0), np.nan)
+        matrix = np.full((len(columns),) * 2, np.nan)
+        positions = [pos for pos, i in enumerate(index) if i is not None]
+        matrix[np.ix_(positions, positions)] = corr[np.ix_(found, found)]
+        return pd.DataFrame(matrix, index=columns, columns=columns)
+
+    def _expand(self, columns):
+        size = len(columns)
+        for name in ("n", "mean", "m2", "c"):
+            grown = np.zeros((size, size))
+            grown[:len(self.columns), :len(self.columns)] = getattr(self, name)
+            setattr(self, name, grown)
+        self.columns = columns
+
+
+class ProfileBuilder:
+    """Accumulates per-column statistics chunk by chunk, so a dataset is
+    profiled in the same single pass that parses it.
+
+    Every accumulator is mergeable: exact moments (Chan's parallel update of
+    Welford's), value counts that fall back to Misra-Gries heavy hitters past
+    PROFILE_MAX_DISTINCT values, quantile sketches and pairwise co-moments for
+    the correlation matrix. With an executor, chunks after the first are
+    profiled there in parallel and merged in order, so a file far larger than
+    the in-memory sample is still described in full."""
+
+    def __init__(self, executor=None):
+        self.rows = 0
+        self.head = None
+        self.nulls = {}
+        # column -> merged value counts; Misra-Gries counters once a column exceeds PROFILE_MAX_DISTINCT values
+        self.counts = {}
+        self.high_cardinality = set()
+        # column -> largest possible undercount of its heavy-hitter counters
+        self.count_error = {}
+        # column -> [count, mean, m2, min, max], merged with Chan's parallel algorithm
+        self.moments = {}
+        self.sketches = {}
+        self.comoments = CoMoments()
+        self.executor = executor
+        self._pending = deque()
+
+    def add(self, chunk):
+        if self.executor is None or self.head is None:
+            self.merge(profile_chunk(chunk))
+            return
+        self._pending.append(self.executor.submit(profile_chunk, chunk))
+        # Bound the chunks waiting in the pool
+        while len(self._pending) > 2 * PROFILE_PROCESSES:
+            self.merge(self._pending.popleft().result())
+
+    def merge(self, other):
+        if self.head is None:
+            self.head = other.head
+        self.rows += other.rows
+        for col, nulls in other.nulls.items():
+            self.nulls[col] = self.nulls.get(col, 0) + nulls
+        for col, counts in other.counts.items():
+            if col in self.counts:
+                counts = self.counts[col].add(counts, fill_value=0)
+            if col in self.high_cardinality or col in other.high_cardinality or len(counts) > PROFILE_MAX_DISTINCT:
+                counts, cut = misra_gries(counts, PROFILE_HEAVY_HITTERS)
+                self.high_cardinality.add(col)
+                self.count_error[col] = self.count_error.get(col, 0) + other.count_error.get(col, 0) + cut
+            self.counts[col] = counts
+        for col, (n, mean, m2, vmin, vmax) in other.moments.items():
+            self._merge_moments(col, n, mean, m2, vmin, vmax)
+        for col, sketch in other.sketches.items():
+            if col in self.sketches:
+                self.sketches[col].merge(sketch)
+            else:
+                self.sketches[col] = sketch
+        self.comoments.merge(other.comoments)
+
+    def drain(self):
+        while self._pending:
+            self.merge(self._pending.popleft().result())
+
+    def _merge_moments(self, col, n, mean, m2, vmin, vmax):
+        if col not in self.moments:
+            self.moments[col] = [n, mean, m2, vmin, vmax]
+            return
+        count, old_mean, old_m2, old_min, old_max = self.moments[col]
+        total = count + n
+        delta = mean - old_mean
+        self.moments[col] = [
+            total,
+            old_mean + delta * n / total,
+            old_m2 + m2 + delta * delta * count * n / total,
+            min(old_min, vmin),
+            max(old_max, vmax),
+        ]
+
+    def finish(self, df, sampled=False, to_html=pd.DataFrame.to_html):
+        """Build the stored profile; `df` is the in-memory part of the dataset and
+        `to_html` renders the summary and head tables the way /analyze does"""
+        self.drain()
+        numeric_cols = [col for col in df.columns if is_numeric_column(df[col])]
+        if not numeric_cols:
+            quantiles = None
+        elif sampled:
+            # Sketched over every row rather than exact over the in-memory part
+            quantiles = pd.DataFrame({col: self.sketches[col].quantiles([0.25, 0.5, 0.75]) if col in self.sketches
+                                      else [float('nan')] * 3 for col in numeric_cols}, index=[0.25, 0.5, 0.75])
+        else:
+            quantiles = df[numeric_cols].quantile([0.25, 0.5, 0.75])
+        
+        stats = {}
+        describe = {}
+        value_counts = {}
+        heavy_hitters = {}
+        for col in df.columns:
+            count = self.rows - self.nulls.get(col, 0)
+            info = {"dtype": str(df[col].dtype), "count": count, "nulls": self.nulls.get(col, 0)}
+            summary = {"count": count}
+            
+            counts = self.counts.get(col)
+            if counts is not None and col not in self.high_cardinality:
+                counts = counts.astype('int64').sort_values(ascending=False, kind='stable')
+                value_counts[col] = count_dict(counts)
+                info["cardinality"] = len(counts)
+            elif counts is not None and sampled:
+                # Heavy hitters over every row; each count is low by at most countError
+                counts = counts.astype('int64').sort_values(ascending=False, kind='stable')
+                heavy_hitters[col] = count_dict(counts)
+                info["cardinality"] = None
+                info["cardinalityAtLeast"] = PROFILE_MAX_DISTINCT
+                info["countError"] = int(self.count_error.get(col, 0))
+            else:
+                # Too many distinct values to track while streaming; fall back to the in-memory rows
+                counts = df[col].value_counts()
+                info["cardinality"] = None
+                info["cardinalityAtLeast"] = PROFILE_MAX_DISTINCT
+            info["topValues"] = [{"value": to_python(value), "count": int(n)}
+                                 for value, n in counts.head(PROFILE_TOP_K).items()]
+            
+            if col in numeric_cols and col in self.moments:
+                n, mean, m2, vmin, vmax = self.moments[col]
+                std = (m2 / (n - 1)) ** 0.5 if n > 1 else float('nan')
+                numeric = {"mean": mean, "std": std, "min": vmin,
+                           "25%": to_python(quantiles.at[0.25, col]),
+                           "50%": to_python(quantiles.at[0.5, col]),
+                           "75%": to_python(quantiles.at[0.75, col]),
+                           "max": vmax}
+                summary.update(numeric)
+                info.update({k: (None if pd.isna(v) else v) for k, v in numeric.items()})
+            else:
+                summary["unique"] = info["cardinality"] if info["cardinality"] is not None else df[col].nunique()
+                if len(counts):
+                    summary["top"] = counts.index[0]
+                    summary["freq"] = int(counts.iloc[0])
+            describe[col] = summary
+            stats[col] = info
+        
+        # Same layout as df.describe(include='all')
+        order = ["count"]
+        if len(numeric_cols) < len(df.columns):
+            order += ["unique", "top", "freq"]
+        if numeric_cols:
+            order += ["mean", "std", "min", "25%", "50%", "75%", "max"]
+        describe_df = pd.DataFrame(describe, columns=list(df.columns)).reindex(order)
+        corr = self.comoments.correlation(numeric_cols)
+        
+        return {
+            "rows": self.rows,
+            "columns": list(df.columns),
+            "dtypes": df.dtypes.astype(str).to_dict(),
+            "missing": {col: self.nulls.get(col, 0) for col in df.columns},
+            "stats": stats,
+            "valueCounts": value_counts,
+            "approximateQuantiles": sampled,
+            "summaryHtml": to_html(describe_df),
+            "headHtml": to_html(self.head),
+            "heavyHitters": heavy_hitters,
+            # Pairwise over every row, like DataFrame.corr() on the whole file
+            "correlation": correlation_data(corr),
+        }
+
+
+def profile_chunk(chunk):
+    """Statistics of one chunk, ready to merge into a ProfileBuilder (runs in the profile processes)"""
+    part = ProfileBuilder()
+    part.head = chunk.head()
+    part.rows = len(chunk)
+    nulls = chunk.isna().sum()
+    numeric_cols = []
+    for col in chunk.columns:
+        series = chunk[col]
+        part.nulls[col] = int(nulls[col])
+        counts = series.value_counts()
+        if len(counts) > PROFILE_MAX_DISTINCT:
+            counts, part.count_error[col] = misra_gries(counts, PROFILE_HEAVY_HITTERS)
+            part.high_cardinality.add(col)
+        part.counts[col] = counts
+        
+        if is_numeric_column(series):
+            numeric_cols.append(col)
+            values = series.dropna()
+            if len(values):
+                part.moments[col] = [len(values), float(values.mean()),
+                                     float(((values - values.mean()) ** 2).sum()),
+                                     float(values.min()), float(values.max())]
+                part.sketches[col] = QuantileSketch()
+                part.sketches[col].add(values.to_numpy(dtype='float64'))
+    if numeric_cols:
+        part.comoments = CoMoments.from_frame(chunk[numeric_cols])
+    return part
+
+_profile_executor = None
+_profile_executor_lock = threading.Lock()
+
+def get_profile_executor():
+    """Process pool for chunk profiles, started on the first multi-chunk upload"""
+    global _profile_executor
+    if PROFILE_PROCESSES <= 0:
+        return None
+    with _profile_executor_lock:
+        if _profile_executor is None:
+            _profile_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=PROFILE_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _profile_executor
+
+def correlation_data(corr):
+    return {"type": "correlation", "columns": [str(c) for c in corr.columns],
+            "matrix": np.where(np.isnan(corr.to_numpy()), None, corr.to_numpy().round(6)).tolist()}
+
+def profile_answer(profile, action, column=None):
+    """Answer an /analyze action from the stored profile, or None when it cannot"""
+    if profile is None:
+        return None
+    if action == "summary":
+        return profile["summaryHtml"]
+    if action == "head":
+        return profile["headHtml"]
+    if action == "columns":
+        return profile["columns"]
+    if action == "missing":
+        return profile["missing"]
+    if action == "dtypes":
+        return profile["dtypes"]
+    if action == "profile":
+        return {"rows": profile["rows"], "approximateQuantiles": profile["approximateQuantiles"],
+                "columns": profile["stats"]}
+    if action == "value_counts" and column:
+        if column in profile["valueCounts"]:
+            return profile["valueCounts"][column]
+        # Profiles written before heavy hitters were tracked have no such key
+        counts = profile.get("heavyHitters", {}).get(column)
+        if counts is None:
+            return None
+        count_error = profile["stats"].get(column, {}).get("countError", 0)
+        if not count_error:
+            return counts
+        # Misra-Gries counts are lower bounds, each short by at most countError
+        return {"approximate": True, "countError": count_error, "counts": counts}
+    return None
@@ -0,0 +1,382 @@
+"""Uploaded datasets shared by the SQL editor and OneClick.
+
+Datasets live in memory within a shared budget, are persisted to an Arrow
+store that every worker process can attach, and are memory-mapped or spilled
+to disk when they do not fit.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.feather
+    import pyarrow.ipc
+except ImportError:  # Arrow persistence is optional
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# Registry settings: many uploaded datasets share one memory budget
+DATASET_MEMORY_BUDGET_MB = int(os.getenv("DATASET_MEMORY_BUDGET_MB", "2048"))
+DATASET_MAX_COUNT = int(os.getenv("DATASET_MAX_COUNT", "50"))
+# Uploads are persisted here as uncompressed Arrow IPC (Feather) files so they survive restarts
+DATASET_STORE_DIR = os.getenv("DATASET_STORE_DIR", "datasets")
+# Unset: a private temporary directory, made on the first spill and removed with its last file
+DATASET_SPILL_DIR = os.getenv("DATASET_SPILL_DIR")
+# Store file names are upload uuids; anything else in a request never reaches the filesystem
+DATASET_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def read_arrow(path, columns=None):
+    """Memory-map an Arrow IPC file and convert only the requested columns.
+
+    Store files hold a single record batch, so numeric columns without nulls
+    become read-only views of the mapped pages instead of copies; every worker
+    process reading the same dataset shares them through the page cache."""
+    table = pyarrow.feather.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+class DatasetEntry:
+    """An uploaded dataset; `df` is None while it lives only on disk"""
+
+    def __init__(self, dataset_id, name, nbytes, shape, sampled=False, uploaded_at=None):
+        self.id = dataset_id
+        self.name = name
+        self.df = None
+        self.nbytes = nbytes
+        self.shape = shape
+        self.sampled = sampled
+        self.uploaded_at = uploaded_at or time.time()
+        # Zero-row frame with the dataset's columns and dtypes
+        self.schema = None
+        # Arrow IPC file in the dataset store, memory-mapped on reload
+        self.store_path = None
+        # Pickle written on eviction when the frame could not be stored as Arrow
+        self.spill_path = None
+        self.profile_path = None
+        self._profile = None
+
+    @property
+    def profile(self):
+        # Profiles of datasets found in the store are only read when first needed
+        if self._profile is None and self.profile_path is not None:
+            with open(self.profile_path, encoding='utf-8') as f:
+                self._profile = json.load(f)
+        return self._profile
+
+    def info(self):
+        return {
+            "datasetId": self.id,
+            "name": self.name,
+            "shape": self.shape,
+            "bytes": self.nbytes,
+            "inMemory": self.df is not None,
+            "persisted": self.store_path is not None,
+            "spilled": self.spill_path is not None,
+            "sampled": self.sampled,
+            "uploadedAt": self.uploaded_at,
+        }
+
+
+class DatasetRegistry:
+    """Keeps uploaded datasets by id under one memory budget.
+
+    Every upload is written to the store as an Arrow IPC file. When the budget
+    is exceeded the least recently used DataFrames are dropped from memory
+    (frames that could not be stored as Arrow are pickled to the spill
+    directory first) and read back, memory-mapped and only for the columns an
+    action needs, when next used. Datasets in the store are registered again
+    on startup without reading their data.
+
+    The store is also how uvicorn worker processes share datasets: an id this
+    process has not seen is attached from the store on first use, the newest
+    upload of any worker is recorded in the store's `latest` file, and entries
+    whose files another worker removed are forgotten.
+    """
+
+    def __init__(self, budget_bytes, store_dir, spill_dir, max_count):
+        self.budget_bytes = budget_bytes
+        self.store_dir = store_dir
+        self.spill_dir = spill_dir
+        self._own_spill_dir = None
+        self.max_count = max_count
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.latest_id = None
+        self.memory_bytes = 0
+        self.spills = 0
+        self.reloads = 0
+        self.column_reads = 0
+        self.attaches = 0
+        self._latest_path = os.path.join(store_dir, 'latest')
+
+    def add(self, name, df, profile, sampled=False):
+        entry = DatasetEntry(uuid.uuid4().hex, name, int(df.memory_usage(deep=True).sum()),
+                             list(df.shape), sampled)
+        entry.df = df
+        entry.schema = df.head(0)
+        entry._profile = profile
+        self._persist(entry, df, profile)
+        if entry.store_path is not None:
+            self._publish_latest(entry.id)
+        with self._lock:
+            self._entries[entry.id] = entry
+            self.memory_bytes += entry.nbytes
+            self.latest_id = entry.id
+            while len(self._entries) > self.max_count:
+                self._drop(next(iter(self._entries)))
+            self._enforce_budget(keep=entry.id)
+        return entry
+
+    def load_store(self):
+        """Register the datasets persisted by earlier runs (metadata only)"""
+        found = self.sync()
+        with self._lock:
+            if self._entries:
+                self.latest_id = max(self._entries.values(), key=lambda e: e.uploaded_at).id
+            while len(self._entries) > self.max_count:
+                self._drop(next(iter(self._entries)))
+        return found
+
+    def sync(self):
+        """Attach the datasets other workers added to the store and forget the
+        ones they removed; returns how many were attached"""
+        try:
+            filenames = os.listdir(self.store_dir)
+        except OSError:
+            filenames = []
+        stored = {f[:-len('.meta.json')] for f in filenames if f.endswith('.meta.json')}
+        with self._lock:
+            for dataset_id in [d for d, entry in self._entries.items()
+                               if entry.store_path is not None and d not in stored]:
+                self._forget(dataset_id)
+            missing = stored - self._entries.keys()
+        found = [entry for entry in map(self._read_entry, sorted(missing)) if entry is not None]
+        with self._lock:
+            for entry in sorted(found, key=lambda e: e.uploaded_at):
+                self._entries.setdefault(entry.id, entry)
+            self.attaches += len(found)
+        return len(found)
+
+    def get(self, dataset_id=None):
+        """Return the entry (DataFrame possibly still on disk), or None for unknown ids"""
+        with self._lock:
+            dataset_id = dataset_id or self._latest()
+            entry = self._entries.get(dataset_id)
+            if entry is not None and entry.store_path is not None and not os.path.exists(entry.store_path):
+                # Removed by another worker
+                self._forget(dataset_id)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(dataset_id)
+                return entry
+        return self._attach(dataset_id) if dataset_id else None
+
+    def schema(self, entry):
+        """Zero-row frame with the dataset's columns and dtypes, without reading any rows"""
+        if entry.schema is None:
+            if entry.store_path is not None:
+                with pa.memory_map(entry.store_path) as source:
+                    entry.schema = pa.ipc.open_file(source).schema.empty_table().to_pandas()
+            else:
+                entry.schema = self.frame(entry).head(0)
+        return entry.schema
+
+    def frame(self, entry, columns=None):
+        """The entry's DataFrame, or just `columns` of it, read back from disk if necessary"""
+        with self._lock:
+            df = entry.df
+            if df is not None:
+                return df if columns is None else df[columns]
+            if columns is not None and entry.store_path is not None:
+                # Partial reads are served straight from the memory map and not kept
+                self.column_reads += 1
+                return read_arrow(entry.store_path, columns)
+            df = entry.df = self._reload(entry)
+            self.memory_bytes += entry.nbytes
+            self.reloads += 1
+            self._enforce_budget(keep=entry.id)
+            return df if columns is None else df[columns]
+
+    def remove(self, dataset_id):
+        with self._lock:
+            if dataset_id not in self._entries and self._attach(dataset_id) is None:
+                return False
+            self._drop(dataset_id)
+            return True
+
+    def list(self):
+        self.sync()
+        with self._lock:
+            return [entry.info() for entry in reversed(self._entries.values())]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "datasets": len(self._entries),
+                "inMemory": sum(1 for entry in self._entries.values() if entry.df is not None),
+                "memoryBytes": self.memory_bytes,
+                "budgetBytes": self.budget_bytes,
+                "spills": self.spills,
+                "reloads": self.reloads,
+                "columnReads": self.column_reads,
+                "attaches": self.attaches,
+            }
+
+    def _persist(self, entry, df, profile):
+        if pa is None:
+            return
+        base = os.path.join(self.store_dir, entry.id)
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            # Uncompressed and one record batch so readers can map columns zero-copy
+            df.to_feather(base + '.arrow.tmp', compression='uncompressed', chunksize=max(len(df), 1))
+            os.replace(base + '.arrow.tmp', base + '.arrow')
+            with open(base + '.profile.json', 'w', encoding='utf-8') as f:
+                json.dump(profile, f, default=str)
+            # Written last and renamed into place: other workers attach once it exists
+            with open(base + '.meta.json.tmp', 'w', encoding='utf-8') as f:
+                json.dump({"id": entry.id, "name": entry.name, "bytes": entry.nbytes,
+                           "shape": entry.shape, "sampled": entry.sampled,
+                           "uploadedAt": entry.uploaded_at}, f)
+            os.replace(base + '.meta.json.tmp', base + '.meta.json')
+        except Exception as e:
+            # e.g. mixed-type object columns; the dataset then lives in memory/spill only
+            logger.warning(f"Could not persist dataset {entry.id}: {str(e)}")
+            for suffix in ('.arrow.tmp', '.arrow', '.profile.json', '.meta.json.tmp'):
+                if os.path.exists(base + suffix):
+                    os.unlink(base + suffix)
+            return
+        entry.store_path = base + '.arrow'
+        entry.profile_path = base + '.profile.json'
+
+    def _publish_latest(self, dataset_id):
+        tmp = f"{self._latest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(dataset_id)
+            os.replace(tmp, self._latest_path)
+        except OSError:
+            pass
+
+    def _latest(self):
+        # The newest upload of any worker, unless it has been removed since
+        try:
+            with open(self._latest_path, encoding='utf-8') as f:
+                latest = f.read().strip()
+        except OSError:
+            return self.latest_id
+        if latest in self._entries or os.path.exists(os.path.join(self.store_dir, latest + '.meta.json')):
+            return latest
+        return self.latest_id
+
+    def _read_entry(self, dataset_id):
+        base = os.path.join(self.store_dir, dataset_id)
+        try:
+            with open(base + '.meta.json', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(base + '.arrow'):
+            return None
+        entry = DatasetEntry(meta["id"], meta["name"], meta["bytes"], meta["shape"],
+                             meta.get("sampled", False), meta.get("uploadedAt"))
+        entry.store_path = base + '.arrow'
+        if os.path.exists(base + '.profile.json'):
+            entry.profile_path = base + '.profile.json'
+        return entry
+
+    def _attach(self, dataset_id):
+        """Register a dataset another worker wrote to the store (metadata only)"""
+        if not DATASET_ID.fullmatch(dataset_id):
+            return None
+        entry = self._read_entry(dataset_id)
+        if entry is None:
+            return None
+        with self._lock:
+            if entry.id not in self._entries:
+                self._entries[entry.id] = entry
+                self.attaches += 1
+            return self._entries[entry.id]
+
+    def _enforce_budget(self, keep):
+        # Oldest first; the dataset being served always stays in memory
+        for entry in list(self._entries.values()):
+            if self.memory_bytes <= self.budget_bytes:
+                break
+            if entry.id != keep and entry.df is not None:
+                self._spill(entry)
+
+    def _spill(self, entry):
+        if entry.store_path is None and entry.spill_path is None:
+            entry.spill_path = os.path.join(self._spill_directory(), entry.id + ".pkl.gz")
+            entry.df.to_pickle(entry.spill_path)
+            self.spills += 1
+        entry.df = None
+        self.memory_bytes -= entry.nbytes
+
+    def _spill_directory(self):
+        if self.spill_dir is not None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            return self.spill_dir
+        if self._own_spill_dir is None:
+            self._own_spill_dir = tempfile.mkdtemp(prefix="uniq-spill-")
+        return self._own_spill_dir
+
+    def _discard_spill(self, entry):
+        try:
+            os.unlink(entry.spill_path)
+        except OSError:
+            pass
+        entry.spill_path = None
+        # A private directory goes with its last file
+        if self._own_spill_dir is not None and not any(e.spill_path for e in self._entries.values()):
+            shutil.rmtree(self._own_spill_dir, ignore_errors=True)
+            self._own_spill_dir = None
+
+    def close(self):
+        """Remove this process's spill files (the store is left for the next run)"""
+        with self._lock:
+            for entry in list(self._entries.values()):
+                if entry.spill_path is not None:
+                    if entry.df is None:
+                        self._forget(entry.id)
+                    else:
+                        self._discard_spill(entry)
+
+    def _reload(self, entry):
+        if entry.store_path is not None:
+            return read_arrow(entry.store_path)
+        return pd.read_pickle(entry.spill_path)
+
+    def _forget(self, dataset_id):
+        # Only this process's view; the store files are left alone
+        entry = self._entries.pop(dataset_id)
+        if entry.df is not None:
+            self.memory_bytes -= entry.nbytes
+        if entry.spill_path is not None:
+            self._discard_spill(entry)
+        if self.latest_id == dataset_id:
+            self.latest_id = next(reversed(self._entries), None)
+        return entry
+
+    def _drop(self, dataset_id):
+        entry = self._forget(dataset_id)
+        if entry.store_path is not None:
+            base = entry.store_path[:-len('.arrow')]
+            # Metadata first, so no other worker attaches a half-deleted dataset
+            for path in (base + '.meta.json', entry.store_path, base + '.profile.json'):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
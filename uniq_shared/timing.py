@@ -0,0 +1,179 @@
+"""Request timing and Prometheus metrics shared by the UniQ apps.
+
+Stages recorded while a request runs end up in its Server-Timing header and
+in the histograms served on /metrics.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+
+from uniq_shared.lazy import lazy_import_seconds
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+BYTE_BUCKETS = (256, 1024, 4096, 16_384, 65_536, 262_144, 1_048_576, 4_194_304, 16_777_216)
+
+
+class RequestTiming:
+    """Stages and row count of the request being served"""
+
+    def __init__(self):
+        self.stages = []
+        self.rows = None
+
+
+request_timing = contextvars.ContextVar("request_timing", default=None)
+
+
+def record_stage(stage, seconds):
+    timing = request_timing.get()
+    if timing is not None:
+        timing.stages.append((stage, seconds))
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Time a block (or, as a decorator, a function) as one stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def record_rows(rows):
+    timing = request_timing.get()
+    if timing is not None:
+        timing.rows = rows
+
+
+def collect_stages(fn, *args):
+    """Run fn in a worker process and hand its stages back with the result"""
+    timing = RequestTiming()
+    request_timing.set(timing)
+    return fn(*args), timing.stages
+
+
+class Histogram:
+    """Prometheus histogram with labels"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{format_labels(key, le=bound)} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(key, le='+Inf')} {series['count']}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{format_labels(key)} {series['count']}")
+        return lines
+
+
+def format_labels(key, **extra):
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+REQUEST_SECONDS = Histogram("uniq_request_duration_seconds", "Request latency by route", LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram("uniq_stage_duration_seconds", "Time spent per request stage", LATENCY_BUCKETS)
+ANALYZE_SECONDS = Histogram("uniq_analyze_duration_seconds", "/analyze latency by action", LATENCY_BUCKETS)
+RESPONSE_BYTES = Histogram("uniq_response_bytes", "Response body size by route", BYTE_BUCKETS)
+ANALYZE_BYTES = Histogram("uniq_analyze_response_bytes", "/analyze response size by action", BYTE_BUCKETS)
+RESULT_ROWS = Histogram("uniq_result_rows", "Rows returned or ingested per request", ROW_BUCKETS)
+HISTOGRAMS = (REQUEST_SECONDS, STAGE_SECONDS, ANALYZE_SECONDS, RESPONSE_BYTES, ANALYZE_BYTES, RESULT_ROWS)
+
+
+def server_timing(stages, total):
+    """Server-Timing header value; repeated stages (e.g. one per chunk) are summed"""
+    totals = OrderedDict()
+    for stage, seconds in stages:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def add_timing_middleware(app, startup_state, import_started):
+    """Time every request of `app`; the first response also records how long
+    the worker took from `import_started` to serve it"""
+
+    @app.middleware("http")
+    async def time_requests(request, call_next):
+        timing = RequestTiming()
+        token = request_timing.set(timing)
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            request_timing.reset(token)
+        total = time.perf_counter() - started
+        if startup_state["firstResponseSeconds"] is None:
+            startup_state["firstResponseSeconds"] = round(time.perf_counter() - import_started, 3)
+        route = request.scope.get("route")
+        # Unmatched paths share one label so scanners cannot blow up the series count
+        path = route.path if route is not None else "unmatched"
+        response.headers["Server-Timing"] = server_timing(timing.stages, total)
+
+        REQUEST_SECONDS.observe(total, route=path, method=request.method, status=response.status_code)
+        for stage, seconds in timing.stages:
+            STAGE_SECONDS.observe(seconds, route=path, stage=stage)
+        size = response.headers.get("content-length")
+        if size is not None:
+            RESPONSE_BYTES.observe(int(size), route=path)
+        if timing.rows is not None:
+            RESULT_ROWS.observe(timing.rows, route=path)
+        if path == "/analyze":
+            action = request.query_params.get("action", "")
+            mode = request.query_params.get("mode", "png")
+            ANALYZE_SECONDS.observe(total, action=action, mode=mode, status=response.status_code)
+            if size is not None:
+                ANALYZE_BYTES.observe(int(size), action=action, mode=mode)
+        return response
+
+    return time_requests
+
+
+def metrics_text(gauges, startup_state):
+    """Prometheus text exposition: the request histograms, then `gauges` as
+    (name, kind, help, value, labels) tuples, the startup timings and lazy imports"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+    gauges = list(gauges)
+    for key, metric in (("importSeconds", "uniq_import_seconds"), ("warmupSeconds", "uniq_warmup_seconds"),
+                        ("firstResponseSeconds", "uniq_first_response_seconds")):
+        if startup_state[key] is not None:
+            gauges.append((metric, "gauge", f"Startup timing: {key}", startup_state[key], {}))
+    for module, seconds in list(lazy_import_seconds.items()):
+        gauges.append(("uniq_lazy_import_seconds", "gauge", "Time to import a lazily loaded module", seconds, {"module": module}))
+    described = set()
+    for name, kind, help_text, value, labels in gauges:
+        if name not in described:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            described.add(name)
+        lines.append(f"{name}{format_labels(tuple(labels.items()))} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,92 @@
+"""Chunked upload parsing and upload progress shared by the UniQ apps.
+
+Progress is kept per process and mirrored into the dataset store, so any
+worker can answer a poll for an upload another worker is handling.
+"""
+import json
+import os
+import re
+
+import pandas as pd
+
+from uniq_shared.store import DATASET_STORE_DIR
+
+# Chunked upload parsing settings
+UPLOAD_PARSE_CHUNK_ROWS = int(os.getenv("UPLOAD_PARSE_CHUNK_ROWS", "50000"))
+UPLOAD_MEMORY_LIMIT_MB = int(os.getenv("UPLOAD_MEMORY_LIMIT_MB", "1024"))
+MAX_TRACKED_UPLOADS = 100
+
+# upload_id -> progress of uploads that are running or recently finished
+upload_progress = {}
+UPLOAD_ID = re.compile(r"[\w-]{1,64}")
+
+def progress_path(upload_id):
+    if not UPLOAD_ID.fullmatch(upload_id):
+        return None
+    return os.path.join(DATASET_STORE_DIR, "progress", upload_id + ".json")
+
+def publish_progress(progress):
+    path = progress_path(progress["uploadId"])
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(progress, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+def shared_progress(upload_id):
+    """Progress of an upload another worker process is handling, if any"""
+    path = progress_path(upload_id)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (TypeError, OSError, ValueError):
+        return None
+
+def forget_progress(upload_id):
+    upload_progress.pop(upload_id, None)
+    path = progress_path(upload_id)
+    if path is not None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def iter_upload_frames(file):
+    """Yield the uploaded file as DataFrame chunks, reading the spooled file
+    directly instead of copying it into memory first"""
+    file.file.seek(0)
+    if file.filename.endswith('.csv'):
+        yield from pd.read_csv(file.file, chunksize=UPLOAD_PARSE_CHUNK_ROWS)
+    else:
+        # Excel workbooks cannot be parsed incrementally by pandas
+        yield pd.read_excel(file.file)
+
+def start_upload_progress(upload_id, filename, total_bytes):
+    progress = {
+        "uploadId": upload_id,
+        "filename": filename,
+        "status": "parsing",
+        "bytesRead": 0,
+        "totalBytes": total_bytes,
+        "percent": 0.0,
+        "rows": 0,
+    }
+    upload_progress[upload_id] = progress
+    while len(upload_progress) > MAX_TRACKED_UPLOADS:
+        forget_progress(next(iter(upload_progress)))
+    publish_progress(progress)
+    return progress
+
+def update_upload_progress(progress, file, rows):
+    try:
+        progress["bytesRead"] = file.file.tell()
+    except (OSError, ValueError):
+        pass
+    if progress["totalBytes"]:
+        progress["percent"] = round(min(100.0, 100.0 * progress["bytesRead"] / progress["totalBytes"]), 1)
+    progress["rows"] = rows
+    publish_progress(progress)